@@ -0,0 +1,5 @@
+"""
+plexdevices benchmarks
+
+Run from the repository root, e.g. ``python -m benchmarks.keepalive``.
+"""
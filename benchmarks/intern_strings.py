@@ -0,0 +1,49 @@
+"""
+Memory kept per parsed item, and parse time, of ``SAMPLE_MOVIES`` scaled
+up to the requested number of elements, with the strings of the parsed
+dictionaries shared through :data:`plexdevices.utils.strings` and without.
+The XML document is parsed, and so is the same container as JSON.
+
+    python -m benchmarks.intern_strings [elements]
+"""
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import plexdevices.utils
+from benchmarks.parse_xml import document
+
+
+def measure(label, body, content_type, table):
+    plexdevices.utils.strings = table
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = plexdevices.utils.parse_response(body, content_type)
+    elapsed = time.perf_counter() - start
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    items = len(data['_children'])
+    print('{:<20} {:>8.0f} bytes/item  {:>6.2f} s'.format(
+        label, current / float(items), elapsed))
+    return data
+
+
+def main(elements=200000):
+    table = plexdevices.utils.strings
+    xml = document(elements)
+    js = json.dumps(plexdevices.utils.parse_response(xml)).encode('utf-8')
+    try:
+        for kind, body, content_type in (('xml', xml, 'text/xml'),
+                                         ('json', js, 'application/json')):
+            measure(kind, body, content_type, None)
+            measure(kind + ' interned', body, content_type,
+                    plexdevices.utils.InternTable())
+    finally:
+        plexdevices.utils.strings = table
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
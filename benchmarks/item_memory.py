@@ -0,0 +1,47 @@
+"""
+Bytes per item of a fully built library section: items with their values
+in dictionaries, and with ``Server.compact`` storing them in shared-key
+:obj:`CompactDict <plexdevices.utils.CompactDict>` s. The parsed data of
+each item is counted with it.
+
+    python -m benchmarks.item_memory [items]
+"""
+import gc
+import sys
+import tracemalloc
+
+import plexdevices
+from benchmarks.stream_memory import library
+
+
+def build(xml, compact=False):
+    server = plexdevices.device.create_device({'provides': 'server',
+                                               '_children': []})
+    server.compact = compact
+    container = plexdevices.media.MediaContainer(
+        server, server._compact(plexdevices.utils.parse_response(xml)))
+    for item in container.children:
+        for x in item.media:
+            x.parts
+    return container
+
+
+def measure(label, xml, count, **kwargs):
+    gc.collect()
+    tracemalloc.start()
+    container = build(xml, **kwargs)
+    gc.collect()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('{:<20} {:>8.0f} bytes/item'.format(label, current / float(count)))
+    return container
+
+
+def main(count=20000):
+    xml = library(count)[0]
+    measure('dict items', xml, count)
+    measure('compact items', xml, count, compact=True)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
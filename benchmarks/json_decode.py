@@ -0,0 +1,44 @@
+"""
+Decode throughput of each installed JSON backend on library section
+containers of a few sizes, decoded from the response bytes as
+:func:`parse_response <plexdevices.utils.parse_response>` does.
+
+    python -m benchmarks.json_decode [items]
+"""
+import sys
+import time
+
+import plexdevices.jsonlib
+from benchmarks.stream_memory import library
+
+
+def throughput(backend, body, seconds=1.0):
+    """Megabytes decoded per second."""
+    count = 0
+    start = time.perf_counter()
+    while True:
+        backend.loads(body)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count * len(body) / elapsed / 2.0 ** 20
+
+
+def main(items=2000):
+    backends = plexdevices.jsonlib.available()
+    print('selected: {}'.format(plexdevices.jsonlib.backend().name))
+    for count in (50, items):
+        body = library(count)[1]
+        print('{} items, {:.1f} KB'.format(count, len(body) / 1024.0))
+        rates = []
+        for backend in backends:
+            assert backend.loads(body) == plexdevices.jsonlib.loads(body)
+            rates.append((backend.name, throughput(backend, body)))
+        stdlib = dict(rates)['json']
+        for name, rate in rates:
+            print('  {:<12} {:>8.1f} MB/s  {:>5.2f}x json'.format(
+                name, rate, rate / stdlib))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
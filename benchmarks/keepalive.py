@@ -0,0 +1,39 @@
+"""
+Requests per second through :meth:`Device.request` with the pooled keep-alive
+transport, compared to one-shot :func:`requests.request` calls, against a
+local stand-in server.
+
+    python -m benchmarks.keepalive [requests]
+"""
+import sys
+import time
+
+import requests
+
+import plexdevices
+from tests.stub_server import StubServer, server_data
+
+BODY = b'{"_elementType": "MediaContainer", "size": "0"}'
+
+
+def run(label, func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = time.perf_counter() - start
+    print('{:<12} {:>8.0f} req/s'.format(label, count / elapsed))
+
+
+def main(count=2000):
+    routes = {'/library/sections': (
+        200, {'Content-Type': 'application/json'}, BODY)}
+    with StubServer(routes) as stub:
+        server = plexdevices.device.create_device(server_data(stub))
+        url = 'http://{}:{}/library/sections'.format(stub.address, stub.port)
+        run('one-shot', lambda: requests.request('GET', url), count)
+        run('pooled', lambda: server.request('/library/sections'), count)
+        server.close()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
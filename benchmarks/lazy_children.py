@@ -0,0 +1,41 @@
+"""
+Time and memory of building a MediaContainer from an already parsed
+library section, and of then reading its first page of items or all of
+them. The items are built only when they are accessed.
+
+    python -m benchmarks.lazy_children [items]
+"""
+import copy
+import sys
+import time
+import tracemalloc
+
+import plexdevices
+from benchmarks.stream_memory import library
+
+
+def measure(label, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<24} peak {:>8.1f} MB  {:>8.1f} ms'.format(
+        label, peak / 2.0 ** 20, elapsed * 1000))
+    return result
+
+
+def main(count=50000):
+    data = plexdevices.utils.parse_response(library(count)[0])
+    container = measure('construct', lambda: plexdevices.media.MediaContainer(
+        None, copy.copy(data)))
+    measure('len', lambda: len(container))
+    measure('first 20 items', lambda: [x.media[0].parts[0].key
+                                       for x in container.children[:20]])
+    measure('all items', lambda: [x.media[0].parts[0].key
+                                  for x in container.children])
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
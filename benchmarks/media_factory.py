@@ -0,0 +1,108 @@
+"""
+Throughput of building a MediaContainer of 100k children and resolving the
+class of each of them, with the ``if``/``elif`` :func:`media_factory
+<plexdevices.factory.media_factory>` and per-call ``get_type`` dictionary
+that were used before, and with the dispatch index.
+
+    python -m benchmarks.media_factory [items]
+"""
+import sys
+import time
+
+import plexdevices
+from plexdevices.types import PlexType
+
+_NAMES = {getattr(PlexType, x): x for x in dir(PlexType) if x.isupper()}
+# ``types.get_type`` as it was: the dictionary literal is built on every
+# call.
+exec('def get_type(type_str):\n'
+     '    try:\n'
+     '        return {' + ', '.join(
+         '{!r}: PlexType.{}'.format(k, _NAMES[v])
+         for k, v in plexdevices.types._TYPES.items()) + '}[type_str]\n'
+     '    except KeyError:\n'
+     '        return PlexType.UNKNOWN\n')
+
+
+def chained_factory(data):
+    """``factory.media_factory`` as it was."""
+    media = plexdevices.media
+    if 'settings' in data:
+        t = get_type('prefs')
+    elif 'search' in data:
+        t = get_type('input')
+    else:
+        t = get_type(data.get('type', 'unknown'))
+    if data['_elementType'] == 'Directory':
+        if 'ratingKey' in data:
+            if t == PlexType.SEASON:
+                return media.Season
+            elif t == PlexType.SHOW:
+                return media.Show
+            elif t == PlexType.ARTIST:
+                return media.Artist
+            elif t == PlexType.ALBUM:
+                return media.Album
+            elif t == PlexType.PHOTO:
+                return media.PhotoAlbum
+            else:
+                return media.Directory
+        else:
+            if t == PlexType.PREFERENCES:
+                return media.PreferencesDirectory
+            elif t == PlexType.INPUT:
+                return media.InputDirectory
+            else:
+                return media.Directory
+    elif data['_elementType'] in ['Video', 'Track', 'Photo']:
+        if t == PlexType.EPISODE:
+            return media.Episode
+        elif t == PlexType.MOVIE:
+            return media.Movie
+        elif t == PlexType.TRACK:
+            return media.Track
+        elif t == PlexType.PHOTO:
+            return media.Photo
+        elif t == PlexType.CLIP:
+            return media.VideoClip
+    elif data['_elementType'] == 'Hub':
+        return plexdevices.hubs.Hub
+    return None
+
+
+def children(count):
+    kinds = [('Video', 'movie'), ('Video', 'episode'), ('Track', 'track'),
+             ('Directory', 'season'), ('Directory', 'show'),
+             ('Photo', 'photo')]
+    return [{'_elementType': kinds[i % len(kinds)][0], 'ratingKey': str(i),
+             'type': kinds[i % len(kinds)][1], 'title': str(i)}
+            for i in range(count)]
+
+
+def measure(label, factory, items):
+    saved = plexdevices.factory.media_factory
+    plexdevices.factory.media_factory = factory
+    try:
+        start = time.perf_counter()
+        container = plexdevices.media.MediaContainer(
+            None, {'_elementType': 'MediaContainer',
+                   '_children': list(items)})
+        len(container)
+        classified = time.perf_counter() - start
+        for item in container:
+            pass
+        built = time.perf_counter() - start
+    finally:
+        plexdevices.factory.media_factory = saved
+    print('{:<14} classify {:>10.0f} items/s  build {:>10.0f} items/s'.format(
+        label, len(items) / classified, len(items) / built))
+
+
+def main(count=100000):
+    items = children(count)
+    measure('if/elif', chained_factory, items)
+    measure('dispatch index', plexdevices.factory.media_factory, items)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,77 @@
+"""
+Time and peak memory of converting an XML container into dictionaries: the
+former recursive ``parse_xml``, the iterative :func:`parse_xml
+<plexdevices.utils.parse_xml>` over a parsed tree, and
+:func:`parse_xml_document <plexdevices.utils.parse_xml_document>`. The
+document repeats the movies of ``tests/xml_samples.py`` until it holds the
+requested number of elements.
+
+    python -m benchmarks.parse_xml [elements]
+"""
+import re
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import plexdevices.utils
+from tests.xml_samples import SAMPLE_MOVIES
+
+VIDEO = re.compile(r'<Video .*?</Video>', re.S)
+
+
+def document(elements):
+    """SAMPLE_MOVIES with its videos repeated to reach ``elements``."""
+    videos = VIDEO.findall(SAMPLE_MOVIES)
+    per_video = sum(len(ET.fromstring(x).findall('.//*')) + 1
+                    for x in videos) / float(len(videos))
+    count = int(elements / per_video) + 1
+    body = ''.join(videos[i % len(videos)] for i in range(count))
+    head, tail = SAMPLE_MOVIES.split(videos[0], 1)[0], '</MediaContainer>'
+    return (head + body + tail).encode('utf-8')
+
+
+def recursive(root):
+    """``parse_xml`` as it was, with ``list()`` for the removed
+    ``getchildren()``."""
+    children = list(root)
+    x = {k: v for k, v in root.items()}
+    x['_elementType'] = root.tag
+    if len(children):
+        x['_children'] = [recursive(child) for child in children]
+    return x
+
+
+def measure(label, func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('{:<28} best {:>6.3f} s  peak {:>7.1f} MB'.format(
+        label, min(times), peak / 2.0 ** 20))
+    return min(times)
+
+
+def main(elements=50000):
+    xml = document(elements)
+    print('{} elements, {:.1f} MB'.format(
+        len(ET.fromstring(xml).findall('.//*')) + 1, len(xml) / 2.0 ** 20))
+    assert (recursive(ET.fromstring(xml)) ==
+            plexdevices.utils.parse_xml(ET.fromstring(xml)) ==
+            plexdevices.utils.parse_xml_document(xml))
+    old = measure('recursive parse_xml',
+                  lambda: recursive(ET.fromstring(xml)))
+    measure('iterative parse_xml',
+            lambda: plexdevices.utils.parse_xml(ET.fromstring(xml)))
+    new = measure('parse_xml_document',
+                  lambda: plexdevices.utils.parse_xml_document(xml))
+    print('parse_xml_document is {:.2f}x as fast'.format(old / new))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
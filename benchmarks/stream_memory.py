@@ -0,0 +1,93 @@
+"""
+Peak memory of building a MediaContainer from a synthetic 100k-item library
+section, buffered (:meth:`Server.media_container`) versus streamed
+(``streaming=True``), and of only iterating the streamed items.
+
+    python -m benchmarks.stream_memory [items]
+"""
+import gc
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import plexdevices
+from tests.stub_server import StubServer, server_data
+
+ITEM = ('<Video ratingKey="{0}" key="/library/metadata/{0}" type="movie" '
+        'title="Movie {0}" summary="A synthetic movie used to measure memory '
+        'use while parsing." rating="6.4" year="2016" '
+        'thumb="/library/metadata/{0}/thumb/1461391829" '
+        'art="/library/metadata/{0}/art/1461391829" duration="6580330" '
+        'originallyAvailableAt="2016-04-16" addedAt="1461184129" '
+        'updatedAt="1461391829">'
+        '<Media videoResolution="720" id="{0}" duration="6580330" '
+        'bitrate="3240" width="1280" height="718" aspectRatio="1.78" '
+        'audioChannels="6" audioCodec="ac3" videoCodec="h264" container="mkv" '
+        'videoFrameRate="24p" videoProfile="high">'
+        '<Part id="{0}" key="/library/parts/{0}/file.mkv" duration="6580330" '
+        'file="/movies/Movie {0}/Movie {0}.mkv" size="2664781625" '
+        'container="mkv" videoProfile="high" /></Media>'
+        '<Genre tag="Drama" /><Director tag="Someone" /></Video>')
+
+
+def library(count):
+    items = ''.join(ITEM.format(i) for i in range(count))
+    xml = ('<?xml version="1.0" encoding="UTF-8"?>'
+           '<MediaContainer size="{0}" totalSize="{0}" '
+           'identifier="com.plexapp.plugins.library">{1}</MediaContainer>'
+           ).format(count, items).encode()
+    children = plexdevices.utils.iter_xml(io.BytesIO(xml))
+    data = next(children)
+    data['_children'] = list(children)
+    return xml, json.dumps(data).encode()
+
+
+def measure(label, func):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<24} peak {:>8.1f} MB  kept {:>8.1f} MB  {:>6.2f} s'.format(
+        label, peak / 2.0 ** 20, current / 2.0 ** 20, elapsed))
+    return result
+
+
+def main(count=100000):
+    xml, js = library(count)
+
+    def handler(request):
+        json_wanted = 'json' in request.headers.get('Accept', '')
+        body = js if json_wanted else xml
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json' if json_wanted
+                            else 'text/xml;charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    with StubServer({'/library/sections/1/all': handler}) as stub:
+        server = plexdevices.device.create_device(server_data(stub))
+        server.request('/')
+        endpoint = '/library/sections/1/all'
+        container = measure('buffered container',
+                            lambda: server.media_container(endpoint))
+        del container
+        container = measure('streamed container',
+                            lambda: server.media_container(endpoint,
+                                                           streaming=True))
+        del container
+
+        def iterate():
+            data = server.stream_container(endpoint)
+            return sum(1 for _ in data['_children'])
+        measure('streamed iteration', iterate)
+        server.close()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
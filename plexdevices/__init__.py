@@ -3,7 +3,8 @@ __version__ = '0.4.2'
 __author__ = 'Cory Parsons'
 
 from plexdevices.exceptions import (DeviceConnectionsError, PlexTVError,
-                                    RemoteCallbackError)
+                                    RemoteCallbackError, DownloadError,
+                                    ParseError)
 from plexdevices.api import create_session, create_remote, create_play_queue
 
 # Set default logging handler to avoid "No handler found" warnings.
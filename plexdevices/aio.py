@@ -0,0 +1,401 @@
+"""
+asyncio counterparts of :class:`Session <plexdevices.session.Session>` and
+:class:`Server <plexdevices.device.Server>`. Requires `aiohttp`_.
+
+All the requests made through one :class:`AsyncSession` share a single
+:obj:`aiohttp.ClientSession` and its connection pool. The containers returned
+are the usual :obj:`MediaContainer <plexdevices.media.MediaContainer>` and
+:obj:`HubsContainer <plexdevices.hubs.HubsContainer>` objects, bound to the
+blocking :obj:`Server <plexdevices.device.Server>`, so their items keep
+working as before.
+
+.. _aiohttp: https://docs.aiohttp.org/
+
+"""
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+import plexdevices.device
+import plexdevices.exceptions
+import plexdevices.hubs
+import plexdevices.media
+import plexdevices.session
+import plexdevices.utils
+log = logging.getLogger(__name__)
+
+
+def client_session(limit=100, limit_per_host=10):
+    """Create an :obj:`aiohttp.ClientSession` with a keep-alive connection
+    pool of the given size."""
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+        limit=limit, limit_per_host=limit_per_host))
+
+
+try:
+    #: A slow response, which is not a reason to change connections.
+    _READ_TIMEOUTS = (aiohttp.SocketTimeoutError,)
+except AttributeError:  # aiohttp < 3.10
+    _READ_TIMEOUTS = ()
+
+
+def _timeout(timeout):
+    return None if timeout is None else aiohttp.ClientTimeout(total=timeout)
+
+
+def _strings(mapping):
+    """aiohttp only accepts strings in headers and query parameters."""
+    if mapping is None:
+        return None
+    return {k: str(v) for k, v in mapping.items() if v is not None}
+
+
+class AsyncServer(object):
+    """Non-blocking access to a :obj:`Server <plexdevices.device.Server>`.
+    Attributes not defined here are read from the wrapped server.
+
+    Args:
+        server (:obj:`Server <plexdevices.device.Server>`): the server.
+        session (:obj:`AsyncSession`, optional): the session whose connection
+            pool is used. The server makes its own when it is not given.
+
+    """
+
+    def __init__(self, server, session=None):
+        #: The wrapped :obj:`Server <plexdevices.device.Server>`.
+        self.server = server
+        self._session = session
+        self._http = None
+        self._selecting = None
+
+    def __getattr__(self, name):
+        return getattr(self.server, name)
+
+    def __repr__(self):
+        return '<{}:{} - {}>'.format(self.__class__.__name__, self.name,
+                                     self.product)
+
+    @property
+    def http(self):
+        """:obj:`aiohttp.ClientSession` used for every request."""
+        if self._session is not None:
+            return self._session.http
+        if self._http is None:
+            self._http = client_session()
+        return self._http
+
+    async def close(self):
+        """Close the client session if it was created by this server."""
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    async def _test_connection(self, conn):
+        server = self.server
+        url = (conn.uri if server.https_required else
+               'http://{}:{}'.format(conn.host, conn.port))
+        start = time.time()
+        try:
+            async with self.http.get(
+                    url, headers=_strings(server.headers),
+                    timeout=_timeout(server.connection_timeout)) as res:
+                conn.active = 200 <= res.status < 400
+                conn.url = url
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            conn.active = False
+        conn.rtt = time.time() - start if conn.active else None
+        return conn
+
+    async def _active_connection(self, exclude=None):
+        """Probe the connections at once, like
+        :meth:`Device._race_connections`, and cancel the probes still
+        running once a winner is known."""
+        server = self.server
+        connections = [x for x in server.connections if x is not exclude]
+        tasks = {asyncio.ensure_future(self._test_connection(conn)): conn
+                 for conn in connections}
+        pending = set(tasks)
+        winner = None
+        deadline = None
+        loop = asyncio.get_event_loop()
+        try:
+            while pending:
+                timeout = (None if deadline is None else
+                           max(0, deadline - loop.time()))
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for conn in [tasks[x] for x in done if tasks[x].active]:
+                    if winner is None or (conn.local and not winner.local):
+                        winner = conn
+                if winner is None:
+                    continue
+                if winner.local or not any(tasks[x].local for x in pending):
+                    break
+                if deadline is None:
+                    deadline = loop.time() + server.local_preference
+        finally:
+            for task in pending:
+                task.cancel()
+        for conn in connections:
+            if conn is not winner:
+                conn.active = False
+        server.active = winner
+        return winner
+
+    async def _connection(self, failed=None):
+        """Return the active connection. Concurrent requests wait for a
+        single connection selection."""
+        if self.server.active is None:
+            if self._selecting is None:
+                self._selecting = asyncio.Lock()
+            async with self._selecting:
+                if self.server.active is None:
+                    conn = await self._active_connection(exclude=failed)
+                    if conn is None and failed is not None:
+                        await self._active_connection()
+        conn = self.server.active
+        if conn is None:
+            log.error('request: unable to get an active connection.')
+            raise ConnectionError('Unable to connect to device.')
+        return conn
+
+    async def request(self, endpoint, method='GET', headers=None,
+                      params=None, timeout=None, **kwargs):
+        """Make a request to the server. Connection failures are handled
+        like :meth:`Device.request <plexdevices.device.Device.request>`; a
+        ``timeout`` or a read timeout is raised without changing connections.
+
+        Args:
+            endpoint (:obj:`str`): destination on the server.
+                e.g. ``/library/onDeck``.
+            method (:obj:`str`): request method.
+            headers (:obj:`dict`, optional): request headers.
+            params (:obj:`dict`, optional): query parameters.
+            timeout (:obj:`float`, optional): seconds to wait for each
+                attempt.
+            **kwargs: args to pass to :obj:`aiohttp.ClientSession.request()`.
+
+        Returns:
+            :obj:`aiohttp.ClientResponse`: the response, with its body read.
+
+        Raises:
+            ConnectionError
+            aiohttp.ClientError
+            asyncio.TimeoutError
+        """
+        server = self.server
+        headers = dict(headers or {})
+        if 'X-Plex-Token' not in headers:
+            headers.update(server.headers)
+        headers = _strings(headers)
+        params = _strings(params)
+        retry = method.upper() in plexdevices.device.IDEMPOTENT_METHODS
+        deadline = time.time() + server.retry_deadline
+        attempt = 0
+        failed = None
+        while True:
+            try:
+                conn = await self._connection(failed)
+            except ConnectionError as e:
+                conn, error = None, e
+            if conn is not None:
+                url = server._url(conn, endpoint)
+                log.debug('request: {} {}, {}'.format(method, url, params))
+                try:
+                    # reading the whole body releases the connection, and
+                    # keeps the body readable afterwards.
+                    res = await self.http.request(
+                        method, url, headers=headers, params=params,
+                        timeout=_timeout(timeout), **kwargs)
+                    await res.read()
+                except aiohttp.ClientConnectionError as e:
+                    if isinstance(e, _READ_TIMEOUTS):
+                        raise
+                    log.warning('request: {} failed: {!r}'.format(conn, e))
+                    failed = server._failover(conn)
+                    error = e
+                else:
+                    res.raise_for_status()
+                    return res
+            attempt += 1
+            delay = server._retry_delay(attempt, deadline)
+            if not retry or delay is None:
+                raise error
+            server.retries += 1
+            await asyncio.sleep(delay)
+
+    async def container(self, endpoint, size=None, page=None, params=None,
+                        timeout=None):
+        """See :meth:`Server.container <plexdevices.device.Server.container>`.
+
+        Returns:
+            :obj:`dict`: a Dictionary representing a Plex Media Container.
+
+        """
+        headers = {'Accept': 'application/json'}
+        if size is not None and page is not None:
+            headers['X-Plex-Container-Start'] = page * size
+            headers['X-Plex-Container-Size'] = size
+        res = await self.request(endpoint, headers=headers, params=params,
+                                 timeout=timeout)
+        return plexdevices.utils.parse_response(
+            await res.read(), res.headers.get('Content-Type'))
+
+    async def media_container(self, endpoint, size=None, page=None,
+                              params=None, timeout=None):
+        """See :meth:`Server.media_container
+        <plexdevices.device.Server.media_container>`.
+
+        Returns:
+            :obj:`MediaContainer <plexdevices.media.MediaContainer>`
+
+        """
+        data = await self.container(endpoint, size, page, params, timeout)
+        return plexdevices.media.MediaContainer(
+            self.server, data, endpoint, params, page, size)
+
+    async def hub(self, endpoint, size=None, page=None, params=None,
+                  timeout=None):
+        """See :meth:`Server.hub <plexdevices.device.Server.hub>`.
+
+        Returns:
+            :obj:`HubsContainer <plexdevices.hubs.HubsContainer>`
+
+        """
+        data = await self.container(endpoint, size, page, params, timeout)
+        return plexdevices.hubs.HubsContainer(self.server, data)
+
+    async def image(self, endpoint, w=None, h=None, timeout=None):
+        """See :meth:`Server.image <plexdevices.device.Server.image>`.
+
+        Returns:
+            :obj:`bytes`: the image data.
+
+        """
+        if endpoint.startswith('http'):
+            async with self.http.get(endpoint,
+                                     timeout=_timeout(timeout)) as res:
+                res.raise_for_status()
+                return await res.read()
+        params = None
+        if w and h:
+            params = {'url': endpoint, 'width': w, 'height': h, 'maxSize': 1}
+            endpoint = '/photo/:/transcode'
+        res = await self.request(endpoint, params=params, timeout=timeout)
+        return await res.read()
+
+    async def play_queue(self, play_queue_id, timeout=None):
+        """Retrieve an existing :obj:`PlayQueue <plexdevices.media.PlayQueue>`.
+        """
+        data = await self.container('/playQueues/{}'.format(play_queue_id),
+                                    timeout=timeout)
+        return plexdevices.media.PlayQueue(self.server, data)
+
+    async def create_play_queue(self, media_item, player_headers,
+                                timeout=None):
+        """See :func:`plexdevices.create_play_queue`.
+
+        Returns:
+            :obj:`PlayQueue <plexdevices.media.PlayQueue>`
+
+        """
+        headers = {'Accept': 'application/json'}
+        headers.update(player_headers)
+        media, uri = plexdevices.media.PlayQueue.media_uri(media_item,
+                                                           player_headers)
+        res = await self.request('/playQueues', method='POST',
+                                 headers=headers,
+                                 params={'type': media, 'uri': uri},
+                                 timeout=timeout)
+        data = plexdevices.utils.parse_response(
+            await res.read(), res.headers.get('Content-Type'))
+        return await self.play_queue(data['playQueueID'], timeout)
+
+
+class AsyncSession(object):
+    """Non-blocking counterpart of :obj:`Session
+    <plexdevices.session.Session>`. Use it as an async context manager, or
+    call :meth:`close` when done.
+
+    Args:
+        session (:obj:`Session <plexdevices.session.Session>`, optional): the
+            session holding the user's token. A new one is made when it is
+            not given.
+        limit (:obj:`int`, optional): maximum number of open connections.
+        limit_per_host (:obj:`int`, optional): maximum number of open
+            connections to one server.
+
+    Examples:
+        ::
+
+            >>> async with AsyncSession(plexdevices.create_session(
+            ...         username, password)) as s:
+            ...     servers = await s.refresh_devices()
+            ...     on_deck = await servers[0].media_container(
+            ...         '/library/onDeck', timeout=10)
+
+    """
+
+    def __init__(self, session=None, limit=100, limit_per_host=10):
+        #: The wrapped :obj:`Session <plexdevices.session.Session>`.
+        self.session = (plexdevices.session.Session() if session is None else
+                        session)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._http = None
+        self._servers = []
+
+    @property
+    def servers(self):
+        """List of :obj:`AsyncServer` s accessible by the current user."""
+        known = dict((id(x.server), x) for x in self._servers)
+        self._servers = [known.get(id(x)) or AsyncServer(x, self)
+                         for x in self.session.servers]
+        return self._servers
+
+    @property
+    def http(self):
+        """:obj:`aiohttp.ClientSession` shared by all the servers."""
+        if self._http is None:
+            self._http = client_session(self.limit, self.limit_per_host)
+        return self._http
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Close the shared client session."""
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    async def refresh_devices(self, timeout=None):
+        """Retrieve the devices for the current user from
+        ``https://plex.tv/api/resources``.
+
+        Returns:
+            :obj:`list`: the :obj:`AsyncServer` s.
+
+        """
+        try:
+            async with self.http.get('https://plex.tv/api/resources',
+                                     headers=_strings(self.session.headers),
+                                     params={'includeHttps': '1'},
+                                     timeout=_timeout(timeout)) as res:
+                text = await res.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.error(repr(e))
+            raise plexdevices.exceptions.PlexTVError(repr(e))
+        if res.status != 200:
+            log.error('Response: {} - {}'.format(res.status, text))
+            raise plexdevices.exceptions.PlexTVError(res.status)
+        self.session._load_devices(res.status, text)
+        return self.servers
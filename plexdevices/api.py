@@ -1,7 +1,7 @@
 import plexdevices.session
 import plexdevices.remote
 import plexdevices.media
-import plexdevices.compat
+import plexdevices.jsonlib
 
 
 def create_session(user=None, password=None, token=None):
@@ -113,7 +113,7 @@ def create_play_queue(media_item, player_identifier, player_name):
                           method='POST',
                           headers=headers,
                           params={'type': media, 'uri': uri})
-    pqid = plexdevices.compat.json.loads(res.text)['playQueueID']
+    pqid = plexdevices.jsonlib.loads(res.content)['playQueueID']
     return plexdevices.media.PlayQueue(
         server, server.container('/playQueues/{}'.format(pqid)))
 
@@ -0,0 +1,588 @@
+"""
+Response caches for :meth:`Server.container
+<plexdevices.device.Server.container>`.
+
+A cache is attached to a server by setting its ``cache`` attribute. One cache
+can be shared by several servers and users, entries are keyed by the server's
+identifier, the endpoint, the parameters, the paging values and a digest of
+the access token, so a user is never served another user's containers::
+
+    >>> server.cache = plexdevices.cache.MemoryCache(
+    ...     max_entries=500, ttls={'/library/onDeck': 30, '/hubs': 60})
+    >>> server.media_container('/library/sections')  # request
+    >>> server.media_container('/library/sections')  # cached
+    >>> server.cache.hits, server.cache.misses
+    (1, 1)
+
+:class:`DiskCache` keeps the entries in a database, so they survive restarts
+and can be shared by several processes::
+
+    >>> server.cache = plexdevices.cache.DiskCache('~/.cache/plexdevices')
+
+When the server sends an ``ETag`` or ``Last-Modified`` header, stale entries
+are revalidated with a conditional request instead of being fetched again.
+
+"""
+import collections
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import requests
+
+import plexdevices.utils
+
+
+def cache_key(server, endpoint, params=None, start=None, size=None,
+              token=None):
+    """Return the cache key of a container request. The key holds a digest
+    of ``token`` rather than the token itself, since it may be written to
+    disk."""
+    params = tuple(sorted((k, str(v)) for k, v in (params or {}).items()))
+    user = None
+    if token is not None:
+        user = hashlib.sha1(token.encode('utf-8')).hexdigest()
+    return (server, endpoint, params, start, size, user)
+
+
+def endpoint_matches(endpoint, prefix):
+    """``True`` if ``endpoint`` is ``prefix`` or below it."""
+    return (endpoint == prefix or
+            endpoint.startswith(prefix.rstrip('/') + '/') or
+            endpoint.startswith(prefix + '?'))
+
+
+class CacheEntry(object):
+    """A cached container.
+
+    Args:
+        data (:obj:`dict`): the parsed container.
+        size (:obj:`int`): approximate size of the entry in bytes.
+        ttl (:obj:`float`): seconds the entry is fresh for. ``None`` never
+            expires.
+        etag (:obj:`str`, optional): the response's ``ETag``.
+        last_modified (:obj:`str`, optional): the response's
+            ``Last-Modified``.
+    """
+
+    def __init__(self, data, size, ttl, stored=None, etag=None,
+                 last_modified=None):
+        self.data = data
+        self.size = size
+        self.ttl = ttl
+        #: time the entry was stored or last revalidated.
+        self.stored = time.time() if stored is None else stored
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def age(self):
+        """Seconds since the entry was stored."""
+        return time.time() - self.stored
+
+    @property
+    def fresh(self):
+        """``True`` until the entry's ttl has passed."""
+        return self.ttl is None or self.age < self.ttl
+
+    def copy(self):
+        """Return a copy of the data which the caller is free to modify."""
+        return plexdevices.utils.copy_tree(self.data)
+
+    def validators(self):
+        """Headers making a request conditional on the entry being out of
+        date."""
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class _Counters(object):
+
+    def __init__(self):
+        #: Number of lookups answered with a fresh entry.
+        self.hits = 0
+        #: Number of lookups with no entry, or a stale one.
+        self.misses = 0
+        #: Number of entries removed to stay within the limits.
+        self.evictions = 0
+
+    @property
+    def stats(self):
+        """:obj:`dict` of the hit, miss and eviction counts."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
+
+
+class ContainerCache(_Counters):
+    """Base class of the container caches.
+
+    Args:
+        ttl (:obj:`float`, optional): default seconds entries stay fresh.
+        ttls (:obj:`dict`, optional): seconds entries stay fresh, by endpoint
+            prefix. The longest matching prefix wins.
+    """
+
+    def __init__(self, ttl=60, ttls=None):
+        super(ContainerCache, self).__init__()
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+
+    def ttl_for(self, endpoint):
+        """Return the ttl of entries for ``endpoint``."""
+        prefixes = [x for x in self.ttls if endpoint_matches(endpoint, x)]
+        if not prefixes:
+            return self.ttl
+        return self.ttls[max(prefixes, key=len)]
+
+    def lookup(self, key):
+        """Return the entry for ``key``, stale or not, and count the hit or
+        miss. ``None`` if there is none."""
+        entry = self.get(key)
+        if entry is not None and entry.fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def store(self, key, data, size, response=None):
+        """Cache ``data`` under ``key`` with the ttl of its endpoint. The
+        validators of the :obj:`requests.Response` it was parsed from are
+        kept for revalidation."""
+        headers = {} if response is None else response.headers
+        self.set(key, CacheEntry(data, size, self.ttl_for(key[1]),
+                                 etag=headers.get('ETag'),
+                                 last_modified=headers.get('Last-Modified')))
+
+    def revalidated(self, key, entry):
+        """Mark an entry fresh again, after the server answered a
+        conditional request with ``304 Not Modified``."""
+        entry.stored = time.time()
+        self.set(key, entry)
+
+    def get(self, key):
+        """Return the :class:`CacheEntry` for ``key`` or ``None``."""
+        raise NotImplementedError
+
+    def set(self, key, entry):
+        """Store a :class:`CacheEntry` under ``key``."""
+        raise NotImplementedError
+
+    def invalidate(self, server=None, endpoint=None):
+        """Remove the entries of ``server`` (all servers if ``None``) whose
+        endpoint is ``endpoint`` or below it (any endpoint if ``None``)."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove every entry."""
+        self.invalidate()
+
+
+class MemoryCache(ContainerCache):
+    """An in-memory least recently used cache.
+
+    Args:
+        max_entries (:obj:`int`, optional): maximum number of entries.
+        max_bytes (:obj:`int`, optional): maximum total size of the entries,
+            measured as the size of the response bodies.
+        ttl (:obj:`float`, optional): default seconds entries stay fresh.
+        ttls (:obj:`dict`, optional): seconds entries stay fresh, by endpoint
+            prefix.
+
+    Stale entries are kept until evicted.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 2 ** 20, ttl=60,
+                 ttls=None):
+        super(MemoryCache, self).__init__(ttl, ttls)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        #: Total size of the entries.
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # move to the most recently used end.
+                del self._entries[key]
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += entry.size
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     self.size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def invalidate(self, server=None, endpoint=None):
+        with self._lock:
+            for key in list(self._entries):
+                if server is not None and key[0] != server:
+                    continue
+                if endpoint is not None and not endpoint_matches(key[1],
+                                                                 endpoint):
+                    continue
+                self.size -= self._entries.pop(key).size
+
+
+class DiskCache(ContainerCache):
+    """A persistent least recently used cache, stored in an SQLite database
+    in ``directory``. The response bodies are stored and parsed again when
+    read, so entries survive restarts and can be shared by processes.
+
+    Args:
+        directory (:obj:`str`): where the database is kept. It is created if
+            needed.
+        max_bytes (:obj:`int`, optional): maximum total size of the stored
+            response bodies.
+        ttl (:obj:`float`, optional): default seconds entries stay fresh.
+        ttls (:obj:`dict`, optional): seconds entries stay fresh, by endpoint
+            prefix.
+
+    Stale entries are revalidated with a conditional request when the server
+    gave an ``ETag`` or ``Last-Modified`` header.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 2 ** 20, ttl=60,
+                 ttls=None):
+        super(DiskCache, self).__init__(ttl, ttls)
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.directory,
+                                                'containers.db'),
+                                   check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS containers ('
+                'key TEXT PRIMARY KEY, server TEXT, endpoint TEXT, '
+                'body BLOB, size INTEGER, ttl REAL, stored REAL, '
+                'accessed REAL, etag TEXT, last_modified TEXT)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS containers_accessed '
+                             'ON containers (accessed)')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM containers').fetchone()[0]
+
+    @property
+    def size(self):
+        """Total size of the stored response bodies."""
+        with self._lock:
+            return self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM containers').fetchone()[0]
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+    def store(self, key, data, size, response=None):
+        body = None if response is None else response.content
+        if body is None:
+            return
+        headers = response.headers
+        self.set(key, DiskCacheEntry(body, len(body), self.ttl_for(key[1]),
+                                     etag=headers.get('ETag'),
+                                     last_modified=headers.get(
+                                         'Last-Modified')))
+
+    def get(self, key):
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT body, size, ttl, stored, etag, last_modified '
+                'FROM containers WHERE key = ?', (repr(key),)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE containers SET accessed = ? '
+                             'WHERE key = ?', (time.time(), repr(key)))
+        body, size, ttl, stored, etag, last_modified = row
+        return DiskCacheEntry(bytes(body), size, ttl, stored, etag,
+                              last_modified)
+
+    def set(self, key, entry):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO containers VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (repr(key), key[0], key[1], sqlite3.Binary(entry.body),
+                 entry.size, entry.ttl, entry.stored, time.time(),
+                 entry.etag, entry.last_modified))
+            total = self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM containers').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._db.execute('SELECT key, size FROM containers '
+                                    'ORDER BY accessed').fetchall()
+            for old_key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._db.execute('DELETE FROM containers WHERE key = ?',
+                                 (old_key,))
+                total -= size
+                self.evictions += 1
+
+    def invalidate(self, server=None, endpoint=None):
+        with self._lock, self._db:
+            rows = self._db.execute(
+                'SELECT key, server, endpoint FROM containers').fetchall()
+            for key, key_server, key_endpoint in rows:
+                if server is not None and key_server != server:
+                    continue
+                if endpoint is not None and not endpoint_matches(key_endpoint,
+                                                                 endpoint):
+                    continue
+                self._db.execute('DELETE FROM containers WHERE key = ?',
+                                 (key,))
+
+
+class DiskCacheEntry(CacheEntry):
+    """A :class:`CacheEntry` holding the response body, which is parsed
+    when the data is needed."""
+
+    def __init__(self, body, size, ttl, stored=None, etag=None,
+                 last_modified=None):
+        super(DiskCacheEntry, self).__init__(None, size, ttl, stored, etag,
+                                             last_modified)
+        self.body = body
+
+    def copy(self):
+        return plexdevices.utils.parse_response(self.body)
+
+
+def image_key(server, endpoint, w=None, h=None):
+    """Return the cache key of an image. Images at a full URL are shared by
+    all servers."""
+    if endpoint.startswith('http'):
+        server = None
+    return (server, endpoint, w, h)
+
+
+class ImageCache(_Counters):
+    """A least recently used cache of images for :meth:`Server.image
+    <plexdevices.device.Server.image>`, with one file per image in
+    ``directory``.
+
+    Images are written to a temporary file while they are downloaded and
+    renamed into place once complete, so a cached file is never partial.
+    The modification times of the files record their last use.
+
+    Args:
+        directory (:obj:`str`): where the images are kept. It is created if
+            needed.
+        max_bytes (:obj:`int`, optional): maximum total size of the images.
+
+    Examples:
+        ::
+
+            >>> server.image_cache = plexdevices.cache.ImageCache(
+            ...     '~/.cache/plexdevices/images', max_bytes=256 * 2 ** 20)
+            >>> server.image(movie.thumb, 300, 450).content
+
+    """
+    chunk_size = 64 * 1024
+    #: Fraction of ``max_bytes`` to evict down to once it is exceeded, so
+    #: that the directory is not scanned on every store at the budget.
+    low_water = 0.9
+
+    def __init__(self, directory, max_bytes=512 * 2 ** 20):
+        super(ImageCache, self).__init__()
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._lock = threading.Lock()
+        #: Total size of the images.
+        self.size = sum(os.path.getsize(x) for x, _ in self._files())
+
+    def __len__(self):
+        return len(self._files())
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def path(self, key):
+        """Return the file of the image cached under ``key``."""
+        name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, key):
+        """Return the image cached under ``key`` as a :obj:`requests.Response`
+        reading from the file, or ``None``. Count the hit or miss."""
+        path = self.path(key)
+        try:
+            os.utime(path, None)
+            res = _file_response(path, key[1])
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return res
+
+    def store(self, key, response):
+        """Write the body of ``response`` to the cache under ``key``, reading
+        it in chunks, and close it.
+
+        Returns:
+            :obj:`requests.Response`: the image, reading from the file.
+        """
+        fd, tmp = tempfile.mkstemp(prefix='.tmp', dir=self.directory)
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+            path = self.path(key)
+            plexdevices.utils.replace_file(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        finally:
+            response.close()
+        with self._lock:
+            self.size += size
+            if self.size > self.max_bytes:
+                self._evict(keep=path)
+        return _file_response(path, key[1])
+
+    def clear(self):
+        """Remove every image."""
+        with self._lock:
+            for path, _ in self._files():
+                _remove(path)
+            self.size = 0
+
+    def _files(self):
+        """The cached files and their modification times."""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                files.append((path, os.path.getmtime(path)))
+            except OSError:
+                pass
+        return files
+
+    def _evict(self, keep):
+        files = sorted(self._files(), key=lambda x: x[1])
+        sizes = [(x, os.path.getsize(x)) for x, _ in files]
+        self.size = sum(size for _, size in sizes)
+        target = int(self.max_bytes * self.low_water)
+        for path, size in sizes:
+            if self.size <= target:
+                break
+            if path == keep:
+                continue
+            if _remove(path):
+                self.size -= size
+                self.evictions += 1
+
+
+def _file_response(path, url):
+    """A :obj:`requests.Response` whose body is read from ``path``."""
+    res = requests.Response()
+    res.raw = _FileBody(open(path, 'rb'))
+    res.status_code = 200
+    res.url = url
+    res.headers['Content-Length'] = str(os.path.getsize(path))
+    return res
+
+
+class _FileBody(object):
+    """A file which closes itself once read to the end."""
+
+    def __init__(self, f):
+        self._file = f
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        if not data or size is None or size < 0:
+            self._file.close()
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+class SingleFlight(object):
+    """Share one call of a function between concurrent callers asking for
+    the same key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Call ``func``, unless a call for ``key`` is already running, in
+        which case wait for it and use its result.
+
+        Returns:
+            :obj:`tuple`: the result, and ``True`` if it is shared with
+            another caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, call.waiters > 0
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
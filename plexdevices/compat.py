@@ -36,6 +36,7 @@ if is_py2:
     from urlparse import urlparse, urlunparse, urljoin, urlsplit, urldefrag
     from urllib2 import parse_http_list
     from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    import Queue as queue
     # import cookielib
     # from Cookie import Morsel
     # from StringIO import StringIO
@@ -45,6 +46,7 @@ if is_py2:
     bytes = str
     str = unicode
     basestring = basestring
+    intern = intern
     numeric_types = (int, long, float)
 
 elif is_py3:
@@ -53,6 +55,8 @@ elif is_py3:
                               unquote_plus, urldefrag)
     from urllib.request import parse_http_list, getproxies, proxy_bypass
     from http.server import HTTPServer, BaseHTTPRequestHandler
+    import queue
+    from sys import intern
     # from http import cookiejar as cookielib
     # from http.cookies import Morsel
     # from io import StringIO
@@ -63,6 +67,11 @@ elif is_py3:
     basestring = (str, bytes)
     numeric_types = (int, float)
 
+try:
+    from collections.abc import MutableMapping, MutableSequence
+except ImportError:
+    from collections import MutableMapping, MutableSequence
+
 try:
     iteritems = dict.iteritems
 except AttributeError:
@@ -1,5 +1,10 @@
 import logging
+import random
+import threading
+import time
+import weakref
 import requests
+import plexdevices.cache
 import plexdevices.compat
 import plexdevices.exceptions
 import plexdevices.hubs
@@ -7,12 +12,34 @@ import plexdevices.media
 import plexdevices.utils
 log = logging.getLogger(__name__)
 
+#: Default number of per-host connection pools kept by a device's transport.
+POOL_CONNECTIONS = 4
+#: Default number of idle keep-alive connections kept per host.
+POOL_MAXSIZE = 10
+#: Request methods which are safe to send again after a connection failure.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+# container requests in flight, shared by all the servers.
+_flights = plexdevices.cache.SingleFlight()
+
 
 def create_device(data):
     """Create a Device object and mixin the functionality it provides."""
-    provides = data.get('provides').split(',')
-    mixins = tuple([x for x in [_provides_mixins(p) for p in provides] if x is not None])
-    return Device(data, mixins=mixins if mixins else None)
+    return Device(data, mixins=_mixins(data.get('provides').split(',')))
+
+
+def _mixins(provides):
+    """The mixins for a list of provides, or ``None`` if there are none."""
+    mixins = tuple([x for x in [_provides_mixins(p) for p in provides]
+                    if x is not None])
+    return mixins or None
+
+
+def _replace_data(data, new):
+    """Replace the values of ``data`` with those of ``new``, in place."""
+    if data is not new:
+        data.clear()
+        data.update(new)
 
 
 def _provides_mixins(provides):
@@ -27,17 +54,49 @@ class DynamicInheritance(type):
         if mixins:
             assert isinstance(mixins, tuple)
             mixins = tuple([x for x in mixins if x is not None])
-            new_cls = type(cls.__name__, mixins + (cls,), {})
+            new_cls = plexdevices.utils.mixed_class(cls.__name__,
+                                                    mixins + (cls,),
+                                                    cls.__module__)
             return super(DynamicInheritance, new_cls).__call__(data)
         return super(DynamicInheritance, cls).__call__(data)
 
 
 class Device(plexdevices.compat.with_metaclass(DynamicInheritance)):
+    #: Number of per-host connection pools kept by :attr:`http`.
+    pool_connections = POOL_CONNECTIONS
+    #: Maximum number of idle keep-alive connections kept per host.
+    #: Connections beyond this are closed when released.
+    pool_maxsize = POOL_MAXSIZE
+    #: Probe all connections at once and use the first one that answers,
+    #: instead of testing them one after another.
+    race_connections = True
+    #: Seconds a remote connection that answered first can still be overtaken
+    #: by a local connection.
+    local_preference = 0.05
+    #: Seconds to wait for a connection probe.
+    connection_timeout = 1
+    #: Number of times an idempotent request is retried after a connection
+    #: failure.
+    max_retries = 3
+    #: Base delay in seconds between retries. It doubles on every attempt
+    #: and a random amount of it is used.
+    retry_backoff = 0.2
+    #: Upper limit in seconds of a single retry delay.
+    retry_backoff_max = 5
+    #: Seconds after which a request is no longer retried.
+    retry_deadline = 30
+    #: Number of requests sent again after a connection failure.
+    retries = 0
+    #: Number of times a failed active connection was replaced.
+    failovers = 0
 
     def __init__(self, data):
         self.data = data
         self.connections = [Connection(conn) for conn in data['_children']]
         self.active = None
+        # keep the transport when a device is refreshed in place.
+        self._http = getattr(self, '_http', None)
+        self._http_lock = getattr(self, '_http_lock', None) or threading.Lock()
 
     def __eq__(self, other):
         if self.__class__.__name__ == other.__class__.__name__:
@@ -128,61 +187,303 @@ class Device(plexdevices.compat.with_metaclass(DynamicInheritance)):
     def headers(self):
         return {'X-Plex-Token': self.access_token}
 
+    @property
+    def http(self):
+        """:obj:`requests.Session`: the pooled keep-alive transport used for
+        every request to this device. It is created on first use."""
+        http = self._http
+        if http is None:
+            # the connection probes ask for it from several threads at once.
+            with self._http_lock:
+                if self._http is None:
+                    self._http = plexdevices.utils.pooled_session(
+                        self.pool_connections, self.pool_maxsize)
+                http = self._http
+        return http
+
+    def configure_pool(self, pool_connections=None, pool_maxsize=None):
+        """Change the connection pool limits. The current transport is closed
+        and a new one is built on the next request.
+
+        Args:
+            pool_connections (:obj:`int`, optional): number of per-host pools
+                to keep.
+            pool_maxsize (:obj:`int`, optional): number of idle keep-alive
+                connections to keep per host.
+
+        """
+        if pool_connections is not None:
+            self.pool_connections = pool_connections
+        if pool_maxsize is not None:
+            self.pool_maxsize = pool_maxsize
+        self.close()
+
+    def close(self):
+        """Close the pooled connections held by this device."""
+        with self._http_lock:
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+
     def __reduce__(self):
-        return (Device, (self.data, tuple([_provides_mixins(p) for p in self.provides])))
+        return (Device, (self.data, _mixins(self.provides)),
+                {'pool_connections': self.pool_connections,
+                 'pool_maxsize': self.pool_maxsize})
 
     def __repr__(self):
         return '<{}:{} - {}>'.format(self.__class__.__name__, self.name,
                                      self.product)
 
-    def _active_connection(self):
+    def _active_connection(self, exclude=None):
         """Test the connections. Return the working one if possible."""
-        for conn in self.connections:
-            if conn.test(self.access_token, secure=self.https_required):
+        connections = [x for x in self.connections if x is not exclude]
+        if self.race_connections and len(connections) > 1:
+            self.active = self._race_connections(connections)
+            return self.active
+        for conn in connections:
+            if self._test_connection(conn):
                 self.active = conn
                 return self.active
         self.active = None
         return self.active
 
+    def _test_connection(self, conn):
+        return conn.test(self.access_token, secure=self.https_required,
+                         timeout=self.connection_timeout, session=self.http)
+
+    def _race_connections(self, connections):
+        """Probe all the connections at once. The first to answer wins,
+        unless a local connection answers within :attr:`local_preference`
+        seconds of it. Probes still running afterwards are abandoned and their
+        connections left inactive."""
+        results = plexdevices.compat.queue.Queue()
+        done = threading.Event()
+
+        def probe(conn):
+            try:
+                ok = self._test_connection(conn)
+            except Exception as e:
+                # always answer, the race may be waiting for this connection.
+                log.warning('race: testing {} failed: {!r}'.format(conn, e))
+                conn.active = ok = False
+            if done.is_set() and conn is not winner:
+                conn.active = False
+            results.put((conn, ok))
+
+        winner = None
+        pending = list(connections)
+        for conn in connections:
+            thread = threading.Thread(target=probe, args=(conn,))
+            thread.daemon = True
+            thread.start()
+        deadline = None
+        while pending:
+            timeout = (None if deadline is None else
+                       max(0, deadline - time.time()))
+            try:
+                conn, ok = results.get(timeout=timeout)
+            except plexdevices.compat.queue.Empty:
+                break
+            pending.remove(conn)
+            if not ok:
+                continue
+            if conn.local:
+                winner = conn
+                break
+            if winner is None:
+                winner = conn
+                if not any(x.local for x in pending):
+                    break
+                deadline = time.time() + self.local_preference
+        done.set()
+        for conn in connections:
+            if conn is not winner and conn not in pending:
+                conn.active = False
+        log.debug('race: {} won, rtts: {}'.format(
+            winner, [(x.uri, x.rtt) for x in connections]))
+        return winner
+
     def request(self, endpoint, method='GET', **kwargs):
         """Make a request to the devices. This is a wrapper for
-        :obj:`requests.request()`
+        :obj:`requests.Session.request()` using the device's pooled
+        :attr:`http` transport.
 
         Args:
             endpoint (:obj:`str`): destination on the server.
                 e.g. ``/library/onDeck``.
             method (:obj:`str`): request method.
-            **kwargs: args to pass to :obj:`requests.request()`.
+            **kwargs: args to pass to :obj:`requests.Session.request()`.
 
         Returns:
             :obj:`requests.Response`
 
+        When the active connection fails, or does not accept the connection
+        in time, the next best connection is selected. Idempotent requests
+        are then retried up to :attr:`max_retries` times with a jittered
+        exponential backoff, for at most :attr:`retry_deadline` seconds, also
+        while no connection answers. A response which is slow to arrive
+        (:obj:`requests.exceptions.ReadTimeout`) is not retried.
+
         Raises:
             ConnectionError
+            requests.exceptions.ConnectionError
             requests.exceptions.HTTPError
             requests.exceptions.Timeout
         """
-        if self.active is None:
-            self._active_connection()
-            if self.active is None:
-                log.error('request: unable to get an active connection.')
-                raise ConnectionError('Unable to connect to device.')
         if 'headers' in kwargs:
             if 'X-Plex-Token' not in kwargs['headers']:
                 kwargs['headers'].update(self.headers)
         else:
             kwargs['headers'] = self.headers
-        url = (self.active.uri + endpoint if self.https_required else
-               'http://{}:{}{}'.format(self.active.address,
-                                       self.active.port, endpoint))
-        log.debug('request: {} {}, {}'.format(method, url, kwargs))
-        res = requests.request(method, url, **kwargs)
-        res.raise_for_status()
-        return res
+        retry = method.upper() in IDEMPOTENT_METHODS
+        deadline = time.time() + self.retry_deadline
+        attempt = 0
+        failed = None
+        while True:
+            try:
+                conn = self._connection(failed)
+            except ConnectionError as e:
+                # no connection answered; every path may be briefly down.
+                conn, error = None, e
+            if conn is not None:
+                url = self._url(conn, endpoint)
+                log.debug('request: {} {}, {}'.format(method, url, kwargs))
+                try:
+                    res = self.http.request(method, url, **kwargs)
+                except requests.exceptions.ConnectionError as e:
+                    # includes ConnectTimeout. A ReadTimeout means the server
+                    # is slow, not unreachable, so it is raised as is.
+                    log.warning('request: {} failed: {}'.format(conn, e))
+                    failed = self._failover(conn)
+                    error = e
+                else:
+                    res.raise_for_status()
+                    return res
+            attempt += 1
+            delay = self._retry_delay(attempt, deadline)
+            if not retry or delay is None:
+                raise error
+            self.retries += 1
+            time.sleep(delay)
+
+    def _url(self, conn, endpoint):
+        return (conn.uri + endpoint if self.https_required else
+                'http://{}:{}{}'.format(conn.host, conn.port, endpoint))
+
+    def _retry_delay(self, attempt, deadline):
+        """Return the seconds to wait before retry number ``attempt``, or
+        ``None`` when the request should not be retried."""
+        delay = random.uniform(0, min(self.retry_backoff_max,
+                                      self.retry_backoff * 2 ** attempt))
+        if attempt > self.max_retries or time.time() + delay > deadline:
+            return None
+        return delay
+
+    def _connection(self, failed=None):
+        """Return the active connection, selecting one if needed. A connection
+        which just failed is only used again when no other one works."""
+        conn = self.active
+        if conn is None:
+            conn = self._active_connection(exclude=failed)
+            if conn is None and failed is not None:
+                conn = self._active_connection()
+            if conn is None:
+                log.error('request: unable to get an active connection.')
+                raise ConnectionError('Unable to connect to device.')
+        return conn
+
+    def _failover(self, conn):
+        """Drop a connection that failed so the next request selects
+        another."""
+        conn.active = False
+        if self.active is conn:
+            self.active = None
+            self.failovers += 1
+        return conn
 
 
 class Server(Device):
     """A :class:`Device <plexdevices.device.Device>` which provides a server."""
+    #: :obj:`ContainerCache <plexdevices.cache.ContainerCache>` used by
+    #: :meth:`container`, or ``None``.
+    cache = None
+    #: Share one request and parse between concurrent identical
+    #: :meth:`container` calls.
+    coalesce_requests = True
+    #: Default seconds past their ttl that cached containers are served by
+    #: :meth:`media_container` and :meth:`hub` while they are refreshed in
+    #: the background, or ``None`` to always wait for stale containers.
+    max_stale = None
+    #: Keep the values of the items in containers in :obj:`CompactDict
+    #: <plexdevices.utils.CompactDict>` s, which share their keys, instead of
+    #: dictionaries. It lowers the memory used by large libraries.
+    compact = False
+    #: Share one object per item (by ``ratingKey``) between the containers
+    #: of this server. A live item is reused, and updated, when another
+    #: container holds it, which becomes its ``container``, and items of other classes (e.g. in hubs) share
+    #: its :attr:`data <plexdevices.media.BaseObject.data>`, so that changes
+    #: such as :meth:`mark_watched
+    #: <plexdevices.media.MediaItem.mark_watched>` show in every container.
+    #: Play queue entries are not shared.
+    share_items = False
+    #: :obj:`ImageCache <plexdevices.cache.ImageCache>` used by
+    #: :meth:`image`, or ``None``.
+    image_cache = None
+    #: Maximum images requested per second by
+    #: :meth:`MediaContainer.prefetch_images
+    #: <plexdevices.media.MediaContainer.prefetch_images>`, or ``None``.
+    image_rate_limit = None
+
+    @property
+    def image_limiter(self):
+        """:obj:`RateLimiter <plexdevices.utils.RateLimiter>` applying
+        :attr:`image_rate_limit`, shared by the prefetches of this server, or
+        ``None``."""
+        rate = self.image_rate_limit
+        if rate is None:
+            return None
+        limiter = self.__dict__.get('_image_limiter')
+        if limiter is None or limiter.rate != rate:
+            limiter = self._image_limiter = plexdevices.utils.RateLimiter(rate)
+        return limiter
+
+    @property
+    def items(self):
+        """:obj:`weakref.WeakValueDictionary` of the live items shared
+        through :attr:`share_items`, by ``(class, ratingKey)``."""
+        items = self.__dict__.get('_items')
+        if items is None:
+            items = self.__dict__.setdefault('_items',
+                                             weakref.WeakValueDictionary())
+        return items
+
+    def _shared_item(self, cls, data, build):
+        """Return the live item of ``cls`` with the ``ratingKey`` of
+        ``data``, its values replaced by ``data``, else the item made by
+        ``build(data)``."""
+        key = data.get('ratingKey')
+        if key is None or 'playQueueItemID' in data:
+            return build(data)
+        lock = self.__dict__.get('_items_lock')
+        if lock is None:
+            lock = self.__dict__.setdefault('_items_lock', threading.Lock())
+        items = self.items
+        with lock:
+            item = items.get((cls, key))
+            if item is not None:
+                _replace_data(item.data, data)
+                if getattr(item, '_media', None) is not None:
+                    item._media = None
+                return item
+            # an item of another class with this ratingKey shares its data.
+            other = items.get(key)
+            if other is not None:
+                _replace_data(other.data, data)
+                data = other.data
+            item = build(data)
+            items[(cls, key)] = item
+            items[key] = item
+            return item
 
     def container(self, endpoint, size=None, page=None, params=None, **kwargs):
         """
@@ -198,17 +499,152 @@ class Server(Device):
         Returns:
             :obj:`dict`: a Dictionary representing a Plex Media Container.
 
+        When :attr:`cache` is set, fresh cached containers are returned
+        without a request, and stale ones are revalidated with a conditional
+        request. Concurrent calls for the same container share a single
+        request, each caller getting its own copy of the result.
+
         """
-        headers = self.headers
+        return self._container(endpoint, size, page, params, **kwargs)[0]
+
+    def _container(self, endpoint, size=None, page=None, params=None,
+                   max_stale=None, on_refresh=None, **kwargs):
+        """Return a container and the cache entry it was read from, or
+        ``None`` if it was requested.
+
+        A stale entry no more than ``max_stale`` seconds past its ttl is
+        returned at once, and refreshed in the background. ``on_refresh`` is
+        called with the new container once it is received.
+        """
+        cache = self.cache
+        key = self._cache_key(endpoint, size, page, params)
+        entry = None
+        if cache is not None:
+            entry = cache.lookup(key)
+            if entry is not None and entry.fresh:
+                return entry.copy(), entry
+            if (entry is not None and max_stale is not None and
+                    entry.age - entry.ttl <= max_stale):
+                self._refresh(key, entry, endpoint, size, page, params,
+                              on_refresh, kwargs)
+                return entry.copy(), entry
+        return self._fetch(key, entry, endpoint, size, page, params,
+                           **kwargs), None
+
+    def _fetch(self, key, entry, endpoint, size, page, params, **kwargs):
+        """Request a container, revalidating ``entry`` if there is one, and
+        cache it."""
+        cache = self.cache
+
+        def fetch():
+            res = self._request_container(endpoint, size, page, params, entry,
+                                          **kwargs)
+            if res.status_code == 304:
+                cache.revalidated(key, entry)
+                return entry.copy()
+            body = res.content
+            data = plexdevices.utils.parse_response(
+                body, res.headers.get('Content-Type'))
+            if cache is not None:
+                cache.store(key, data, len(body), res)
+            return data
+
+        if self.coalesce_requests:
+            # the token too, so that users never share a request.
+            data, shared = _flights.do(key + (self.access_token,), fetch)
+        else:
+            data, shared = fetch(), False
+        if shared or cache is not None:
+            return plexdevices.utils.copy_tree(data)
+        return data
+
+    def _refresh(self, key, entry, endpoint, size, page, params, on_refresh,
+                 kwargs):
+        """Fetch a container again in a background thread."""
+        def refresh():
+            try:
+                data = self._fetch(key, entry, endpoint, size, page, params,
+                                   **kwargs)
+            except (ConnectionError, requests.exceptions.RequestException,
+                    plexdevices.exceptions.ParseError) as e:
+                log.warning('refresh: {} failed: {!r}'.format(endpoint, e))
+                return
+            if on_refresh is not None:
+                on_refresh(data)
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+    def _request_container(self, endpoint, size, page, params, entry=None,
+                           **kwargs):
+        """Request a container, conditionally when a cached ``entry`` is
+        given."""
+        headers = self._container_headers(size, page)
         headers['Accept'] = 'application/json'
-        if size is not None and page is not None:
-            headers['X-Plex-Container-Start'] = page * size
-            headers['X-Plex-Container-Size'] = size
+        if entry is not None:
+            headers.update(entry.validators())
+        return self.request(endpoint, method='GET', params=params,
+                            headers=headers, stream=True, **kwargs)
+
+    def _cache_key(self, endpoint, size, page, params):
+        start = page * size if size is not None and page is not None else None
+        return plexdevices.cache.cache_key(self.client_identifier, endpoint,
+                                           params, start, size,
+                                           self.access_token)
+
+    def invalidate_cache(self, *endpoints):
+        """Remove this server's cached containers for the given endpoints
+        and the ones below them, or all of them if none are given."""
+        cache = self.cache
+        if cache is None:
+            return
+        if not endpoints:
+            cache.invalidate(self.client_identifier)
+        for endpoint in endpoints:
+            cache.invalidate(self.client_identifier, endpoint)
+
+    def stream_container(self, endpoint, size=None, page=None, params=None,
+                         **kwargs):
+        """Like :meth:`container`, but the response is parsed while it is
+        read from the socket instead of being buffered first.
+
+        The ``_children`` of the returned dictionary is an iterator which
+        reads and parses the next child on demand. The connection is released
+        once it is exhausted or closed.
+
+        Returns:
+            :obj:`dict`: a Dictionary representing a Plex Media Container.
+
+        """
+        headers = self._container_headers(size, page)
+        headers['Accept'] = 'application/xml'
         res = self.request(endpoint, method='GET', params=params,
                            headers=headers, stream=True, **kwargs)
-        return plexdevices.utils.parse_response(res.text)
+        content_type = res.headers.get('Content-Type', '')
+        if 'json' in content_type:
+            return plexdevices.utils.parse_response(res.content, content_type)
+        res.raw.decode_content = True
+        items = plexdevices.utils.iter_xml(res.raw)
+        try:
+            data = next(items)
+        except Exception:
+            res.close()
+            raise
+        if 'totalSize' not in data:
+            data['totalSize'] = 1
+        data['_children'] = _release_after(items, res)
+        return data
+
+    def _container_headers(self, size, page):
+        headers = self.headers
+        if size is not None and page is not None:
+            headers['X-Plex-Container-Start'] = str(page * size)
+            headers['X-Plex-Container-Size'] = str(size)
+        return headers
 
-    def media_container(self, endpoint, size=None, page=None, params=None, **kwargs):
+    def media_container(self, endpoint, size=None, page=None, params=None,
+                        streaming=False, parallel_pages=None, max_stale=None,
+                        on_refresh=None, **kwargs):
         """
         Args:
             endpoint (:obj:`str`): destination on the server.
@@ -218,15 +654,75 @@ class Server(Device):
                 containers.
             params (:obj:`dict`, optional): Dictionary of parameters to be
                 added to the url in the request.
+            streaming (:obj:`bool`, optional): build the items while the
+                response is read, see :meth:`stream_container`.
+            parallel_pages (:obj:`int`, optional): when paging, load all the
+                following pages too, requesting this many at once. See
+                :meth:`MediaContainer.fetch_all
+                <plexdevices.media.MediaContainer.fetch_all>`.
+            max_stale (:obj:`float`, optional): serve a cached container up to
+                this many seconds past its ttl at once, while it is refreshed
+                in the background. Defaults to :attr:`max_stale`.
+            on_refresh (:obj:`callable`, optional): called with the new
+                :obj:`MediaContainer <plexdevices.media.MediaContainer>` when
+                a stale container has been refreshed.
 
         Returns:
             :obj:`MediaContainer <plexdevices.media.MediaContainer>`: an
             object representing a Plex Media Container.
 
         """
-        data = self.container(endpoint, size, page, params, **kwargs)
-        return plexdevices.media.MediaContainer(
-            self, data, endpoint, params, page, size)
+        def build(data):
+            return plexdevices.media.MediaContainer(
+                self, self._compact(data), endpoint, params, page, size)
+
+        if streaming:
+            container = build(self.stream_container(endpoint, size, page,
+                                                    params, **kwargs))
+        else:
+            container = self._cached_container(build, endpoint, size, page,
+                                               params, max_stale, on_refresh,
+                                               **kwargs)
+        if parallel_pages and size is not None and page is not None:
+            container.fetch_all(workers=parallel_pages,
+                                timeout=kwargs.get('timeout', 5))
+        return container
+
+    def iter_container(self, endpoint, page_size=100, params=None,
+                       streaming=False, **kwargs):
+        """Iterate over every item of a container, requesting it one page at
+        a time. Only the page being read is kept by the iterator, so memory
+        use does not grow with the size of the container.
+
+        Args:
+            endpoint (:obj:`str`): destination on the server.
+                e.g. ``/library/sections/1/all``.
+            page_size (:obj:`int`, optional): number of items per request.
+            params (:obj:`dict`, optional): Dictionary of parameters to be
+                added to the url in the request.
+            streaming (:obj:`bool`, optional): parse each page while it is
+                read, see :meth:`stream_container`.
+
+        Yields:
+            :obj:`BaseObject <plexdevices.media.BaseObject>`: the items. Each
+            one belongs to the :obj:`MediaContainer
+            <plexdevices.media.MediaContainer>` of its page.
+
+        """
+        page = 0
+        while True:
+            container = self.media_container(endpoint, page_size, page,
+                                             params, streaming=streaming,
+                                             **kwargs)
+            children, total = container.children, container.total_size
+            container = None
+            count = 0
+            for count, item in enumerate(children, 1):
+                yield item
+            children = None
+            page += 1
+            if count < page_size or page * page_size >= total:
+                return
 
     def image(self, endpoint, w=None, h=None, **kwargs):
         """If w and h are set, the server will transcode the image to the
@@ -241,10 +737,27 @@ class Server(Device):
         Returns:
              :obj:`requests.Response`
 
+        When :attr:`image_cache` is set, cached images are read from disk,
+        and the others are written to it as they are downloaded.
+
         """
+        cache = self.image_cache
+        if cache is not None:
+            key = plexdevices.cache.image_key(self.client_identifier,
+                                              endpoint, w, h)
+            res = cache.get(key)
+            if res is not None:
+                return res
+        res = self._image(endpoint, w, h, **kwargs)
+        if cache is not None and res.status_code == 200:
+            return cache.store(key, res)
+        return res
+
+    def _image(self, endpoint, w=None, h=None, **kwargs):
+        """Request an image, bypassing :attr:`image_cache`."""
         if endpoint.startswith('http'):
             log.debug('requesting image.')
-            return requests.get(endpoint, stream=True, **kwargs)
+            return self.http.get(endpoint, stream=True, **kwargs)
 
         if not w or not h:
             params = None
@@ -269,11 +782,12 @@ class Server(Device):
             'maxSize': 1
         }
         url = 'http://{}:{}/photo/:/transcode?X-Plex-Token={}&{}'.format(
-            self.active.address, self.active.port, self.access_token,
+            self.active.host, self.active.port, self.access_token,
             plexdevices.compat.urlencode(params))
         return url
 
-    def hub(self, endpoint, size=None, page=None, params=None, **kwargs):
+    def hub(self, endpoint, size=None, page=None, params=None, max_stale=None,
+            on_refresh=None, **kwargs):
         """`added in 0.4.0`
 
         Args:
@@ -281,14 +795,47 @@ class Server(Device):
                 e.g. ``/hubs/onDeck``.
             params (:obj:`dict`, optional): parameters to be added to the url
                 in the request.
+            max_stale (:obj:`float`, optional): see :meth:`media_container`.
+            on_refresh (:obj:`callable`, optional): see
+                :meth:`media_container`.
 
         Returns:
             :obj:`HubsContainer <plexdevices.hubs.HubsContainer>` an object
             representing a Media Container.
 
         """
-        data = self.container(endpoint, size, page, params, **kwargs)
-        return plexdevices.hubs.HubsContainer(self, data)
+        return self._cached_container(
+            lambda data: plexdevices.hubs.HubsContainer(self,
+                                                        self._compact(data)),
+            endpoint, size, page, params, max_stale, on_refresh, **kwargs)
+
+    def _compact(self, data):
+        return plexdevices.utils.compact(data) if self.compact else data
+
+    def _cached_container(self, build, endpoint, size, page, params,
+                          max_stale, on_refresh, **kwargs):
+        """Build a container with ``build``, marking whether it is stale."""
+        if max_stale is None:
+            max_stale = self.max_stale
+        if on_refresh is not None:
+            callback = on_refresh
+            on_refresh = lambda data: callback(build(data))
+        data, entry = self._container(endpoint, size, page, params, max_stale,
+                                      on_refresh, **kwargs)
+        container = build(data)
+        if entry is not None:
+            container.age = entry.age
+            container.stale = not entry.fresh
+        return container
+
+
+def _release_after(items, res):
+    """Yield from items, closing the response when done."""
+    try:
+        for item in items:
+            yield item
+    finally:
+        res.close()
 
 
 class Player(Device):
@@ -305,6 +852,8 @@ class Connection(object):
         self.active = False
         #: uri set by test()
         self.url = None
+        #: seconds the last successful test() took, or ``None``.
+        self.rtt = None
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -319,6 +868,14 @@ class Connection(object):
     def address(self):
         return self.data.get('address')
 
+    @property
+    def host(self):
+        """The address for a url, in brackets if it is an IPv6 address."""
+        address = self.address
+        if address and ':' in address:
+            return '[{}]'.format(address)
+        return address
+
     @property
     def port(self):
         return self.data.get('port')
@@ -334,17 +891,22 @@ class Connection(object):
     def __repr__(self):
         return '<{}:{}>'.format(self.__class__.__name__, self.uri)
 
-    def test(self, token, secure=False, timeout=1):
-        """Test the connection with the given X-Plex-Token."""
+    def test(self, token, secure=False, timeout=1, session=None):
+        """Test the connection with the given X-Plex-Token. If a
+        :obj:`requests.Session` is given, the probe goes through its pool so
+        the connection can be reused by later requests."""
+        http = requests if session is None else session
+        start = time.time()
         try:
             url = (self.uri if secure else
-                   'http://{}:{}'.format(self.address, self.port))
-            res = requests.get(url, timeout=timeout,
-                               headers={'X-Plex-Token': token})
+                   'http://{}:{}'.format(self.host, self.port))
+            res = http.get(url, timeout=timeout,
+                           headers={'X-Plex-Token': token})
         except (requests.exceptions.ConnectionError,
                 requests.exceptions.Timeout):
             self.active = False
         else:
             self.active = 200 <= res.status_code < 400
             self.url = url
+        self.rtt = time.time() - start if self.active else None
         return self.active
@@ -0,0 +1,602 @@
+"""
+Downloads of :obj:`Part <plexdevices.media.Part>` files.
+
+A :class:`SegmentedDownload` splits a file into byte ranges which are
+requested at once, each over its own connection, and written into place in a
+preallocated file. The progress is saved next to the file, so an interrupted
+download resumes where it stopped::
+
+    >>> part = movie.media[0].parts[0]
+    >>> part.download('/mnt/sync', segments=4)
+    '/mnt/sync/Movie (2016).mkv'
+
+A :class:`DownloadManager` downloads the parts of many items, from any
+number of servers, within a bandwidth limit::
+
+    >>> manager = DownloadManager('/mnt/sync', bandwidth=4 * 2 ** 20)
+    >>> manager.add(show, priority=1)
+    >>> manager.add(album)
+    >>> manager.wait()
+
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+
+import plexdevices.exceptions
+import plexdevices.media
+import plexdevices.utils
+log = logging.getLogger(__name__)
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class Segment(object):
+    """A byte range of the file, from ``start`` to ``end`` excluded, of which
+    everything before ``position`` has been written."""
+
+    def __init__(self, start, end, position=None):
+        self.start = start
+        self.end = end
+        self.position = start if position is None else position
+
+    def __repr__(self):
+        return '<Segment:{}-{} at {}>'.format(self.start, self.end,
+                                              self.position)
+
+    @property
+    def remaining(self):
+        """Bytes left to write."""
+        return self.end - self.position
+
+    @property
+    def done(self):
+        """``True`` once the whole range is written."""
+        return self.position >= self.end
+
+
+class SegmentedDownload(object):
+    """Download ``url`` to ``path`` with several range requests at once.
+
+    While downloading, the data is written to ``path + '.part'`` and the
+    progress to ``path + '.part.json'``. Both are replaced by ``path`` when
+    the download completes and its size is checked.
+
+    Args:
+        url (:obj:`str`): the file's url, including the token.
+        path (:obj:`str`): where the file is saved.
+        size (:obj:`int`, optional): expected size of the file. It is asked
+            from the server when not given. The server is asked anyway
+            before a download in several segments, to find whether it
+            supports range requests.
+        segments (:obj:`int`, optional): number of ranges requested at once.
+        session (:obj:`requests.Session`, optional): the session used for the
+            requests. Give the server's :attr:`http
+            <plexdevices.device.Device.http>` to reuse its connections.
+        headers (:obj:`dict`, optional): headers sent with each request.
+        max_retries (:obj:`int`, optional): attempts of a range which fail
+            without receiving any data before the download is abandoned.
+        retry_backoff (:obj:`float`, optional): seconds before the first
+            retry, doubling with each one.
+        timeout (:obj:`float`, optional): seconds to wait for the server.
+        progress (:obj:`callable`, optional): called with the number of bytes
+            downloaded and the size of the file as data arrives.
+        limiter (:obj:`RateLimiter <plexdevices.utils.RateLimiter>`,
+            optional): limits the bytes read per second.
+
+    """
+    #: Bytes read from the socket at a time.
+    chunk_size = 256 * 1024
+    #: Seconds between saves of the progress.
+    save_interval = 1.0
+
+    def __init__(self, url, path, size=None, segments=4, session=None,
+                 headers=None, max_retries=5, retry_backoff=0.5, timeout=30,
+                 progress=None, limiter=None):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.segment_count = max(1, segments)
+        self.session = session if session is not None else requests.Session()
+        self.headers = dict(headers or {})
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.progress = progress
+        self.limiter = limiter
+        #: :obj:`list` of the :class:`Segment` s of the file.
+        self.segments = []
+        self._lock = threading.Lock()
+        self._saved = 0
+        self._errors = []
+        self._cancelled = threading.Event()
+
+    def __repr__(self):
+        return '<{}:{}>'.format(self.__class__.__name__, self.path)
+
+    @property
+    def temp_path(self):
+        """The file being written."""
+        return self.path + '.part'
+
+    @property
+    def state_path(self):
+        """The file holding the progress."""
+        return self.path + '.part.json'
+
+    @property
+    def downloaded(self):
+        """Bytes written so far."""
+        return sum(x.position - x.start for x in self.segments)
+
+    def cancel(self):
+        """Stop a running download, keeping its progress, or the next
+        :meth:`run` if none is running. :meth:`run` can be called again to
+        resume it."""
+        self._cancelled.set()
+
+    def run(self):
+        """Download the file, resuming a previous attempt if there is one.
+
+        Returns:
+            :obj:`str`: the path of the file, or ``None`` if the download was
+            cancelled.
+
+        Raises:
+            :obj:`DownloadError <plexdevices.exceptions.DownloadError>`: if a
+            range keeps failing, or the file does not have the expected size.
+        """
+        if self._cancelled.is_set():
+            # cancelled before it started, the next run goes ahead.
+            self._cancelled.clear()
+            return None
+        if not (self.size is not None and self._resume()):
+            # ranges are only used once the server is known to support them.
+            if self.size is None or self.segment_count > 1:
+                self._probe()
+            if not self._resume():
+                self._allocate()
+        self._errors = []
+        pending = [x for x in self.segments if not x.done]
+        threads = [threading.Thread(target=self._work, args=(x,))
+                   for x in pending]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._save()
+        cancelled = self._cancelled.is_set()
+        self._cancelled.clear()
+        if self._errors:
+            raise self._errors[0]
+        if cancelled:
+            return None
+        return self._finish()
+
+    def _probe(self):
+        """Ask the server for the size of the file, checking it against the
+        expected one. Use a single segment if it does not support range
+        requests."""
+        DownloadError = plexdevices.exceptions.DownloadError
+        headers = dict(self.headers, Range='bytes=0-0')
+        res = self.session.get(self.url, headers=headers, stream=True,
+                               timeout=self.timeout)
+        size = None
+        try:
+            res.raise_for_status()
+            if res.status_code == 206:
+                match = CONTENT_RANGE.match(
+                    res.headers.get('Content-Range', ''))
+                if match is not None and match.group(3) != '*':
+                    size = int(match.group(3))
+            else:
+                self.segment_count = 1
+                if 'Content-Length' in res.headers:
+                    size = int(res.headers['Content-Length'])
+        finally:
+            res.close()
+        if size is None:
+            if self.size is None:
+                raise DownloadError(
+                    self.path, 'the server did not give the size of the file')
+        elif self.size is None:
+            self.size = size
+        elif size != self.size:
+            raise DownloadError(self.path, 'the file is {} bytes, not {}'
+                                .format(size, self.size))
+
+    def _resume(self):
+        """Load the progress of a previous attempt. ``False`` if there is
+        none for a file of this size."""
+        if not (os.path.exists(self.state_path) and
+                os.path.exists(self.temp_path)):
+            return False
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except ValueError:
+            return False
+        if (state.get('size') != self.size or
+                os.path.getsize(self.temp_path) != self.size):
+            return False
+        self.segments = [Segment(*x) for x in state['segments']]
+        log.debug('resuming {} at {} bytes.'.format(self.path,
+                                                    self.downloaded))
+        return True
+
+    def _allocate(self):
+        """Create the file at its full size and split it into segments."""
+        with open(self.temp_path, 'wb') as f:
+            f.truncate(self.size)
+        count = min(self.segment_count, self.size) or 1
+        step = self.size // count
+        bounds = [i * step for i in range(count)] + [self.size]
+        self.segments = [Segment(bounds[i], bounds[i + 1])
+                         for i in range(count)]
+        self._save()
+
+    def _work(self, segment):
+        failures = 0
+        while not (segment.done or self._errors or
+                   self._cancelled.is_set()):
+            position = segment.position
+            try:
+                self._fetch(segment)
+                if segment.done or self._cancelled.is_set():
+                    continue
+                # the response ended early.
+                error = IOError('the response ended at {}'.format(
+                    segment.position))
+            except plexdevices.exceptions.DownloadError as e:
+                self._errors.append(e)
+                return
+            except (requests.exceptions.RequestException, IOError) as e:
+                error = e
+            log.warning('download: {!r} failed: {!r}'.format(segment, error))
+            failures = 0 if segment.position > position else failures + 1
+            if failures > self.max_retries:
+                self._errors.append(plexdevices.exceptions.DownloadError(
+                    self.path, error))
+                return
+            self._cancelled.wait(self.retry_backoff *
+                                 2 ** max(0, failures - 1))
+
+    def _fetch(self, segment):
+        """Request the rest of ``segment`` and write it into place."""
+        headers = dict(self.headers, Range='bytes={}-{}'.format(
+            segment.position, segment.end - 1))
+        res = self.session.get(self.url, headers=headers, stream=True,
+                               timeout=self.timeout)
+        try:
+            res.raise_for_status()
+            self._check_response(res, segment)
+            # unbuffered, so the saved progress never runs ahead of the file.
+            with open(self.temp_path, 'r+b', buffering=0) as f:
+                f.seek(segment.position)
+                for chunk in res.iter_content(self.chunk_size):
+                    chunk = chunk[:segment.remaining]
+                    f.write(chunk)
+                    with self._lock:
+                        segment.position += len(chunk)
+                    self._progress()
+                    if self.limiter is not None:
+                        self.limiter.acquire(len(chunk))
+                    if segment.done or self._cancelled.is_set():
+                        break
+        finally:
+            res.close()
+
+    def _check_response(self, res, segment):
+        DownloadError = plexdevices.exceptions.DownloadError
+        if res.status_code != 206:
+            if segment.position == 0 and segment.end == self.size:
+                return
+            raise DownloadError(self.path,
+                                'the server does not support range requests')
+        match = CONTENT_RANGE.match(res.headers.get('Content-Range', ''))
+        if match is None or int(match.group(1)) != segment.position:
+            raise DownloadError(self.path, 'unexpected range {!r}'.format(
+                res.headers.get('Content-Range')))
+        if match.group(3) != '*' and int(match.group(3)) != self.size:
+            raise DownloadError(self.path, 'the file is {} bytes, not {}'
+                                .format(match.group(3), self.size))
+
+    def _progress(self):
+        if self.progress is not None:
+            self.progress(self.downloaded, self.size)
+        if time.time() - self._saved >= self.save_interval:
+            self._save()
+
+    def _save(self):
+        """Write the progress to :attr:`state_path`, atomically."""
+        with self._lock:
+            self._saved = time.time()
+            state = {'size': self.size,
+                     'segments': [[x.start, x.end, x.position]
+                                  for x in self.segments]}
+            tmp = self.state_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            plexdevices.utils.replace_file(tmp, self.state_path)
+
+    def _finish(self):
+        size = os.path.getsize(self.temp_path)
+        if size != self.size or self.downloaded != self.size:
+            raise plexdevices.exceptions.DownloadError(
+                self.path, 'expected {} bytes, got {}'.format(
+                    self.size, self.downloaded))
+        plexdevices.utils.replace_file(self.temp_path, self.path)
+        os.remove(self.state_path)
+        return self.path
+
+
+class DownloadTask(object):
+    """The download of one :obj:`Part <plexdevices.media.Part>` by a
+    :class:`DownloadManager`."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, part, path, priority, order):
+        #: The :obj:`Part <plexdevices.media.Part>`.
+        self.part = part
+        #: Where the file is saved.
+        self.path = path
+        #: Tasks with a higher priority start first.
+        self.priority = priority
+        #: One of :attr:`QUEUED`, :attr:`RUNNING`, :attr:`DONE` or
+        #: :attr:`FAILED`.
+        self.state = self.QUEUED
+        #: Bytes downloaded.
+        self.downloaded = 0
+        #: Size of the file, once known.
+        self.size = part.size
+        #: The :obj:`Exception` which made the task fail.
+        self.error = None
+        self._order = order
+        self._download = None
+
+    def __repr__(self):
+        return '<{}:{} {}>'.format(self.__class__.__name__, self.path,
+                                   self.state)
+
+    @property
+    def server(self):
+        """The :obj:`Server <plexdevices.device.Server>` of the part."""
+        return self.part.parent.parent.container.server
+
+    @property
+    def finished(self):
+        """``True`` once the task is done or failed."""
+        return self.state in (self.DONE, self.FAILED)
+
+
+class DownloadManager(object):
+    """Download the parts of items from any number of servers in the
+    background, by priority, using :class:`SegmentedDownload`.
+
+    Args:
+        directory (:obj:`str`): where the files are saved, keeping their names
+            on the server.
+        workers (:obj:`int`, optional): maximum downloads at once.
+        per_server (:obj:`int`, optional): maximum downloads at once from one
+            server.
+        bandwidth (:obj:`float`, optional): maximum bytes per second, shared
+            by all the downloads.
+        segments (:obj:`int`, optional): ranges requested at once for each
+            file.
+        progress (:obj:`callable`, optional): called with a
+            :class:`DownloadTask` as data arrives and when its state
+            changes.
+        **kwargs: args to pass to :class:`SegmentedDownload`.
+
+    Items are expanded into their parts when they are added: a
+    :obj:`MediaItem <plexdevices.media.MediaItem>` gives the parts of its
+    first media, and a :obj:`MediaDirectory
+    <plexdevices.media.MediaDirectory>`, such as a :obj:`Season
+    <plexdevices.media.Season>`, :obj:`Album <plexdevices.media.Album>` or
+    :obj:`PhotoAlbum <plexdevices.media.PhotoAlbum>`, the parts of the items
+    below it.
+    """
+
+    def __init__(self, directory, workers=4, per_server=2, bandwidth=None,
+                 segments=1, progress=None, **kwargs):
+        self.directory = directory
+        self.per_server = per_server
+        self.segments = segments
+        self.progress = progress
+        self.limiter = (None if bandwidth is None else
+                        plexdevices.utils.RateLimiter(bandwidth))
+        self._kwargs = kwargs
+        #: :obj:`list` of the :class:`DownloadTask` s, in the order they were
+        #: added.
+        self.tasks = []
+        self._keys = set()
+        self._paths = set()
+        self._active = {}
+        self._paused = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._work)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, item, priority=0):
+        """Queue the downloads of ``item``'s parts.
+
+        Args:
+            item: a :obj:`Part <plexdevices.media.Part>`, :obj:`Media
+                <plexdevices.media.Media>`, :obj:`MediaItem
+                <plexdevices.media.MediaItem>`, :obj:`MediaDirectory
+                <plexdevices.media.MediaDirectory>` or :obj:`MediaContainer
+                <plexdevices.media.MediaContainer>`.
+            priority (:obj:`int`, optional): tasks with a higher priority
+                start first.
+
+        Returns:
+            :obj:`list`: the new :class:`DownloadTask` s. Parts already added,
+            from the same server, are skipped. A part whose file name is
+            taken by another part is saved as ``name (2).ext``, and so on.
+        """
+        added = []
+        for part in self._parts(item):
+            server = part.parent.parent.container.server
+            key = (server.client_identifier, part.key)
+            with self._cond:
+                if key in self._keys:
+                    continue
+                self._keys.add(key)
+                path = self._unique_path(part.file_name)
+                self._paths.add(path)
+                task = DownloadTask(part, path, priority, len(self.tasks))
+                self.tasks.append(task)
+                self._cond.notify()
+            added.append(task)
+        return added
+
+    def _unique_path(self, file_name):
+        path = os.path.join(self.directory, file_name)
+        name, ext = os.path.splitext(path)
+        n = 1
+        while path in self._paths:
+            n += 1
+            path = '{} ({}){}'.format(name, n, ext)
+        return path
+
+    def pause(self):
+        """Stop the running downloads, keeping their progress, and start no
+        others until :meth:`resume`."""
+        with self._cond:
+            self._paused = True
+            running = [x for x in self.tasks
+                       if x.state == DownloadTask.RUNNING]
+        for task in running:
+            if task._download is not None:
+                task._download.cancel()
+
+    def resume(self):
+        """Restart the downloads after :meth:`pause`."""
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    @property
+    def paused(self):
+        """``True`` between :meth:`pause` and :meth:`resume`."""
+        return self._paused
+
+    def wait(self, timeout=None):
+        """Block until every task is done or failed.
+
+        Returns:
+            :obj:`bool`: ``False`` if ``timeout`` seconds passed first.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not all(x.finished for x in self.tasks):
+                remaining = (None if deadline is None else
+                             deadline - time.time())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        """Stop the downloads, keeping their progress, and the workers."""
+        self.pause()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _parts(self, item):
+        media = plexdevices.media
+        if isinstance(item, media.Part):
+            return [item]
+        if isinstance(item, media.Media):
+            return list(item.parts)
+        if isinstance(item, media.MediaItem):
+            return list(item.media[0].parts) if item.media else []
+        if isinstance(item, media.MediaDirectory):
+            item = item.container.server.media_container(item.key)
+        if isinstance(item, media.MediaContainer):
+            return [part for child in item.children
+                    if isinstance(child, (media.MediaItem,
+                                          media.MediaDirectory))
+                    for part in self._parts(child)]
+        raise TypeError('cannot download {!r}'.format(item))
+
+    def _next(self):
+        """The queued task with the highest priority whose server has a free
+        slot."""
+        tasks = [x for x in self.tasks if x.state == DownloadTask.QUEUED and
+                 self._active.get(x.server.client_identifier, 0) <
+                 self.per_server]
+        if not tasks:
+            return None
+        return min(tasks, key=lambda x: (-x.priority, x._order))
+
+    def _work(self):
+        while True:
+            with self._cond:
+                task = None
+                while not self._closed:
+                    task = None if self._paused else self._next()
+                    if task is not None:
+                        break
+                    self._cond.wait()
+                if task is None:
+                    return
+                server = task.server.client_identifier
+                self._active[server] = self._active.get(server, 0) + 1
+                task.state = DownloadTask.RUNNING
+            self._notify(task)
+            try:
+                download = self._download(task)
+                with self._cond:
+                    task._download = download
+                    paused = self._paused
+                path = None if paused else download.run()
+            except Exception as e:
+                log.error('download: {!r} failed: {!r}'.format(task, e))
+                state, task.error = DownloadTask.FAILED, e
+            else:
+                state = (DownloadTask.QUEUED if path is None else
+                         DownloadTask.DONE)
+            with self._cond:
+                self._active[server] -= 1
+                task.state = state
+                task._download = None
+                self._cond.notify_all()
+            self._notify(task)
+
+    def _download(self, task):
+        def progress(downloaded, size):
+            task.downloaded, task.size = downloaded, size
+            self._notify(task)
+
+        part = task.part
+        return SegmentedDownload(part.resolve_key(), task.path, part.size,
+                                 self.segments, session=task.server.http,
+                                 progress=progress, limiter=self.limiter,
+                                 **self._kwargs)
+
+    def _notify(self, task):
+        if self.progress is not None:
+            self.progress(task)
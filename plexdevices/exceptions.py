@@ -20,3 +20,25 @@ class PlexTVError(Exception):
 
 class RemoteCallbackError(Exception):
     pass
+
+
+class ParseError(ValueError):
+
+    def __init__(self, body, content_type, error):
+        self.body = body
+        self.content_type = content_type
+        self.error = error
+
+    def __str__(self):
+        return 'Unable to parse {} response: {} - {!r}'.format(
+            self.content_type or 'untyped', self.error, self.body[:80])
+
+
+class DownloadError(Exception):
+
+    def __init__(self, path, error):
+        self.path = path
+        self.error = error
+
+    def __str__(self):
+        return 'Download of {} failed: {}'.format(self.path, self.error)
@@ -1,52 +1,121 @@
+import threading
 import plexdevices.media
 import plexdevices.hubs
 import plexdevices.types
 
+#: Classes registered with :func:`register`, by
+#: ``(_elementType, has ratingKey, PlexType)``. ``None`` matches anything.
+_registry = {}
+#: Classes by ``(_elementType, has ratingKey, type string)``, for every
+#: known type string, built from :data:`_registry` on first use.
+_index = None
+_lock = threading.Lock()
+_MISSING = object()
 
-def media_factory(data):
-    t = media_type(data)
-    if data['_elementType'] == 'Directory':
-        if 'ratingKey' in data:
-            if t == plexdevices.types.PlexType.SEASON:
-                return plexdevices.media.Season
-            elif t == plexdevices.types.PlexType.SHOW:
-                return plexdevices.media.Show
-            elif t == plexdevices.types.PlexType.ARTIST:
-                return plexdevices.media.Artist
-            elif t == plexdevices.types.PlexType.ALBUM:
-                return plexdevices.media.Album
-            elif t == plexdevices.types.PlexType.PHOTO:
-                return plexdevices.media.PhotoAlbum
-            else:
-                return plexdevices.media.Directory
-        else:
-            if t == plexdevices.types.PlexType.PREFERENCES:
-                return plexdevices.media.PreferencesDirectory
-            elif t == plexdevices.types.PlexType.INPUT:
-                return plexdevices.media.InputDirectory
-            else:
-                return plexdevices.media.Directory
-    elif data['_elementType'] in ['Video', 'Track', 'Photo']:
-        if t == plexdevices.types.PlexType.EPISODE:
-            return plexdevices.media.Episode
-        elif t == plexdevices.types.PlexType.MOVIE:
-            return plexdevices.media.Movie
-        elif t == plexdevices.types.PlexType.TRACK:
-            return plexdevices.media.Track
-        elif t == plexdevices.types.PlexType.PHOTO:
-            return plexdevices.media.Photo
-        elif t == plexdevices.types.PlexType.CLIP:
-            return plexdevices.media.VideoClip
-    elif data['_elementType'] == 'Hub':
-        return plexdevices.hubs.Hub
+
+def register(cls, element_type, plex_type=None, rating_key=None):
+    """Make :func:`media_factory` return ``cls`` for items of a tag and type.
+
+    A registration replaces the ones with the same tag and type; without
+    ``rating_key`` it replaces them whatever their ``rating_key``. A more
+    specific registration wins over a less specific one. So subclasses of
+    the built-in classes can be used instead of them::
+
+        class MyMovie(plexdevices.media.Movie):
+            pass
+
+        plexdevices.factory.register(MyMovie, 'Video',
+                                     plexdevices.types.PlexType.MOVIE)
+
+    Args:
+        cls (:obj:`type`): the class, or ``None`` to skip those items.
+        element_type (:obj:`str`): the item's tag, e.g. ``Directory``.
+        plex_type (:obj:`int`, optional): a :class:`PlexType
+            <plexdevices.types.PlexType>`. Any type if not given.
+        rating_key (:obj:`bool`, optional): whether the item has a
+            ``ratingKey``. Either if not given.
+    """
+    global _index
+    with _lock:
+        _load_builtin()
+        if rating_key is None:
+            for flag in (True, False):
+                _registry.pop((element_type, flag, plex_type), None)
+        _registry[(element_type, rating_key, plex_type)] = cls
+        _index = None
+
+
+def _load_builtin():
+    if _registry:
+        return
+    media, hubs = plexdevices.media, plexdevices.hubs
+    t = plexdevices.types.PlexType
+    builtin = [
+        (media.Directory, 'Directory', None, None),
+        (media.Season, 'Directory', t.SEASON, True),
+        (media.Show, 'Directory', t.SHOW, True),
+        (media.Artist, 'Directory', t.ARTIST, True),
+        (media.Album, 'Directory', t.ALBUM, True),
+        (media.PhotoAlbum, 'Directory', t.PHOTO, True),
+        (media.PreferencesDirectory, 'Directory', t.PREFERENCES, False),
+        (media.InputDirectory, 'Directory', t.INPUT, False),
+        (hubs.Hub, 'Hub', None, None),
+    ] + [(cls, element, plex_type, None)
+         for element in ('Video', 'Track', 'Photo')
+         for cls, plex_type in ((media.Episode, t.EPISODE),
+                                (media.Movie, t.MOVIE),
+                                (media.Track, t.TRACK),
+                                (media.Photo, t.PHOTO),
+                                (media.VideoClip, t.CLIP))]
+    for cls, element, plex_type, rating_key in builtin:
+        _registry[(element, rating_key, plex_type)] = cls
+
+
+def _resolve(element_type, rating_key, plex_type):
+    for key in ((element_type, rating_key, plex_type),
+                (element_type, None, plex_type),
+                (element_type, rating_key, None),
+                (element_type, None, None)):
+        if key in _registry:
+            return _registry[key]
     return None
 
 
-def media_type(data):
+def _build_index():
+    global _index
+    with _lock:
+        if _index is None:
+            _load_builtin()
+            index = {}
+            elements = set(key[0] for key in _registry)
+            for type_str, plex_type in plexdevices.types._TYPES.items():
+                for element in elements:
+                    for rating_key in (True, False):
+                        index[(element, rating_key, type_str)] = _resolve(
+                            element, rating_key, plex_type)
+            _index = index
+        return _index
+
+
+def media_factory(data):
+    """Return the class of the item ``data``, or ``None`` if it is not a
+    known item."""
+    key = (data['_elementType'], 'ratingKey' in data, _type_string(data))
+    cls = (_index or _build_index()).get(key, _MISSING)
+    if cls is _MISSING:
+        # a type string or tag which is not in the index.
+        with _lock:
+            return _resolve(key[0], key[1], media_type(data))
+    return cls
+
+
+def _type_string(data):
     if 'settings' in data:
-        dtype = 'prefs'
+        return 'prefs'
     elif 'search' in data:
-        dtype = 'input'
-    else:
-        dtype = data.get('type', 'unknown')
-    return plexdevices.types.get_type(dtype)
+        return 'input'
+    return data.get('type', 'unknown')
+
+
+def media_type(data):
+    return plexdevices.types.get_type(_type_string(data))
@@ -1,5 +1,6 @@
 import plexdevices.media
 import plexdevices.factory
+import plexdevices.utils
 
 
 class HubsContainer(plexdevices.media.MediaContainer):
@@ -51,20 +52,23 @@ class Hub(HubsItemBase):
         self.data = data
         #: The :class:`HubsContainer <plexdevices.hubs.HubsContainer>` which holds this item.
         self.container = container
-        if '_children' in data:
-            #: List of :class:`BaseObject <BaseObject>`'s in the Hub.
-            self.children = []
-            for c in data['_children']:
-                cls = plexdevices.factory.media_factory(c)
-                if cls is not None:
-                    newclass = type('HubsItem', (cls, HubsItemBase, SearchMixin), {})
-                    item = newclass(c, self)
-                    item.container = container
-                    item.hub = self
-                    self.children.append(item)
-            del self.data['_children']
-        else:
-            self.children = []
+        #: :class:`LazyChildren <plexdevices.media.LazyChildren>` of the items in the Hub.
+        self.children = plexdevices.media.LazyChildren(data.pop('_children', ()), self._build)
+
+    def _build(self, data, cls):
+        newclass = plexdevices.utils.mixed_class(
+            'HubsItem', (cls, HubsItemBase, SearchMixin), __name__)
+        server = getattr(self.container, 'server', None)
+        if getattr(server, 'share_items', False) is True:
+            # a reused item belongs to the newest hub holding it.
+            return self._bind(server._shared_item(
+                newclass, data, lambda x: newclass(x, self)))
+        return self._bind(newclass(data, self))
+
+    def _bind(self, item):
+        item.container = self.container
+        item.hub = self
+        return item
 
     def __repr__(self):
         return '<{}: {} {}>'.format(self.__class__.__name__, self.title, self.type)
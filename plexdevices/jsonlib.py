@@ -0,0 +1,146 @@
+"""
+The JSON backend used to decode responses.
+
+The fastest installed library is used, in the order of :data:`BACKENDS`:
+`orjson`_, `ujson`_, `simplejson`_ and then the standard library's
+:mod:`json`. The choice can be forced with the ``PLEXDEVICES_JSON``
+environment variable, or at run time::
+
+    >>> plexdevices.jsonlib.use('json')
+    <Backend:json>
+
+All the backends decode :obj:`bytes` as well as :obj:`str`, and raise a
+:obj:`ValueError` on malformed input. ``python -m benchmarks.json_decode``
+compares the installed ones.
+
+.. _orjson: https://github.com/ijl/orjson
+.. _ujson: https://github.com/ultrajson/ultrajson
+.. _simplejson: https://github.com/simplejson/simplejson
+
+"""
+import json
+import logging
+import os
+import threading
+log = logging.getLogger(__name__)
+
+#: Names of the backends, fastest first.
+BACKENDS = ('orjson', 'ujson', 'simplejson', 'json')
+#: Environment variable naming the backend to use.
+ENV_VAR = 'PLEXDEVICES_JSON'
+
+
+class Backend(object):
+    """A JSON library.
+
+    Args:
+        name (:obj:`str`): the library's module name.
+        loads (:obj:`callable`): decodes :obj:`bytes` or :obj:`str`.
+        dumps (:obj:`callable`): encodes to a :obj:`str`.
+    """
+
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return '<Backend:{}>'.format(self.name)
+
+
+def _orjson():
+    import orjson
+    return Backend('orjson', orjson.loads,
+                   lambda obj: orjson.dumps(obj).decode('utf-8'))
+
+
+def _ujson():
+    import ujson
+    return Backend('ujson', ujson.loads, ujson.dumps)
+
+
+def _simplejson():
+    import simplejson
+    return Backend('simplejson', simplejson.loads, simplejson.dumps)
+
+
+def _json():
+    return Backend('json', json.loads, json.dumps)
+
+
+_LOADERS = {'orjson': _orjson, 'ujson': _ujson, 'simplejson': _simplejson,
+            'json': _json}
+_lock = threading.Lock()
+_backend = None
+
+
+def load_backend(name):
+    """Return the :class:`Backend` named ``name``.
+
+    Raises:
+        ValueError: if the name is not one of :data:`BACKENDS`.
+        ImportError: if the library is not installed.
+    """
+    if name not in _LOADERS:
+        raise ValueError('Unknown JSON backend: {!r}, expected one of '
+                         '{}'.format(name, ', '.join(BACKENDS)))
+    return _LOADERS[name]()
+
+
+def available():
+    """Return the :class:`Backend` s which are installed, fastest first."""
+    backends = []
+    for name in BACKENDS:
+        try:
+            backends.append(load_backend(name))
+        except ImportError:
+            pass
+    return backends
+
+
+def use(name=None):
+    """Select the backend used by :func:`loads` and :func:`dumps`.
+
+    Args:
+        name (:obj:`str`, optional): one of :data:`BACKENDS`. The fastest
+            installed one is used if not given.
+
+    Returns:
+        :obj:`Backend`: the selected backend.
+
+    Raises:
+        ValueError: if the name is unknown.
+        ImportError: if the named library is not installed.
+    """
+    global _backend
+    backend = available()[0] if name is None else load_backend(name)
+    with _lock:
+        _backend = backend
+    log.debug('using the {} JSON backend.'.format(backend.name))
+    return backend
+
+
+def backend():
+    """Return the selected :class:`Backend`. On first use, it is the one
+    named by the ``PLEXDEVICES_JSON`` environment variable if it can be
+    loaded, else the fastest installed one."""
+    if _backend is not None:
+        return _backend
+    name = os.environ.get(ENV_VAR)
+    if name:
+        try:
+            return use(name)
+        except (ValueError, ImportError) as e:
+            log.warning('{}={}: {}, detecting a backend.'.format(ENV_VAR,
+                                                                 name, e))
+    return use()
+
+
+def loads(s):
+    """Decode JSON :obj:`bytes` or :obj:`str` with the selected backend."""
+    return (_backend or backend()).loads(s)
+
+
+def dumps(obj):
+    """Encode ``obj`` to a JSON :obj:`str` with the selected backend."""
+    return (_backend or backend()).dumps(obj)
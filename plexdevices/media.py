@@ -1,59 +1,468 @@
 import os
 import logging
+import threading
 import time
 import datetime
+import weakref
+import plexdevices.cache
+import plexdevices.download
 import plexdevices.factory
 import plexdevices.compat
+import plexdevices.jsonlib
+import plexdevices.utils
 log = logging.getLogger(__name__)
 
+#: Endpoints whose containers show the watched state of items.
+WATCH_STATE_ENDPOINTS = ('/library/onDeck', '/library/recentlyAdded',
+                         '/library/recentlyViewed', '/library/sections',
+                         '/hubs')
+
+
+_UNKNOWN = object()
+
+
+class LazyChildren(plexdevices.compat.MutableSequence):
+    """The items of a container, kept as their data and built on first
+    access.
+
+    It is a mutable sequence like the :obj:`list` it replaces. Only the
+    items which are indexed, iterated over or compared are built, once; a
+    slice builds the items in its range and returns them as a :obj:`list`.
+    :func:`len`, ``+=``, ``+``, :meth:`reverse` and deletions build nothing,
+    ``in``, :meth:`index` and :meth:`count` only build the items whose data
+    could match, and :meth:`sort` builds every item.
+
+    Args:
+        data (:obj:`iterable`): the items' dictionaries.
+        build (:obj:`callable`): called with an item's dictionary and its
+            class from :func:`media_factory <plexdevices.factory.media_factory>`
+            to make the item.
+    """
+
+    def __init__(self, data=(), build=None):
+        self._data = list(data)
+        n = len(self._data)
+        self._builds = [build] * n
+        self._classes = [_UNKNOWN] * n
+        self._items = [None] * n
+        self._pending = n > 0
+
+    def _classify(self):
+        # drop the entries which the factory does not know, so that
+        # positions and len() match the list of items.
+        if not self._pending:
+            return
+        data, builds, classes, items = [], [], [], []
+        for entry in zip(self._data, self._builds, self._classes, self._items):
+            cls = entry[2]
+            if cls is _UNKNOWN:
+                cls = plexdevices.factory.media_factory(entry[0])
+                if cls is None:
+                    continue
+            data.append(entry[0])
+            builds.append(entry[1])
+            classes.append(cls)
+            items.append(entry[3])
+        self._data, self._builds, self._classes, self._items = data, builds, classes, items
+        self._pending = False
+
+    def _item(self, i):
+        item = self._items[i]
+        if item is None:
+            item = self._items[i] = self._builds[i](self._data[i], self._classes[i])
+        return item
+
+    def _lists(self):
+        return (self._data, self._builds, self._classes, self._items)
+
+    @staticmethod
+    def _entries(items):
+        """The entries of built items: their data, no builder, their class
+        and the item."""
+        return [(getattr(x, 'data', None), None, type(x), x) for x in items]
+
+    def _matches(self, item, start=0, stop=None):
+        """Yield the positions of the items equal to ``item``, building only
+        those whose data could match it."""
+        self._classify()
+        identity = getattr(item, '_identity', None)
+        identity = identity() if identity is not None else None
+        data = getattr(item, 'data', None)
+        for i in range(*slice(start, stop).indices(len(self._data))):
+            built = self._items[i]
+            if built is None:
+                d = self._data[i]
+                if identity is not None:
+                    if (d.get('ratingKey'),
+                            d.get('playQueueItemID')) != identity[1:]:
+                        continue
+                elif data is None or d != data:
+                    continue
+            if self._item(i) == item:
+                yield i
+
+    @property
+    def built(self):
+        """Number of items which have been built."""
+        return sum(1 for item in self._items if item is not None)
+
+    def __len__(self):
+        self._classify()
+        return len(self._data)
+
+    def __getitem__(self, index):
+        self._classify()
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(len(self._data)))]
+        if index < 0:
+            index += len(self._data)
+        if not 0 <= index < len(self._data):
+            raise IndexError('list index out of range')
+        return self._item(index)
+
+    def __setitem__(self, index, value):
+        self._classify()
+        if isinstance(index, slice):
+            entries = self._entries(value)
+            columns = list(zip(*entries)) or [(), (), (), ()]
+            # the first assignment raises before the others on a bad slice.
+            for values, column in zip(self._lists(), columns):
+                values[index] = list(column)
+        else:
+            # the first assignment raises IndexError before the others.
+            for values, x in zip(self._lists(), self._entries([value])[0]):
+                values[index] = x
+
+    def __delitem__(self, index):
+        self._classify()
+        for values in self._lists():
+            del values[index]
+
+    def insert(self, index, item):
+        """Insert a built item before ``index``."""
+        self._classify()
+        for values, x in zip(self._lists(), self._entries([item])[0]):
+            values.insert(index, x)
+
+    def __iter__(self):
+        self._classify()
+        i = 0
+        while i < len(self._data):
+            yield self._item(i)
+            i += 1
+            if self._pending:
+                self._classify()
+
+    def __contains__(self, item):
+        for _ in self._matches(item):
+            return True
+        return False
+
+    def __eq__(self, other):
+        if isinstance(other, (LazyChildren, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __getstate__(self):
+        self._classify()
+        return self.__dict__
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __add__(self, other):
+        if not isinstance(other, (LazyChildren, list)):
+            return NotImplemented
+        children = self.copy()
+        children.extend(other)
+        return children
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        children = LazyChildren()
+        children.extend(other)
+        children.extend(self)
+        return children
+
+    def __repr__(self):
+        return '<{}: {} items, {} built>'.format(self.__class__.__name__, len(self), self.built)
+
+    def copy(self):
+        """Return a shallow copy, sharing the items built so far."""
+        children = LazyChildren()
+        children.extend(self)
+        return children
+
+    def index(self, item, start=0, stop=None):
+        """Return the position of the first item equal to ``item``.
+
+        Raises:
+            ValueError: if it is not present.
+        """
+        for i in self._matches(item, start, stop):
+            return i
+        raise ValueError('{!r} is not in list'.format(item))
+
+    def count(self, item):
+        """Return the number of items equal to ``item``."""
+        return sum(1 for _ in self._matches(item))
+
+    def append(self, item):
+        """Add a built item to the end."""
+        for values, x in zip(self._lists(), self._entries([item])[0]):
+            values.append(x)
+
+    def extend(self, items):
+        """Add the items of another :class:`LazyChildren`, without building
+        them, or of an iterable of built items."""
+        if isinstance(items, LazyChildren):
+            for values, other in zip(self._lists(), items._lists()):
+                values.extend(list(other))
+            self._pending = self._pending or items._pending
+        else:
+            for values, column in zip(self._lists(),
+                                      zip(*self._entries(list(items)))):
+                values.extend(column)
+
+    def reverse(self):
+        """Reverse the items in place, without building them."""
+        for values in self._lists():
+            values.reverse()
+
+    def sort(self, key=None, reverse=False):
+        """Sort the items in place, like :meth:`list.sort`. Every item is
+        built."""
+        self._classify()
+        items = [self._item(i) for i in range(len(self._data))]
+        order = sorted(range(len(items)),
+                       key=(lambda i: items[i]) if key is None else
+                       (lambda i: key(items[i])), reverse=reverse)
+        for values in self._lists():
+            values[:] = [values[i] for i in order]
+
 
 class MediaContainer(object):
     """An object representing a Plex MediaContainer."""
+    #: ``True`` if the container was served from the cache after its ttl.
+    stale = False
+    #: Seconds since the container was received, when it came from the
+    #: cache.
+    age = 0
 
     def __init__(self, server, data, endpoint=None, params=None, page=0, size=None):
         #: Dictionary of the MediaContainer's values.
-        if type(data) is bytes:
-            data = plexdevices.utils.parse_response(data.decode())
-        elif type(data) is str:
+        if isinstance(data, (bytes, str)):
             data = plexdevices.utils.parse_response(data)
         self.data = data
         self._endpoint = endpoint
         self._params = params
         self._page = page
         self._size = size
+        self._read_ahead = None
         #: The :class:`Server <plexdevices.device.Server>` which this container was retrieved from.
         self.server = server
-        if '_children' in data:
-            #: List of items in the container.
-            self.children = []
-            for c in data['_children']:
-                cls = plexdevices.factory.media_factory(c)
-                if cls is not None:
-                    item = cls(c, self)
-                    self.children.append(item)
-            del self.data['_children']
-        else:
-            self.children = []
+        #: :class:`LazyChildren` of the items in the container.
+        self.children = LazyChildren(data.pop('_children', ()), self._build)
+
+    def _build(self, data, cls):
+        if getattr(self.server, 'share_items', False) is True:
+            item = self.server._shared_item(cls, data, lambda x: cls(x, self))
+            # a reused item belongs to the newest container holding it.
+            item.container = self
+            return item
+        return cls(data, self)
 
     def __len__(self):
         return len(self.children)
 
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            self.reached(index)
+        return self.children[index]
+
+    def __iter__(self):
+        for i, item in enumerate(self.children):
+            self.reached(i)
+            yield item
+
     def __eq__(self, other):
         if isinstance(other, self.__class__):
             return self.data == other.data
         return False
 
-    def fetch_more(self):
-        """ """
+    def fetch_more(self, timeout=5):
+        """Retrieve the next page of the container and append its items to
+        :attr:`children`. Use :meth:`Server.iter_container
+        <plexdevices.device.Server.iter_container>` to walk a large container
+        without keeping every page.
+
+        Args:
+            timeout (:obj:`float`, optional): seconds to wait for the server.
+
+        """
         if self._size is None:
             return
         if len(self.children) < self.total_size:
-            next_page = self.server.media_container(
-                self._endpoint, self._size, self._page + 1, self._params,
-                timeout=5)
+            next_page = self._fetch_page(self._page + 1, timeout)
             self._page += 1
             self.children += next_page.children
 
+    def fetch_all(self, workers=4, timeout=5):
+        """Retrieve all the remaining pages of the container, using
+        :attr:`total_size` to know how many there are. Up to ``workers`` pages
+        are requested at once and their items are appended to
+        :attr:`children` in order.
+
+        Args:
+            workers (:obj:`int`, optional): maximum concurrent requests.
+            timeout (:obj:`float`, optional): seconds to wait for each page.
+
+        """
+        if self._size is None:
+            return
+        last = (self.total_size - 1) // self._size
+        pages = range(self._page + 1, last + 1)
+
+        def fetch(page):
+            return self._fetch_page(page, timeout)
+
+        for next_page in plexdevices.utils.parallel_map(fetch, pages, workers):
+            self.children += next_page.children
+        self._page = max(self._page, last)
+
+    def read_ahead(self, threshold=0.75, max_pages=1, timeout=5):
+        """Prefetch the next pages in the background. Once the consumer has
+        reached ``threshold`` of the loaded :attr:`children`, up to
+        ``max_pages`` following pages are requested, so that
+        :meth:`fetch_more` can usually return without waiting.
+
+        The position is reported by indexing or iterating the container, or
+        with :meth:`reached`. Prefetching stops when the container is
+        garbage collected.
+
+        Args:
+            threshold (:obj:`float`, optional): fraction of the loaded items.
+            max_pages (:obj:`int`, optional): pages to keep ahead.
+            timeout (:obj:`float`, optional): seconds to wait for each page.
+
+        Raises:
+            ValueError: if the container was not requested with a page size.
+
+        """
+        if self._endpoint is None or not self._size:
+            raise ValueError('read_ahead needs a paged container.')
+        if self._read_ahead is not None:
+            self._read_ahead.cancel()
+        self._read_ahead = _ReadAhead(self, threshold, max_pages, timeout)
+
+    def reached(self, index):
+        """Tell the container the consumer has reached the item at
+        ``index``. This starts the :meth:`read_ahead` fetches when needed."""
+        read_ahead = self._read_ahead
+        if read_ahead is None or not self._size:
+            return
+        if index + 1 < len(self.children) * read_ahead.threshold:
+            return
+        last = (self.total_size - 1) // self._size
+        for page in range(self._page + 1,
+                          min(self._page + read_ahead.max_pages, last) + 1):
+            read_ahead.request(page)
+
+    def prefetch_images(self, kind='thumb', w=None, h=None, workers=4,
+                        start=0, stop=None, visible=None, cache=None,
+                        timeout=5):
+        """Download the images of the children into a cache, requesting up to
+        ``workers`` at once. Images already cached are skipped and the
+        :attr:`image_rate_limit
+        <plexdevices.device.Server.image_rate_limit>` of the server is
+        respected. Returns once every image has been tried.
+
+        Args:
+            kind (:obj:`str`, optional): the attribute holding the image key,
+                e.g. ``'thumb'`` or ``'art'``.
+            w (:obj:`int`, optional): width to transcode.
+            h (:obj:`int`, optional): height to transcode.
+            workers (:obj:`int`, optional): maximum concurrent requests.
+            start (:obj:`int`, optional): index of the first child.
+            stop (:obj:`int`, optional): index after the last child.
+            visible (:obj:`tuple`, optional): ``(first, last)`` indexes of the
+                children on screen. Their images are requested first, then
+                the others by distance to them.
+            cache (optional): where the images go, with the interface of
+                :obj:`ImageCache <plexdevices.cache.ImageCache>`. Defaults to
+                the server's :attr:`image_cache
+                <plexdevices.device.Server.image_cache>`.
+            timeout (:obj:`float`, optional): seconds to wait for each image.
+
+        Returns:
+            :obj:`int`: the number of images downloaded.
+
+        """
+        server = self.server
+        if cache is None:
+            cache = server.image_cache
+        if cache is None:
+            raise ValueError('prefetch_images needs an image cache.')
+        first, last = visible if visible is not None else (start, start)
+        jobs = plexdevices.compat.queue.PriorityQueue()
+        seen = set()
+        for i, item in enumerate(self.children[start:stop], start):
+            endpoint = getattr(item, kind, None)
+            key = plexdevices.cache.image_key(server.client_identifier,
+                                              endpoint, w, h)
+            if not endpoint or key in seen or key in cache:
+                continue
+            seen.add(key)
+            distance = max(first - i, i - last, 0)
+            jobs.put((distance, i, endpoint, key))
+        limiter = server.image_limiter
+        fetched = []
+
+        def work():
+            while True:
+                try:
+                    _, _, endpoint, key = jobs.get_nowait()
+                except plexdevices.compat.queue.Empty:
+                    return
+                if limiter is not None:
+                    limiter.acquire()
+                try:
+                    res = server._image(endpoint, w, h, timeout=timeout)
+                    if res.status_code == 200:
+                        cache.store(key, res).close()
+                        fetched.append(key)
+                    else:
+                        res.close()
+                except Exception as e:
+                    log.warning('prefetch_images: {} failed: {!r}'.format(
+                        endpoint, e))
+
+        threads = [threading.Thread(target=work)
+                   for _ in range(min(workers, jobs.qsize()))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(fetched)
+
+    def _fetch_page(self, page, timeout):
+        next_page = None
+        if self._read_ahead is not None:
+            next_page = self._read_ahead.take(page)
+        if next_page is None:
+            next_page = self.server.media_container(
+                self._endpoint, self._size, page, self._params,
+                timeout=timeout)
+        return next_page
+
     @property
     def identifier(self):
         return self.data.get('identifier')
@@ -99,6 +508,58 @@ class MediaContainer(object):
         return self.data.get('parentTitle')
 
 
+class _ReadAhead(object):
+    """Pages of a :class:`MediaContainer` fetched in background threads.
+    Only a weak reference to the container is kept, so it can be dropped while
+    fetches are running, which cancels them."""
+
+    def __init__(self, container, threshold, max_pages, timeout):
+        self.threshold = threshold
+        self.max_pages = max_pages
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._server = container.server
+        self._args = (container._endpoint, container._size)
+        self._params = container._params
+        self._timeout = timeout
+        self._owner = weakref.ref(container, lambda ref: self.cancel())
+
+    def request(self, page):
+        with self._lock:
+            if page in self._pages or self.cancelled.is_set():
+                return
+            fetch = self._pages[page] = [threading.Event(), None]
+        thread = threading.Thread(target=self._fetch, args=(page, fetch))
+        thread.daemon = True
+        thread.start()
+
+    def _fetch(self, page, fetch):
+        if not self.cancelled.is_set():
+            endpoint, size = self._args
+            try:
+                fetch[1] = self._server.media_container(
+                    endpoint, size, page, self._params, timeout=self._timeout)
+            except Exception as e:
+                log.warning('read ahead: page {} failed: {}'.format(page, e))
+        fetch[0].set()
+
+    def take(self, page):
+        """Return the page, waiting for it if it is being fetched, or
+        ``None`` if it was not requested or could not be fetched."""
+        with self._lock:
+            fetch = self._pages.pop(page, None)
+        if fetch is None:
+            return None
+        fetch[0].wait()
+        return fetch[1]
+
+    def cancel(self):
+        self.cancelled.set()
+        with self._lock:
+            self._pages.clear()
+
+
 class PlayQueue(MediaContainer):
     """An object representing a Plex PlayQueue. A PlayQueue is a playlist that is maintained by the server.
 
@@ -159,8 +620,9 @@ class PlayQueue(MediaContainer):
                                                item.data['playQueueItemID'])
         res = self.server.request(url, method='DELETE',
                                    headers={'Accept': 'application/json'})
+        self.server.invalidate_cache('/playQueues/{}'.format(self.id))
         if 200 <= res.status_code < 400:
-            self.__init__(self.server, plexdevices.compat.json.loads(res.text))
+            self.__init__(self.server, plexdevices.jsonlib.loads(res.content))
         else:
             log.error('playqueue: could not remove item from playqueue.')
 
@@ -175,8 +637,9 @@ class PlayQueue(MediaContainer):
                                    method='PUT',
                                    headers=headers,
                                    params={'type': media, 'uri': uri})
+        self.server.invalidate_cache('/playQueues/{}'.format(self.id))
         if 200 <= res.status_code < 400:
-            self.__init__(self.server, plexdevices.compat.json.loads(res.text))
+            self.__init__(self.server, plexdevices.jsonlib.loads(res.content))
         else:
             log.error('playqueue: could not add item to playqueue.')
 
@@ -240,7 +703,7 @@ class PlayQueue(MediaContainer):
                               method='POST',
                               headers=headers,
                               params={'type': media, 'uri': uri})
-        pqid = plexdevices.compat.json.loads(res.text)['playQueueID']
+        pqid = plexdevices.jsonlib.loads(res.content)['playQueueID']
         return cls(server, server.container('/playQueues/{}'.format(pqid)))
 
 
@@ -261,11 +724,33 @@ class BaseObject(object):
     def __repr__(self):
         return '<{}: {}>'.format(self.__class__.__name__, self.title)
 
+    def _identity(self):
+        """The server, ``ratingKey`` and ``playQueueItemID`` of the item, or
+        ``None`` if it has no ``ratingKey``."""
+        key = self.data.get('ratingKey')
+        if key is None:
+            return None
+        server = getattr(self.container, 'server', None)
+        return (getattr(server, 'client_identifier', None), key,
+                self.data.get('playQueueItemID'))
+
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, self.__class__):
+            identity = self._identity()
+            if identity is not None:
+                return identity == other._identity()
             return self.data == other.data
         return False
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        identity = self._identity()
+        return hash(identity if identity is not None else self.data.get('key'))
+
     @property
     def markable(self):
         return False
@@ -411,6 +896,7 @@ class Metadata(object):
             'key': self.rating_key,
             'identifier': self.container.identifier,
         })
+        self._invalidate_watch_state()
 
     def mark_unwatched(self):
         """Mark this item as unwatched on its server."""
@@ -422,15 +908,34 @@ class Metadata(object):
             'key': self.rating_key,
             'identifier': self.container.identifier,
         })
+        self._invalidate_watch_state()
+
+    def _invalidate_watch_state(self):
+        """Drop the cached containers which show this item's watched
+        state."""
+        rating_keys = [self.rating_key, self._parent_rating_key(),
+                       self._granparent_rating_key()]
+        endpoints = ['/library/metadata/{}'.format(x)
+                     for x in rating_keys if x is not None]
+        if self.container._endpoint is not None:
+            endpoints.append(self.container._endpoint)
+        self.container.server.invalidate_cache(
+            *(endpoints + list(WATCH_STATE_ENDPOINTS)))
 
 
 class MediaItem(BaseObject, Metadata):
     """An object representing a piece of Media."""
     def __init__(self, data, container):
         super(MediaItem, self).__init__(data, container)
-        #: List of :class:`Media <plexdevices.media.Media>` objects that hold information about the file.
-        self.media = [Media(x, self) for x in data['_children']
-                      if x['_elementType'] == 'Media']
+        self._media = None
+
+    @property
+    def media(self):
+        """List of :class:`Media <plexdevices.media.Media>` objects that hold information about the file."""
+        if self._media is None:
+            self._media = [Media(x, self) for x in self.data['_children']
+                           if x['_elementType'] == 'Media']
+        return self._media
 
     @property
     def in_progress(self):
@@ -821,9 +1326,15 @@ class Media(object):
     def __init__(self, data, parent):
         self.parent = parent
         self.data = data
-        #: List of :class:`Part <plexdevices.media.Part>` objects which references the actual files. Typically there is only one part.
-        self.parts = [Part(x, self) for x in data['_children']
-                      if x['_elementType'] == 'Part']
+        self._parts = None
+
+    @property
+    def parts(self):
+        """List of :class:`Part <plexdevices.media.Part>` objects which references the actual files. Typically there is only one part."""
+        if self._parts is None:
+            self._parts = [Part(x, self) for x in self.data['_children']
+                           if x['_elementType'] == 'Part']
+        return self._parts
 
     @property
     def video_resolution(self):
@@ -969,3 +1480,33 @@ class Part(object):
                                                  server.access_token)
         log.debug('resolved url: %s' % url)
         return url
+
+    def download(self, path, segments=4, progress=None, **kwargs):
+        """Download the file, requesting ``segments`` byte ranges at once.
+        An interrupted download resumes when it is started again with the
+        same path. See :class:`SegmentedDownload
+        <plexdevices.download.SegmentedDownload>`.
+
+        Args:
+            path (:obj:`str`): where the file is saved. If it is a directory,
+                the file keeps its name on the server.
+            segments (:obj:`int`, optional): number of ranges requested at
+                once.
+            progress (:obj:`callable`, optional): called with the number of
+                bytes downloaded and the size of the file.
+            **kwargs: args to pass to :class:`SegmentedDownload
+                <plexdevices.download.SegmentedDownload>`.
+
+        Returns:
+            :obj:`str`: the path of the file.
+
+        Raises:
+            :obj:`DownloadError <plexdevices.exceptions.DownloadError>`
+
+        """
+        server = self.parent.parent.container.server
+        if os.path.isdir(path):
+            path = os.path.join(path, self.file_name)
+        return plexdevices.download.SegmentedDownload(
+            self.resolve_key(), path, self.size, segments,
+            session=server.http, progress=progress, **kwargs).run()
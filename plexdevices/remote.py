@@ -88,7 +88,7 @@ class Remote(object):
         else:
             parsed = {k: v for k, v in container.items()}
             parsed.update({child.get('type'): {k: v for k, v in child.items()}
-                           for child in container.getchildren()})
+                           for child in container})
             return parsed
 
     def _create_server(self):
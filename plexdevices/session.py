@@ -1,10 +1,10 @@
 import logging
-import xml.etree.ElementTree as ET
 import uuid
 import requests
 import plexdevices.compat
 import plexdevices.device
 import plexdevices.exceptions
+import plexdevices.jsonlib
 import plexdevices.utils
 import plexdevices.users
 from plexdevices import __version__
@@ -33,12 +33,27 @@ class Session(object):
         """:obj:`list` of :obj:`User <plexdevices.users.User>` s that can be
         switched to."""
 
+        self._http = None
+
         if user is not None and password is not None:
             self.login(password)
 
     def __repr__(self):
         return '<{}:{}>'.format(self.__class__.__name__, self.token)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_http'] = None
+        return state
+
+    @property
+    def http(self):
+        """:obj:`requests.Session`: keep-alive transport used for plex.tv
+        requests."""
+        if getattr(self, '_http', None) is None:
+            self._http = plexdevices.utils.pooled_session(1, 2)
+        return self._http
+
     @property
     def headers(self):
         headers = {'X-Plex-Client-Identifier': self.identifier,
@@ -53,15 +68,11 @@ class Session(object):
         ``https://plex.tv/api/resources``
 
         """
-        prev_servers = self.servers
-        self.servers = []
-        prev_players = self.players
-        self.players = []
         try:
             log.debug('getting devices.')
-            res = requests.get('https://plex.tv/api/resources',
-                               headers=self.headers,
-                               params={'includeHttps': 1})
+            res = self.http.get('https://plex.tv/api/resources',
+                                headers=self.headers,
+                                params={'includeHttps': 1})
         except (requests.exceptions.ConnectionError,
                 requests.exceptions.Timeout) as e:
             log.error(str(e))
@@ -71,12 +82,21 @@ class Session(object):
             log.error('Response: %d - %s' % (res.status_code, res.text))
             raise plexdevices.exceptions.PlexTVError(res.status_code)
 
+        self._load_devices(res.status_code, res.text)
+
+    def _load_devices(self, status_code, text):
+        """Update :attr:`servers` and :attr:`players` from the body of a
+        ``https://plex.tv/api/resources`` response. Devices already known are
+        refreshed in place."""
+        prev_servers = self.servers
+        self.servers = []
+        prev_players = self.players
+        self.players = []
         try:
-            xml = ET.fromstring(res.text)
-            data = plexdevices.utils.parse_xml(xml)
+            data = plexdevices.utils.parse_xml_document(text)
         except Exception:
-            log.error('Response: %d - %s' % (res.status_code, res.text))
-            raise plexdevices.exceptions.PlexTVError(res.text)
+            log.error('Response: %d - %s' % (status_code, text))
+            raise plexdevices.exceptions.PlexTVError(text)
         else:
             for item in data['_children']:
                 if item['_elementType'] == 'error':
@@ -106,10 +126,10 @@ class Session(object):
         """
         try:
             log.debug('Signing in to plex.tv as "%s"' % self.user)
-            res = requests.post('https://plex.tv/users/sign_in.json',
-                                data={'user[login]': self.user,
-                                      'user[password]': password},
-                                headers=self.headers)
+            res = self.http.post('https://plex.tv/users/sign_in.json',
+                                 data={'user[login]': self.user,
+                                       'user[password]': password},
+                                 headers=self.headers)
         except (requests.exceptions.ConnectionError,
                 requests.exceptions.Timeout) as e:
             log.error(str(e))
@@ -120,7 +140,7 @@ class Session(object):
             raise plexdevices.exceptions.PlexTVError(res.status_code)
 
         try:
-            data = plexdevices.compat.json.loads(res.text)
+            data = plexdevices.jsonlib.loads(res.content)
         except Exception:
             log.error('Response: %d - %s' % (res.status_code, res.text))
             raise plexdevices.exceptions.PlexTVError(res.text)
@@ -137,14 +157,13 @@ class Session(object):
 
         """
         try:
-            res = requests.get('https://plex.tv/api/home/users',
-                               headers=self.headers)
+            res = self.http.get('https://plex.tv/api/home/users',
+                                headers=self.headers)
         except Exception as e:
             raise plexdevices.exceptions.PlexTVError(str(e))
         else:
             try:
-                xml = ET.fromstring(res.text)
-                data = plexdevices.utils.parse_xml(xml)
+                data = plexdevices.utils.parse_xml_document(res.content)
                 self.users = [
                     plexdevices.users.User(x, data['machineIdentifier'])
                     for x in data['_children']
@@ -174,12 +193,11 @@ class Session(object):
         """
         try:
             params = {'pin': pin} if pin is not None else None
-            res = requests.post(
+            res = self.http.post(
                 'https://plex.tv/api/home/users/{}/switch'.format(user.id),
                 headers=self.headers,
                 params=params)
-            xml = ET.fromstring(res.text)
-            data = plexdevices.utils.parse_xml(xml)
+            data = plexdevices.utils.parse_xml_document(res.content)
             log.debug(data)
             if data['_elementType'] == 'Response':
                 raise plexdevices.exceptions.PlexTVError(data['status'])
@@ -208,15 +226,14 @@ class Session(object):
         log.debug('manual_add_server: connecting to: ' + uri)
         params = {'X-Plex-Token': token} if token else {}
         try:
-            res = requests.get(uri, params=params)
+            res = self.http.get(uri, params=params)
         except Exception as e:
             raise ConnectionError(e)
         if 200 > res.status_code >= 400:
             log.error('Response: %d - %s' % (res.status_code, res.text))
             raise ConnectionError('Response: %d - %s' % (res.status_code,
                                                          res.text))
-        xml = ET.fromstring(res.text)
-        data = plexdevices.utils.parse_xml(xml)
+        data = plexdevices.utils.parse_xml_document(res.content)
         log.debug(data)
         device_data = {
             'name': data.get('friendlyName'),
@@ -1,33 +1,526 @@
+import io
+import os
 import re
+import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
-import json
+import requests
+import requests.adapters
+import plexdevices.compat
+import plexdevices.exceptions
+import plexdevices.jsonlib
+
+
+def pooled_session(pool_connections, pool_maxsize):
+    """Create a :obj:`requests.Session` with keep-alive connection pools of
+    the given size mounted for http and https."""
+    session = requests.Session()
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize))
+    return session
+
+
+class InternTable(object):
+    """Shares equal strings between parsed dictionaries.
+
+    Every element of a container repeats the same attribute names, and many
+    attributes take a few values only (``type``, ``videoCodec``,
+    ``videoResolution``...). The table keeps one copy of each name, and of
+    each value of an attribute until the attribute is seen with more than
+    ``max_values`` distinct values, when its values are no longer shared.
+
+    Args:
+        max_keys (:obj:`int`): maximum number of attribute names kept.
+        max_values (:obj:`int`): maximum number of distinct values kept per
+            attribute.
+        max_length (:obj:`int`): longer values are never shared.
+    """
+
+    def __init__(self, max_keys=1024, max_values=256, max_length=64):
+        self.max_keys = max_keys
+        self.max_values = max_values
+        self.max_length = max_length
+        self._keys = {}
+        self._values = {}
+
+    def __len__(self):
+        return len(self._keys) + sum(len(x) for x in self._values.values()
+                                     if x is not None)
+
+    def clear(self):
+        """Forget all the shared strings."""
+        self._keys = {}
+        self._values = {}
+
+    def key(self, name):
+        """Return the shared copy of an attribute name."""
+        shared = self._keys.get(name)
+        if shared is None:
+            if len(self._keys) >= self.max_keys:
+                return name
+            shared = self._keys.setdefault(name, name)
+            self._values.setdefault(shared, {})
+        return shared
+
+    def value(self, name, value):
+        """Return the shared copy of the ``value`` of attribute ``name``,
+        which must come from :meth:`key`."""
+        table = self._values.get(name)
+        if table is None:
+            return value
+        shared = table.get(value)
+        if shared is None:
+            if len(value) > self.max_length:
+                return value
+            if len(table) >= self.max_values:
+                # too many distinct values to be worth sharing.
+                self._values[name] = None
+                return value
+            shared = table.setdefault(value, value)
+        return shared
+
+    def node(self, attrib, tag):
+        """Return the dictionary of an element's attributes and tag, sharing
+        its strings."""
+        keys, values = self._keys, self._values
+        node = {}
+        for k, v in attrib.items():
+            k = keys.get(k) or self.key(k)
+            table = values.get(k)
+            if table is not None:
+                v = table.get(v) or self.value(k, v)
+            node[k] = v
+        node['_elementType'] = keys.get(tag) or self.key(tag)
+        return node
+
+    def tree(self, data):
+        """Share the keys and strings of parsed JSON ``data`` in place, and
+        return it."""
+        key, value = self.key, self.value
+        stack = [data] if isinstance(data, dict) else []
+        while stack:
+            node = stack.pop()
+            items = list(node.items())
+            node.clear()
+            for k, v in items:
+                k = key(k)
+                if isinstance(v, list):
+                    stack.extend(x for x in v if isinstance(x, dict))
+                elif isinstance(v, dict):
+                    stack.append(v)
+                elif isinstance(v, plexdevices.compat.str):
+                    v = value(k, v)
+                node[k] = v
+        return data
+
+
+#: The :class:`InternTable` used by the parsers, or ``None`` (the default)
+#: to not share strings. Sharing lowers the memory kept by large parsed
+#: containers, at the cost of slower parsing::
+#:
+#:     plexdevices.utils.strings = plexdevices.utils.InternTable()
+strings = None
+
+
+def _plain_node(attrib, tag):
+    node = dict(attrib)
+    node['_elementType'] = tag
+    return node
+
+
+def _node_builder():
+    return _plain_node if strings is None else strings.node
 
 
 def parse_xml(root):
-    children = root.getchildren()
-    x = {k: v for k, v in root.items()}
-    x['_elementType'] = root.tag
-    if len(children):
-        x['_children'] = [parse_xml(child) for child in children]
-    return x
+    """Convert an :obj:`xml.etree.ElementTree.Element` and its descendants
+    into dictionaries of their attributes, with the tag in ``_elementType``
+    and the children, if any, in ``_children``.
 
+    The tree is walked without recursion, so its depth is not limited.
+    """
+    make = _node_builder()
+    node = make(root.attrib, root.tag)
+    stack = [(root, node)]
+    pop, push = stack.pop, stack.append
+    while stack:
+        elem, parent = pop()
+        if not len(elem):
+            continue
+        children = parent['_children'] = []
+        add = children.append
+        for child in elem:
+            x = make(child.attrib, child.tag)
+            add(x)
+            if len(child):
+                push((child, x))
+    return node
 
-def parse_response(res):
-    try:
-        data = json.loads(res)
-    except Exception:
-        try:
-            # channels only return xml, maybe it's xml
-            xml = ET.fromstring(res)
-        except Exception:
-            return {}
+
+def parse_xml_document(source):
+    """Parse an XML document into the same dictionaries as
+    :func:`parse_xml`, without building the element tree first.
+
+    The document is read with :func:`iterparse
+    <xml.etree.ElementTree.iterparse>` and each element is cleared once its
+    dictionary is built, so memory is released as the parse goes.
+
+    Args:
+        source: the document as :obj:`bytes` or :obj:`str`, or a file-like
+            object.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    elif not hasattr(source, 'read'):
+        source = io.StringIO(source)
+    root = None
+    stack = []
+    push, pop = stack.append, stack.pop
+    make = _node_builder()
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            node = make(elem.attrib, elem.tag)
+            if stack:
+                parent = stack[-1]
+                children = parent.get('_children')
+                if children is None:
+                    parent['_children'] = [node]
+                else:
+                    children.append(node)
+            else:
+                root = node
+            push(node)
         else:
-            data = parse_xml(xml)
+            pop()
+            elem.clear()
+    return root
+
+
+def copy_tree(data):
+    """Copy a parsed container. Every dictionary and ``_children`` list is
+    copied, the values are shared."""
+    root = dict(data)
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        children = node.get('_children')
+        if children is not None:
+            node['_children'] = [dict(x) for x in children]
+            stack.extend(node['_children'])
+    return root
+
+
+class _Layout(object):
+    """The attribute names of a :class:`CompactDict` and their positions,
+    shared by all the dictionaries with the same names."""
+    __slots__ = ('names', 'positions')
+
+    def __init__(self, names):
+        self.names = names
+        self.positions = {name: i for i, name in enumerate(names)}
+
+
+_layouts = {}
+#: Maximum number of distinct layouts kept for sharing.
+MAX_LAYOUTS = 4096
+
+
+def _layout(names):
+    layout = _layouts.get(names)
+    if layout is None:
+        layout = _Layout(tuple(plexdevices.compat.intern(x)
+                               if isinstance(x, str) else x for x in names))
+        if len(_layouts) < MAX_LAYOUTS:
+            layout = _layouts.setdefault(layout.names, layout)
+    return layout
+
+
+class CompactDict(plexdevices.compat.MutableMapping):
+    """A dictionary which keeps its values in a list and its keys in a
+    layout shared with every other :class:`CompactDict` that has the same
+    keys, in the same order. Items of one type carry the same attributes, so
+    a library of them stores its attribute names once.
+
+    It is a drop-in replacement for the dictionaries of parsed items; see
+    :func:`compact`.
+    """
+    __slots__ = ('_layout', '_values')
+
+    def __init__(self, data=()):
+        if not isinstance(data, dict):
+            data = dict(data)
+        self._layout = _layout(tuple(data))
+        self._values = list(data.values())
+
+    def __getitem__(self, key):
+        return self._values[self._layout.positions[key]]
+
+    def __setitem__(self, key, value):
+        i = self._layout.positions.get(key)
+        if i is None:
+            self._layout = _layout(self._layout.names + (key,))
+            self._values.append(value)
+        else:
+            self._values[i] = value
+
+    def __delitem__(self, key):
+        i = self._layout.positions[key]
+        names = self._layout.names
+        self._layout = _layout(names[:i] + names[i + 1:])
+        del self._values[i]
+
+    def __contains__(self, key):
+        return key in self._layout.positions
+
+    def __iter__(self):
+        return iter(self._layout.names)
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, default=None):
+        i = self._layout.positions.get(key)
+        return default if i is None else self._values[i]
+
+    def copy(self):
+        return CompactDict(self)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, dict(self))
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+def compact(data):
+    """Convert the items of a parsed container, and their descendants, into
+    :class:`CompactDict` s. The container's own dictionary is kept, and a
+    ``_children`` iterator is converted as it is consumed."""
+    def convert(node):
+        node = CompactDict(node)
+        children = node.get('_children')
+        if children is not None:
+            node['_children'] = [convert(x) for x in children]
+        return node
+
+    children = data.get('_children')
+    if children is not None:
+        data = dict(data)
+        data['_children'] = (list(map(convert, children))
+                             if isinstance(children, list)
+                             else map(convert, children))
+    return data
+
+
+_classes = {}
+_classes_lock = threading.Lock()
+
+
+def mixed_class(name, bases, module, namespace=None):
+    """Return a class called ``name`` which derives from ``bases``.
+
+    Each combination is created once and reused, so that items which mix
+    in the same classes share one class. It is also set as an attribute of
+    ``module``, under a name unique to the combination, so that its
+    instances can be pickled.
+
+    Args:
+        name (:obj:`str`): the ``__name__`` of the class.
+        bases (:obj:`tuple`): its base classes.
+        module (:obj:`str`): the name of the module to keep it in.
+        namespace (:obj:`dict`, optional): its attributes, when it is
+            created.
+    """
+    key = (name, bases, module)
+    cls = _classes.get(key)
+    if cls is not None:
+        return cls
+    with _classes_lock:
+        cls = _classes.get(key)
+        if cls is None:
+            cls = type(name, bases, dict(namespace or {}))
+            scope = sys.modules[module]
+            qualname = '_'.join([name] + [x.__name__ for x in bases])
+            unique, i = qualname, 1
+            while getattr(scope, unique, cls) is not cls:
+                i += 1
+                unique = '{}{}'.format(qualname, i)
+            cls.__module__ = module
+            cls.__qualname__ = unique
+            setattr(scope, unique, cls)
+            _classes[key] = cls
+        return cls
+
+
+def parallel_map(func, items, workers):
+    """Call ``func`` on each of ``items`` using at most ``workers`` threads.
+
+    Returns:
+        :obj:`list`: the results, in the order of ``items``.
+
+    Raises:
+        The first exception raised by a call, once the running calls are
+        done. Items not yet started are skipped.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    jobs = plexdevices.compat.queue.Queue()
+    for job in enumerate(items):
+        jobs.put(job)
+
+    def work():
+        while not errors:
+            try:
+                i, item = jobs.get_nowait()
+            except plexdevices.compat.queue.Empty:
+                return
+            try:
+                results[i] = func(item)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=work)
+               for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def replace_file(src, dst):
+    """Rename ``src`` to ``dst``, replacing it if it exists. The rename is
+    atomic where the platform allows it."""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class RateLimiter(object):
+    """A token bucket allowing ``rate`` units per second on average, and up
+    to ``burst`` at once. It is safe to share between threads.
+
+    Args:
+        rate (:obj:`float`): units added to the bucket per second.
+        burst (:obj:`float`, optional): size of the bucket, the amount that
+            can be taken at once without waiting.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Take ``amount`` units from the bucket, sleeping until they are
+        available. Amounts larger than the bucket are allowed and wait for
+        the time they are worth."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def iter_xml(source):
+    """Parse an XML document from a file-like object while it is being read.
+
+    The root element's dictionary (without ``_children``) is yielded as soon
+    as its start tag is read, then the dictionary of each of its children as
+    soon as the child's end tag is read. The dictionaries have the same shape
+    as :func:`parse_xml` output. Parsed elements are cleared so only the
+    child being built is held in memory.
+    """
+    stack = []
+    root = None
+    make = _node_builder()
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            node = make(elem.attrib, elem.tag)
+            if len(stack) > 1:
+                parent = stack[-1]
+                if '_children' in parent:
+                    parent['_children'].append(node)
+                else:
+                    parent['_children'] = [node]
+            elif not stack:
+                root = elem
+                yield node
+            stack.append(node)
+        else:
+            node = stack.pop()
+            if len(stack) == 1:
+                root.clear()
+                yield node
+            elem.clear()
+
+
+def response_format(body, content_type=None):
+    """Return ``'json'`` or ``'xml'``, the format of a response body, from
+    its content type, or from its first character when the content type
+    does not tell. ``None`` if neither matches."""
+    content_type = (content_type or '').lower()
+    if 'json' in content_type:
+        return 'json'
+    if 'xml' in content_type:
+        return 'xml'
+    first = body.lstrip()[:1]
+    if first in (b'{', b'[', u'{', u'['):
+        return 'json'
+    if first in (b'<', u'<'):
+        return 'xml'
+    return None
+
+
+def parse_response(body, content_type=None):
+    """Parse a JSON or XML response body into a dictionary.
+
+    Args:
+        body (:obj:`bytes` or :obj:`str`): the body. Bytes are decoded by the
+            parser, without making a :obj:`str` of the whole body first.
+        content_type (:obj:`str`, optional): the ``Content-Type`` header,
+            which chooses the parser. The body is sniffed when it is not
+            given or names neither format.
+
+    Returns:
+        :obj:`dict`: the parsed container, ``{}`` for an empty body.
+
+    Raises:
+        :obj:`ParseError <plexdevices.exceptions.ParseError>`: if the body is
+        malformed.
+    """
+    if not body or not body.strip():
+        return {}
+    kind = response_format(body, content_type)
+    try:
+        if kind == 'json':
+            data = plexdevices.jsonlib.loads(body)
+            return data if strings is None else strings.tree(data)
+        elif kind == 'xml':
+            # channels only return xml.
+            data = parse_xml_document(body)
             if 'totalSize' not in data:
                 data['totalSize'] = 1
             return data
-    else:
-        return data
+    except (ValueError, ET.ParseError) as e:
+        raise plexdevices.exceptions.ParseError(body, content_type, e)
+    raise plexdevices.exceptions.ParseError(body, content_type,
+                                            'unknown format')
 
 RE1 = re.compile('(.)([A-Z][a-z]+)')
 RE2 = re.compile('([a-z0-9])([A-Z])')
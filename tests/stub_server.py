@@ -0,0 +1,141 @@
+"""
+A small threaded HTTP/1.1 server standing in for a Plex Media Server.
+"""
+import json
+import re
+import threading
+import socketserver
+
+import plexdevices.compat
+
+
+class StubHandler(plexdevices.compat.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path,
+                                     dict(self.headers.items())))
+        self.server.connections.add(self.client_address)
+        path = self.path.split('?', 1)[0]
+        route = self.server.routes.get(path, self.server.default)
+        if callable(route):
+            return route(self)
+        status, headers, body = route
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+    do_PUT = do_GET
+    do_DELETE = do_GET
+
+
+class StubServer(socketserver.ThreadingMixIn, plexdevices.compat.HTTPServer):
+    """Serve ``routes``, a dict of path to ``(status, headers, body)`` or to a
+    callable taking the request handler. Use as a context manager."""
+    daemon_threads = True
+
+    def __init__(self, routes=None, default=(200, {}, b'')):
+        plexdevices.compat.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                               StubHandler)
+        self.routes = routes or {}
+        self.default = default
+        self.requests = []
+        self.connections = set()
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+def server_data(stub, name='stub', provides='server', connections=None):
+    """Device data for a server whose only connection is the stub."""
+    if connections is None:
+        connections = [{'protocol': 'http', 'address': stub.address,
+                        'port': stub.port, 'local': '1',
+                        'uri': 'http://{}:{}'.format(stub.address, stub.port)}]
+    return {'name': name, 'product': 'Plex Media Server',
+            'clientIdentifier': name, 'provides': provides,
+            'accessToken': 'TOKEN', 'httpsRequired': '0',
+            '_children': connections}
+
+
+def paged_library(count, item_type='movie'):
+    """A handler serving a JSON container of ``count`` items which honours
+    the X-Plex-Container-Start and X-Plex-Container-Size headers."""
+    items = [{'_elementType': 'Video', 'type': item_type,
+              'ratingKey': str(i), 'key': '/library/metadata/{}'.format(i),
+              'title': 'Item {}'.format(i), '_children': []}
+             for i in range(count)]
+
+    def handler(request):
+        start = int(request.headers.get('X-Plex-Container-Start', 0))
+        size = int(request.headers.get('X-Plex-Container-Size', count))
+        page = items[start:start + size]
+        body = json.dumps({'_elementType': 'MediaContainer',
+                           'identifier': 'com.plexapp.plugins.library',
+                           'size': str(len(page)), 'totalSize': str(count),
+                           'offset': str(start), '_children': page}).encode()
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+    return handler
+
+
+def range_file(body, drops=0, drop_after=None, ranges=True):
+    """A handler serving ``body`` with support for single range requests.
+    The first ``drops`` responses are cut off after ``drop_after`` bytes,
+    half of the range by default, by closing the connection."""
+    state = {'drops': drops}
+    lock = threading.Lock()
+
+    def handler(request):
+        start, end = 0, len(body) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', request.headers.get('Range', ''))
+        partial = ranges and match is not None
+        if partial:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+        data = body[start:end + 1]
+        request.send_response(206 if partial else 200)
+        if partial:
+            request.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(body)))
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        with lock:
+            drop = state['drops'] > 0
+            state['drops'] -= drop
+        if drop:
+            cut = drop_after if drop_after is not None else len(data) // 2
+            request.wfile.write(data[:cut])
+            request.wfile.flush()
+            request.close_connection = True
+            return
+        request.wfile.write(data)
+    return handler
@@ -0,0 +1,107 @@
+"""
+plexdevices Tests
+
+asyncio API against a local stand-in server.
+"""
+import asyncio
+import json
+import time
+import unittest
+import unittest.mock
+
+import plexdevices
+
+try:
+    import plexdevices.aio
+except ImportError:
+    aio = None
+else:
+    aio = plexdevices.aio
+
+from .stub_server import StubServer, server_data
+
+ON_DECK = json.dumps({
+    '_elementType': 'MediaContainer', 'size': '1',
+    'identifier': 'com.plexapp.plugins.library',
+    '_children': [{'_elementType': 'Directory', 'key': '/library/sections/1',
+                   'title': 'Movies', 'type': 'movie'}]
+}).encode()
+
+
+def slow(request):
+    time.sleep(0.5)
+    request.send_response(200)
+    request.send_header('Content-Length', '0')
+    request.end_headers()
+
+
+@unittest.skipIf(aio is None, 'aiohttp is not installed')
+class TestAsyncServer(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer({
+            '/library/onDeck': (200, {'Content-Type': 'application/json'},
+                                ON_DECK),
+            '/slow': slow,
+        }).__enter__()
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+
+    def tearDown(self):
+        self.stub.__exit__()
+
+    def run_async(self, coro):
+        async def main():
+            async with aio.AsyncSession() as session:
+                return await coro(aio.AsyncServer(self.server, session))
+        return asyncio.run(main())
+
+    def test_media_container(self):
+        async def fetch(server):
+            return await asyncio.gather(*[
+                server.media_container('/library/onDeck') for _ in range(20)])
+        containers = self.run_async(fetch)
+        self.assertEqual(len(containers), 20)
+        for container in containers:
+            self.assertIsInstance(container, plexdevices.media.MediaContainer)
+            self.assertIs(container.server, self.server)
+            self.assertEqual(container.children[0].title, 'Movies')
+        self.assertIs(self.server.active, self.server.connections[0])
+
+    def test_timeout(self):
+        async def fetch(server):
+            await server.media_container('/library/onDeck')
+            return await server.container('/slow', timeout=0.1)
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_async(fetch)
+
+
+class _Response(object):
+    status = 401
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def text(self):
+        return '<errors><error>Invalid token.</error></errors>'
+
+
+@unittest.skipIf(aio is None, 'aiohttp is not installed')
+class TestAsyncSession(unittest.TestCase):
+
+    def test_refresh_devices_error(self):
+        async def refresh():
+            session = aio.AsyncSession()
+            session.session.servers = ['kept']
+            session._http = unittest.mock.Mock()
+            session._http.get.return_value = _Response()
+            with self.assertRaises(plexdevices.PlexTVError):
+                await session.refresh_devices()
+            return session.session.servers
+        self.assertEqual(asyncio.run(refresh()), ['kept'])
+
+
+if __name__ == "__main__":
+    unittest.main()
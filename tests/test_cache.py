@@ -0,0 +1,491 @@
+"""
+plexdevices Tests
+
+Container caches.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import plexdevices
+import plexdevices.cache
+import plexdevices.compat
+
+from .stub_server import StubServer, server_data, paged_library
+
+
+def key(endpoint, server='A'):
+    return plexdevices.cache.cache_key(server, endpoint)
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_lru_entries(self):
+        cache = plexdevices.cache.MemoryCache(max_entries=2)
+        cache.store(key('/a'), {}, 1)
+        cache.store(key('/b'), {}, 1)
+        cache.lookup(key('/a'))
+        cache.store(key('/c'), {}, 1)
+        self.assertIsNotNone(cache.get(key('/a')))
+        self.assertIsNone(cache.get(key('/b')))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_lru_bytes(self):
+        cache = plexdevices.cache.MemoryCache(max_bytes=100)
+        cache.store(key('/a'), {}, 60)
+        cache.store(key('/b'), {}, 60)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 60)
+
+    def test_ttls(self):
+        cache = plexdevices.cache.MemoryCache(
+            ttl=60, ttls={'/library': 30, '/library/onDeck': 0})
+        self.assertEqual(cache.ttl_for('/library/sections'), 30)
+        self.assertEqual(cache.ttl_for('/library/onDeck'), 0)
+        self.assertEqual(cache.ttl_for('/libraryX'), 60)
+        cache.store(key('/library/onDeck'), {}, 1)
+        self.assertFalse(cache.lookup(key('/library/onDeck')).fresh)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_invalidate(self):
+        cache = plexdevices.cache.MemoryCache()
+        for endpoint in ('/library/metadata/1', '/library/metadata/1/children',
+                         '/library/metadata/12'):
+            cache.store(key(endpoint), {}, 1)
+        cache.store(key('/library/metadata/1', server='B'), {}, 1)
+        cache.invalidate('A', '/library/metadata/1')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get(key('/library/metadata/12')))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+
+class TestServerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer({'/all': paged_library(3)}).__enter__()
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+        self.server.cache = plexdevices.cache.MemoryCache()
+
+    def tearDown(self):
+        self.stub.__exit__()
+
+    def test_hit(self):
+        first = self.server.media_container('/all')
+        second = self.server.media_container('/all')
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(len(second), 3)
+        self.assertIsNot(first.children[0].data, second.children[0].data)
+        self.assertEqual(self.server.cache.stats['hits'], 1)
+        self.server.media_container('/all', 2, 0)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_users_not_shared(self):
+        self.server.media_container('/all')
+        other = plexdevices.device.create_device(server_data(self.stub))
+        other.data['accessToken'] = 'OTHER'
+        other.cache = self.server.cache
+        other.media_container('/all')
+        self.assertEqual(len(self.stub.requests), 4)
+        self.assertEqual(self.stub.requests[3][2]['X-Plex-Token'], 'OTHER')
+        self.assertEqual(len(self.server.cache), 2)
+        key = other._cache_key('/all', None, None, None)
+        self.assertNotIn('OTHER', key)
+        self.assertIsNotNone(self.server.cache.lookup(key))
+
+    def test_mark_watched_invalidates(self):
+        container = self.server.media_container('/all')
+        container.children[0].mark_watched()
+        self.server.media_container('/all')
+        self.assertEqual(len(self.stub.requests), 4)
+        self.assertEqual(self.stub.requests[2][1].split('?')[0], '/:/scrobble')
+
+
+def etag_library(request):
+    """Serve a small container with an ETag, answering 304 when the request
+    carries it."""
+    if request.headers.get('If-None-Match') == '"v1"':
+        request.send_response(304)
+        request.send_header('ETag', '"v1"')
+        request.send_header('Content-Length', '0')
+        request.end_headers()
+        return
+    body = json.dumps({'_elementType': 'MediaContainer',
+                       '_children': [{'_elementType': 'Directory',
+                                      'key': 'a', 'title': 'A'}]}).encode()
+    request.send_response(200)
+    request.send_header('Content-Type', 'application/json')
+    request.send_header('ETag', '"v1"')
+    request.send_header('Content-Length', str(len(body)))
+    request.end_headers()
+    request.wfile.write(body)
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stub = StubServer({'/library/sections': etag_library}).__enter__()
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+
+    def tearDown(self):
+        self.stub.__exit__()
+        shutil.rmtree(self.directory)
+
+    def cache(self, **kwargs):
+        cache = plexdevices.cache.DiskCache(self.directory, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def requests(self):
+        return [x for x in self.stub.requests if x[1] == '/library/sections']
+
+    def test_user_directory(self):
+        with unittest.mock.patch.dict(os.environ, {'HOME': self.directory}):
+            cache = plexdevices.cache.DiskCache('~/containers')
+        self.addCleanup(cache.close)
+        self.assertEqual(cache.directory,
+                         os.path.join(self.directory, 'containers'))
+        self.assertTrue(os.path.isfile(os.path.join(cache.directory,
+                                                    'containers.db')))
+
+    def test_survives_restart(self):
+        self.server.cache = self.cache()
+        self.server.media_container('/library/sections')
+        self.server.cache = self.cache()
+        container = self.server.media_container('/library/sections')
+        self.assertEqual(container.children[0].title, 'A')
+        self.assertEqual(len(self.requests()), 1)
+        self.assertEqual(self.server.cache.hits, 1)
+
+    def test_revalidate(self):
+        self.server.cache = self.cache(ttl=0)
+        self.server.media_container('/library/sections')
+        container = self.server.media_container('/library/sections')
+        self.assertEqual(container.children[0].title, 'A')
+        requests = self.requests()
+        self.assertEqual(len(requests), 2)
+        self.assertNotIn('If-None-Match', requests[0][2])
+        self.assertEqual(requests[1][2]['If-None-Match'], '"v1"')
+
+    def test_memory_revalidate(self):
+        self.server.cache = plexdevices.cache.MemoryCache(ttl=0)
+        self.server.media_container('/library/sections')
+        entry = self.server.cache.get(self.server._cache_key(
+            '/library/sections', None, None, None))
+        stored = entry.stored
+        container = self.server.media_container('/library/sections')
+        self.assertEqual(len(container), 1)
+        self.assertEqual(self.requests()[1][2]['If-None-Match'], '"v1"')
+        self.assertGreaterEqual(entry.stored, stored)
+
+    def test_lru_bytes(self):
+        cache = self.cache(max_bytes=130)
+        for endpoint in ('/a', '/b', '/c'):
+            cache.set(key(endpoint), plexdevices.cache.DiskCacheEntry(
+                b'{}' * 20, 40, 60))
+            time.sleep(0.01)
+        cache.lookup(key('/a'))
+        cache.set(key('/d'), plexdevices.cache.DiskCacheEntry(b'{}', 40, 60))
+        self.assertIsNotNone(cache.get(key('/a')))
+        self.assertIsNone(cache.get(key('/b')))
+        self.assertEqual(cache.size, 120)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_invalidate(self):
+        cache = self.cache()
+        for endpoint in ('/library/metadata/1', '/library/metadata/12'):
+            cache.set(key(endpoint), plexdevices.cache.DiskCacheEntry(
+                b'{}', 2, 60))
+        cache.invalidate('A', '/library/metadata/1')
+        self.assertEqual(len(cache), 1)
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer({'/all': paged_library(3)}).__enter__()
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+        self.server.cache = plexdevices.cache.MemoryCache(ttl=0)
+        self.server.max_stale = 60
+        self.server.media_container('/all')
+
+    def tearDown(self):
+        self.stub.__exit__()
+
+    def test_refresh(self):
+        refreshed = []
+        done = threading.Event()
+
+        def on_refresh(container):
+            refreshed.append(container)
+            done.set()
+
+        container = self.server.media_container('/all', on_refresh=on_refresh)
+        self.assertTrue(container.stale)
+        self.assertGreater(container.age, 0)
+        self.assertEqual(len(container), 3)
+        self.assertTrue(done.wait(5))
+        self.assertFalse(refreshed[0].stale)
+        self.assertEqual(len(refreshed[0]), 3)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_refresh_parse_error(self):
+        self.stub.routes['/all'] = (
+            200, {'Content-Type': 'application/json'}, b'{"_children": [')
+        with self.assertLogs('plexdevices.device', 'WARNING') as logs:
+            self.assertTrue(self.server.media_container('/all').stale)
+            deadline = time.time() + 5
+            while not logs.records and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertIn('ParseError', logs.output[0])
+
+    def test_unreachable(self):
+        self.stub.__exit__()
+        self.stub = StubServer().__enter__()
+        self.server.retry_deadline = 0
+        hub = self.server.hub('/all')
+        self.assertTrue(hub.stale)
+        self.assertEqual(len(hub), 3)
+
+    def test_too_stale(self):
+        container = self.server.media_container('/all', max_stale=0)
+        self.assertFalse(container.stale)
+        self.assertEqual(len(self.stub.requests), 3)
+
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.stub = StubServer({
+            '/photo/:/transcode': (200, {'Content-Type': 'image/jpeg'},
+                                   b'x' * 1000),
+            '/poster.jpg': (200, {'Content-Type': 'image/jpeg'}, b'y' * 500),
+        }).__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+        self.server.image_cache = plexdevices.cache.ImageCache(self.directory)
+
+    def count(self, path):
+        return len([x for x in self.stub.requests
+                    if x[1].split('?')[0] == path])
+
+    def test_transcoded(self):
+        first = self.server.image('/library/metadata/1/thumb', 100, 150)
+        self.assertEqual(first.content, b'x' * 1000)
+        second = self.server.image('/library/metadata/1/thumb', 100, 150)
+        self.assertEqual(second.content, b'x' * 1000)
+        second.close()
+        self.assertEqual(self.count('/photo/:/transcode'), 1)
+        self.server.image('/library/metadata/1/thumb', 200, 300).close()
+        self.assertEqual(self.count('/photo/:/transcode'), 2)
+        cache = self.server.image_cache
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.size, 2000)
+        self.assertEqual(len(cache), 2)
+
+    def test_external(self):
+        url = 'http://{}:{}/poster.jpg'.format(self.stub.address,
+                                               self.stub.port)
+        for _ in range(2):
+            res = self.server.image(url)
+            self.assertEqual(res.content, b'y' * 500)
+            res.close()
+        self.assertEqual(self.count('/poster.jpg'), 1)
+
+    def test_lru_bytes(self):
+        cache = plexdevices.cache.ImageCache(self.directory, max_bytes=3500)
+        self.server.image_cache = cache
+        for i in range(3):
+            self.server.image('/thumb/{}'.format(i), 10, 10).close()
+            time.sleep(0.01)
+        self.server.image('/thumb/0', 10, 10).close()
+        self.server.image('/thumb/3', 10, 10).close()
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.size, 3000)
+        self.assertTrue(os.path.exists(cache.path(
+            plexdevices.cache.image_key('stub', '/thumb/0', 10, 10))))
+        self.assertFalse(os.path.exists(cache.path(
+            plexdevices.cache.image_key('stub', '/thumb/1', 10, 10))))
+
+    def test_evicts_to_low_water(self):
+        cache = plexdevices.cache.ImageCache(self.directory, max_bytes=5000)
+        self.server.image_cache = cache
+        for i in range(6):
+            self.server.image('/thumb/{}'.format(i), 10, 10).close()
+            time.sleep(0.01)
+        self.assertEqual(cache.evictions, 2)
+        self.assertEqual(cache.size, 4000)
+        scans = []
+        files = cache._files
+        cache._files = lambda: scans.append(1) or files()
+        self.server.image('/thumb/6', 10, 10).close()
+        self.assertEqual(scans, [])
+        self.assertEqual(cache.size, 5000)
+
+    def test_survives_restart(self):
+        self.server.image('/thumb', 10, 10).close()
+        cache = plexdevices.cache.ImageCache(self.directory)
+        self.assertEqual(cache.size, 1000)
+        res = cache.get(plexdevices.cache.image_key('stub', '/thumb', 10, 10))
+        self.assertEqual(len(res.content), 1000)
+        res.close()
+
+
+def query(path):
+    return dict(x.split('=', 1) for x in path.split('?', 1)[1].split('&'))
+
+
+class TestPrefetchImages(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.stub = StubServer({
+            '/all': paged_library(20),
+            '/photo/:/transcode': (200, {}, b'x' * 100),
+        }).__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+        self.server.image_cache = plexdevices.cache.ImageCache(self.directory)
+        self.container = self.server.media_container('/all')
+        for item in self.container.children:
+            item.data['thumb'] = '{}/thumb'.format(item.key)
+
+    def transcoded(self):
+        return [plexdevices.compat.unquote_plus(query(x[1])['url'])
+                for x in self.stub.requests
+                if x[1].startswith('/photo/:/transcode')]
+
+    def test_prefetch(self):
+        self.assertEqual(self.container.prefetch_images(w=10, h=15), 20)
+        self.assertEqual(len(self.server.image_cache), 20)
+        self.assertEqual(self.container.prefetch_images(w=10, h=15), 0)
+        self.server.image(self.container[5].thumb, 10, 15).close()
+        self.assertEqual(len(self.transcoded()), 20)
+        self.assertEqual(self.server.image_cache.stats['hits'], 1)
+
+    def test_visible_first(self):
+        self.container.prefetch_images(w=10, h=15, workers=1, start=5,
+                                       visible=(10, 11))
+        self.assertEqual(self.transcoded()[:4], [
+            '/library/metadata/10/thumb', '/library/metadata/11/thumb',
+            '/library/metadata/9/thumb', '/library/metadata/12/thumb'])
+        self.assertEqual(len(self.transcoded()), 15)
+
+    def test_rate_limit(self):
+        self.server.image_rate_limit = 20
+        start = time.time()
+        self.container.prefetch_images(w=10, h=15, stop=10, workers=10)
+        self.assertGreater(time.time() - start, 0.4)
+
+    def test_requires_cache(self):
+        self.server.image_cache = None
+        with self.assertRaises(ValueError):
+            self.container.prefetch_images()
+
+
+class TestCoalescing(unittest.TestCase):
+
+    def slow(self, request):
+        time.sleep(0.3)
+        body = json.dumps({'_elementType': 'MediaContainer',
+                           '_children': [{'_elementType': 'Directory',
+                                          'key': 'a', 'title': 'A'}]})
+        request.send_response(200)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body.encode())
+
+    def count(self, stub):
+        return len([x for x in stub.requests if x[1] == '/library/onDeck'])
+
+    def fetch_concurrently(self, server, count):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            server.media_container('/library/onDeck'))) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesce(self):
+        with StubServer({'/library/onDeck': self.slow}) as stub:
+            server = plexdevices.device.create_device(server_data(stub))
+            results = self.fetch_concurrently(server, 5)
+            self.assertEqual(self.count(stub), 1)
+            self.assertEqual([len(x) for x in results], [1] * 5)
+            self.assertEqual(len(set(id(x.children[0].data)
+                                     for x in results)), 5)
+
+    def test_tokens_not_shared(self):
+        def on_deck(request):
+            time.sleep(0.3)
+            body = json.dumps({'_elementType': 'MediaContainer', '_children': [
+                {'_elementType': 'Directory', 'key': 'a',
+                 'title': request.headers['X-Plex-Token']}]})
+            request.send_response(200)
+            request.send_header('Content-Length', str(len(body)))
+            request.end_headers()
+            request.wfile.write(body.encode())
+
+        with StubServer({'/library/onDeck': on_deck}) as stub:
+            servers = [plexdevices.device.create_device(server_data(stub))
+                       for _ in range(2)]
+            servers[1].data['accessToken'] = 'OTHER'
+            results = {}
+            threads = [threading.Thread(target=lambda x=x: results.update({
+                x.access_token: x.media_container('/library/onDeck')}))
+                for x in servers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(self.count(stub), 2)
+            self.assertEqual(dict((k, v.children[0].title)
+                                  for k, v in results.items()),
+                             {'TOKEN': 'TOKEN', 'OTHER': 'OTHER'})
+
+    def test_disabled(self):
+        with StubServer({'/library/onDeck': self.slow}) as stub:
+            server = plexdevices.device.create_device(server_data(stub))
+            server.coalesce_requests = False
+            self.fetch_concurrently(server, 3)
+            self.assertEqual(self.count(stub), 3)
+
+    def test_error_shared(self):
+        flight = plexdevices.cache.SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            time.sleep(0.2)
+            raise ValueError('boom')
+
+        def follower():
+            started.wait()
+            try:
+                flight.do('k', lambda: None)
+            except ValueError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=follower)
+        thread.start()
+        with self.assertRaises(ValueError):
+            flight.do('k', fail)
+        thread.join()
+        self.assertEqual(len(errors), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
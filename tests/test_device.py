@@ -0,0 +1,341 @@
+"""
+plexdevices Tests
+
+Device transport and connection handling against a local stand-in server.
+"""
+import gc
+import pickle
+import threading
+import time
+import unittest
+import unittest.mock
+
+import requests
+
+import plexdevices
+
+from .stub_server import StubServer, server_data, paged_library
+from .xml_samples import SAMPLE_MOVIES
+
+XML = {'Content-Type': 'text/xml;charset=utf-8'}
+
+
+class TestTransport(unittest.TestCase):
+
+    def test_keep_alive(self):
+        with StubServer() as stub:
+            server = plexdevices.device.create_device(server_data(stub))
+            for _ in range(5):
+                server.request('/library/onDeck')
+            self.assertEqual(len(stub.requests), 6)
+            self.assertEqual(len(stub.connections), 1)
+            server.close()
+
+    def test_pool_limits(self):
+        server = plexdevices.device.create_device({
+            'provides': 'server',
+            '_children': []
+        })
+        server.configure_pool(pool_connections=2, pool_maxsize=3)
+        adapter = server.http.get_adapter('http://localhost')
+        self.assertIsInstance(server.http, requests.Session)
+        self.assertEqual(adapter._pool_connections, 2)
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_one_transport_across_threads(self):
+        server = plexdevices.device.create_device({
+            'provides': 'server',
+            '_children': []
+        })
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(
+            server.http)) for _ in range(20)]
+        with unittest.mock.patch('plexdevices.utils.pooled_session',
+                                 side_effect=lambda *a: time.sleep(0.05) or
+                                 requests.Session()) as pooled_session:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(pooled_session.call_count, 1)
+        self.assertEqual(len(set(id(x) for x in sessions)), 1)
+
+    def test_pickle_rebuilds_transport(self):
+        server = plexdevices.device.create_device({
+            'provides': 'server',
+            '_children': []
+        })
+        server.configure_pool(pool_maxsize=7)
+        server.http
+        unpickled = pickle.loads(pickle.dumps(server))
+        self.assertIsNone(unpickled._http)
+        self.assertEqual(unpickled.pool_maxsize, 7)
+        self.assertIsInstance(unpickled.http, requests.Session)
+        self.assertIsNot(unpickled.http, server.http)
+
+    def test_pickle_plain_device(self):
+        client = plexdevices.device.create_device({
+            'provides': 'client',
+            '_children': []
+        })
+        self.assertIs(type(client), plexdevices.device.Device)
+        self.assertIs(type(pickle.loads(pickle.dumps(client))),
+                      plexdevices.device.Device)
+
+    def test_device_classes_shared(self):
+        data = {'provides': 'server,player', '_children': []}
+        first = plexdevices.device.create_device(data)
+        second = plexdevices.device.create_device(dict(data))
+        self.assertIs(type(first), type(second))
+        self.assertIsInstance(first, plexdevices.device.Server)
+        self.assertIsInstance(first, plexdevices.device.Player)
+        self.assertIs(type(pickle.loads(pickle.dumps(first))), type(first))
+
+
+def slow(seconds):
+    def handler(request):
+        time.sleep(seconds)
+        request.send_response(200)
+        request.send_header('Content-Length', '0')
+        request.end_headers()
+    return handler
+
+
+def connection(stub, local):
+    return {'protocol': 'http', 'address': stub.address, 'port': stub.port,
+            'uri': 'http://{}:{}'.format(stub.address, stub.port),
+            'local': str(int(local))}
+
+
+class TestConnectionRace(unittest.TestCase):
+
+    def test_fastest_wins(self):
+        with StubServer(default=slow(0.5)) as slow_stub, \
+                StubServer() as fast_stub:
+            server = plexdevices.device.create_device(server_data(
+                None, connections=[connection(slow_stub, False),
+                                   connection(fast_stub, False)]))
+            start = time.time()
+            active = server._active_connection()
+            self.assertLess(time.time() - start, 0.4)
+            self.assertIs(active, server.connections[1])
+            self.assertIsNotNone(active.rtt)
+            self.assertFalse(server.connections[0].active)
+
+    def test_prefers_local(self):
+        with StubServer() as remote_stub, \
+                StubServer(default=slow(0.05)) as local_stub:
+            server = plexdevices.device.create_device(server_data(
+                None, connections=[connection(remote_stub, False),
+                                   connection(local_stub, True)]))
+            server.local_preference = 0.5
+            self.assertIs(server._active_connection(), server.connections[1])
+
+    def test_probe_error(self):
+        with StubServer(default=(500, {}, b'')) as stub:
+            server = plexdevices.device.create_device(server_data(
+                None, connections=[connection(stub, True),
+                                   connection(stub, False)]))
+            test = server._test_connection
+
+            def broken(conn):
+                if conn.local:
+                    raise requests.exceptions.InvalidURL(conn.uri)
+                return test(conn)
+            server._test_connection = broken
+            self.assertIsNone(server._active_connection())
+            self.assertFalse(server.connections[0].active)
+
+    def test_ipv6_host(self):
+        conn = plexdevices.device.Connection({'address': '::1',
+                                              'port': 32400})
+        self.assertEqual(conn.host, '[::1]')
+        server = plexdevices.device.create_device(server_data(
+            None, connections=[dict(conn.data, protocol='http', local='1')]))
+        self.assertEqual(server._url(conn, '/library'),
+                         'http://[::1]:32400/library')
+
+    def test_all_fail(self):
+        with StubServer(default=(500, {}, b'')) as stub:
+            server = plexdevices.device.create_device(server_data(
+                None, connections=[connection(stub, False),
+                                   connection(stub, True)]))
+            self.assertIsNone(server._active_connection())
+            self.assertIsNone(server.connections[0].rtt)
+
+
+class TestFailover(unittest.TestCase):
+
+    def setUp(self):
+        dead = StubServer()
+        dead.server_close()
+        self.dead = dead
+
+    def create_server(self, stub):
+        server = plexdevices.device.create_device(server_data(
+            None, connections=[connection(self.dead, True),
+                               connection(stub, False)]))
+        server.retry_backoff = 0.01
+        server.active = server.connections[0]
+        return server
+
+    def test_get_fails_over(self):
+        with StubServer() as stub:
+            server = self.create_server(stub)
+            server.request('/library/onDeck')
+            self.assertIs(server.active, server.connections[1])
+            self.assertEqual(server.failovers, 1)
+            self.assertEqual(server.retries, 1)
+
+    def test_post_not_retried(self):
+        with StubServer() as stub:
+            server = self.create_server(stub)
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                server.request('/playQueues', method='POST')
+            self.assertEqual(server.failovers, 1)
+            self.assertEqual(server.retries, 0)
+            server.request('/playQueues', method='POST')
+            self.assertIs(server.active, server.connections[1])
+
+    def test_deadline(self):
+        server = plexdevices.device.create_device(server_data(
+            None, connections=[connection(self.dead, True)]))
+        server.active = server.connections[0]
+        server.retry_deadline = 0
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            server.request('/library/onDeck')
+        self.assertEqual(server.retries, 0)
+        self.assertIsNone(server.active)
+
+    def test_selection_retried(self):
+        server = plexdevices.device.create_device(server_data(
+            None, connections=[connection(self.dead, True)]))
+        server.retry_backoff = 0.01
+        server.max_retries = 3
+        with self.assertRaises(ConnectionError):
+            server.request('/library/onDeck')
+        self.assertEqual(server.retries, 3)
+
+    def test_read_timeout_not_failed_over(self):
+        with StubServer({'/slow': slow(0.5)}) as stub:
+            server = self.create_server(stub)
+            server.active = server.connections[1]
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                server.request('/slow', timeout=0.1)
+            self.assertIs(server.active, server.connections[1])
+            self.assertEqual((server.failovers, server.retries), (0, 0))
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer({
+            '/library/sections/2/all': (200, XML, SAMPLE_MOVIES.encode()),
+        }).__enter__()
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+
+    def tearDown(self):
+        self.stub.__exit__()
+
+    def test_stream_container(self):
+        data = self.server.stream_container('/library/sections/2/all')
+        self.assertEqual(data['_elementType'], 'MediaContainer')
+        self.assertEqual(data['totalSize'], '255')
+        first = next(data['_children'])
+        self.assertEqual(first['title'], 'Confirmation')
+        self.assertEqual(first['_children'][0]['_children'][0]['_elementType'],
+                         'Part')
+        self.assertEqual(len(list(data['_children'])), 15)
+
+    def test_streaming_media_container(self):
+        container = self.server.media_container('/library/sections/2/all',
+                                                streaming=True)
+        self.assertEqual(len(container), 16)
+        self.assertNotIn('_children', container.data)
+        for item in container.children:
+            self.assertIsInstance(item, plexdevices.media.Movie)
+        self.assertEqual(self.stub.requests[-1][2]['Accept'],
+                         'application/xml')
+
+
+class TestPaging(unittest.TestCase):
+
+    def test_iter_container(self):
+        with StubServer({'/all': paged_library(23)}) as stub:
+            server = plexdevices.device.create_device(server_data(stub))
+            items = server.iter_container('/all', page_size=10)
+            first = next(items)
+            self.assertIsInstance(first, plexdevices.media.Movie)
+            self.assertEqual(len(first.container), 10)
+            titles = [first.title] + [x.title for x in items]
+            self.assertEqual(titles, ['Item {}'.format(i) for i in range(23)])
+            starts = [x[2].get('X-Plex-Container-Start')
+                      for x in stub.requests[1:]]
+            self.assertEqual(starts, ['0', '10', '20'])
+
+    def test_iter_container_exact_pages(self):
+        with StubServer({'/all': paged_library(20)}) as stub:
+            server = plexdevices.device.create_device(server_data(stub))
+            self.assertEqual(len(list(server.iter_container('/all', 10))), 20)
+            self.assertEqual(len(stub.requests), 3)
+
+    def test_parallel_pages(self):
+        with StubServer({'/all': paged_library(45)}) as stub:
+            server = plexdevices.device.create_device(server_data(stub))
+            container = server.media_container('/all', 10, 0,
+                                               parallel_pages=3)
+            self.assertEqual([x.title for x in container.children],
+                             ['Item {}'.format(i) for i in range(45)])
+            self.assertEqual(len(stub.requests), 6)
+            container.fetch_more()
+            container.fetch_all()
+            self.assertEqual(len(container), 45)
+            self.assertEqual(len(stub.requests), 6)
+
+
+class TestReadAhead(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubServer({'/all': paged_library(30)}).__enter__()
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+        self.container = self.server.media_container('/all', 10, 0)
+        self.container.read_ahead(threshold=0.5, max_pages=2)
+
+    def tearDown(self):
+        self.stub.__exit__()
+
+    def requested_starts(self):
+        return sorted(int(x[2]['X-Plex-Container-Start'])
+                      for x in self.stub.requests[1:])
+
+    def test_prefetch(self):
+        self.container[3]
+        self.assertEqual(len(self.stub.requests), 2)
+        self.container[4]
+        self.container.fetch_more()
+        self.assertEqual(len(self.container), 20)
+        self.assertEqual(self.container[19].title, 'Item 19')
+        self.container.fetch_more()
+        self.assertEqual(len(self.container), 30)
+        self.assertEqual(self.requested_starts(), [0, 10, 20])
+
+    def test_unpaged(self):
+        container = plexdevices.media.MediaContainer(None, SAMPLE_MOVIES)
+        with self.assertRaises(ValueError):
+            container.read_ahead()
+        container = self.server.media_container('/all')
+        self.assertRaises(ValueError, container.read_ahead)
+        self.assertEqual(len(list(container)), 30)
+        container[0]
+
+    def test_cancel_when_dropped(self):
+        read_ahead = self.container._read_ahead
+        del self.container
+        gc.collect()
+        self.assertTrue(read_ahead.cancelled.is_set())
+        read_ahead.request(1)
+        self.assertEqual(len(self.stub.requests), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
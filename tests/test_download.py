@@ -0,0 +1,329 @@
+"""
+plexdevices Tests
+
+Segmented downloads against a local stand-in server.
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import plexdevices
+import plexdevices.download
+
+from .stub_server import StubServer, server_data, range_file
+
+BODY = bytes(bytearray(random.getrandbits(8) for _ in range(100000)))
+
+
+def item(i, element='Video', item_type='episode'):
+    return {'_elementType': element, 'type': item_type,
+            'ratingKey': str(i), 'key': '/library/metadata/{}'.format(i),
+            'title': 'Item {}'.format(i), '_children': [{
+                '_elementType': 'Media', '_children': [{
+                    '_elementType': 'Part', 'id': str(i),
+                    'key': '/library/parts/{}/file'.format(i),
+                    'file': '/media/{}.mkv'.format(i),
+                    'size': str(len(BODY))}]}]}
+
+
+def container(children):
+    return (200, {}, json.dumps({'_elementType': 'MediaContainer',
+                                 '_children': children}).encode())
+
+
+def slow_file(body, step=1000, delay=0.005):
+    """Like range_file, but sending ``step`` bytes every ``delay``
+    seconds."""
+    def handler(request):
+        start = int(request.headers.get('Range', 'bytes=0-')[6:].split('-')[0])
+        data = body[start:]
+        request.send_response(206)
+        request.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+            start, len(body) - 1, len(body)))
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        try:
+            for i in range(0, len(data), step):
+                request.wfile.write(data[i:i + step])
+                request.wfile.flush()
+                time.sleep(delay)
+        except (IOError, OSError):
+            request.close_connection = True
+    return handler
+
+
+class TestSegmentedDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'file.mkv')
+
+    def download(self, stub, **kwargs):
+        kwargs.setdefault('retry_backoff', 0.01)
+        url = 'http://{}:{}/file'.format(stub.address, stub.port)
+        return plexdevices.download.SegmentedDownload(url, self.path,
+                                                      **kwargs)
+
+    def ranges(self, stub):
+        """The starts of the ranges requested, leaving out the probe."""
+        return sorted(int(x[2]['Range'][6:].split('-')[0])
+                      for x in stub.requests if x[2]['Range'] != 'bytes=0-0')
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_segments(self):
+        progress = []
+        with StubServer({'/file': range_file(BODY)}) as stub:
+            download = self.download(stub, size=len(BODY), segments=4,
+                                     progress=lambda *x: progress.append(x))
+            self.assertEqual(download.run(), self.path)
+            self.assertEqual(self.ranges(stub), [0, 25000, 50000, 75000])
+        self.assertEqual(self.read(), BODY)
+        self.assertEqual(progress[-1], (len(BODY), len(BODY)))
+        self.assertEqual(os.listdir(self.directory), ['file.mkv'])
+
+    def test_probe_size(self):
+        with StubServer({'/file': range_file(BODY)}) as stub:
+            self.download(stub, segments=3).run()
+        self.assertEqual(self.read(), BODY)
+
+    def test_no_ranges(self):
+        with StubServer({'/file': range_file(BODY, ranges=False)}) as stub:
+            download = self.download(stub, segments=3)
+            download.run()
+            self.assertEqual(len(download.segments), 1)
+        self.assertEqual(self.read(), BODY)
+
+    def test_no_ranges_known_size(self):
+        with StubServer({'/file': range_file(BODY, ranges=False)}) as stub:
+            download = self.download(stub, size=len(BODY), segments=4)
+            self.assertEqual(download.run(), self.path)
+            self.assertEqual(len(download.segments), 1)
+        self.assertEqual(self.read(), BODY)
+
+    def test_cancelled_before_run(self):
+        with StubServer({'/file': range_file(BODY)}) as stub:
+            download = self.download(stub, size=len(BODY), segments=4)
+            download.cancel()
+            self.assertIsNone(download.run())
+            self.assertEqual(stub.requests, [])
+            self.assertEqual(download.run(), self.path)
+        self.assertEqual(self.read(), BODY)
+
+    def test_dropped_connections(self):
+        with StubServer({'/file': range_file(BODY, drops=6)}) as stub:
+            self.download(stub, size=len(BODY), segments=4).run()
+            self.assertEqual(len(stub.requests), 10)
+        self.assertEqual(self.read(), BODY)
+
+    def test_resume(self):
+        full = range_file(BODY)
+        dropping = range_file(BODY, drops=4, drop_after=1000)
+
+        def interrupted(request):
+            if request.headers['Range'] == 'bytes=0-0':
+                return full(request)
+            if len(request.server.requests) <= 5:
+                return dropping(request)
+            request.send_response(503)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+
+        with StubServer({'/file': interrupted}) as stub:
+            download = self.download(stub, size=len(BODY), segments=4,
+                                     max_retries=1)
+            download.chunk_size = 500
+            with self.assertRaises(plexdevices.DownloadError):
+                download.run()
+        with open(self.path + '.part.json') as f:
+            state = json.load(f)
+        self.assertEqual([x[2] - x[0] for x in state['segments']],
+                         [1000] * 4)
+        with StubServer({'/file': range_file(BODY)}) as stub:
+            self.download(stub, size=len(BODY), segments=4).run()
+            self.assertEqual(self.ranges(stub), [1000, 26000, 51000, 76000])
+        self.assertEqual(self.read(), BODY)
+        self.assertFalse(os.path.exists(self.path + '.part.json'))
+
+    def test_empty_responses(self):
+        def empty(request):
+            start = int(request.headers['Range'][6:].split('-')[0])
+            request.send_response(206)
+            request.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(BODY) - 1, len(BODY)))
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+
+        with StubServer({'/file': empty}) as stub:
+            download = self.download(stub, size=len(BODY), segments=1,
+                                     max_retries=2)
+            with self.assertRaises(plexdevices.DownloadError):
+                download.run()
+            self.assertEqual(len(stub.requests), 3)
+
+    def test_size_mismatch(self):
+        with StubServer({'/file': range_file(BODY)}) as stub:
+            with self.assertRaises(plexdevices.DownloadError):
+                self.download(stub, size=len(BODY) + 10).run()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestPartDownload(unittest.TestCase):
+
+    def test_download(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        movie = {'_elementType': 'MediaContainer', '_children': [{
+            '_elementType': 'Video', 'type': 'movie', 'ratingKey': '1',
+            'key': '/library/metadata/1', 'title': 'Movie', '_children': [{
+                '_elementType': 'Media', '_children': [{
+                    '_elementType': 'Part', 'id': '1',
+                    'key': '/library/parts/1/file.mkv',
+                    'file': '/media/Movie (2016).mkv',
+                    'size': str(len(BODY))}]}]}]}
+        with StubServer({
+            '/library/metadata/1': (200, {}, json.dumps(movie).encode()),
+            '/library/parts/1/file.mkv': range_file(BODY),
+        }) as stub:
+            server = plexdevices.device.create_device(server_data(stub))
+            item = server.media_container('/library/metadata/1').children[0]
+            path = item.media[0].parts[0].download(directory, segments=2)
+        self.assertEqual(path, os.path.join(directory, 'Movie (2016).mkv'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+
+
+class TestDownloadManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        same_name = item(5, 'Video', 'movie')
+        same_name['_children'][0]['_children'][0]['file'] = '/other/1.mkv'
+        routes = {
+            '/library/metadata/10': container([{
+                '_elementType': 'Directory', 'type': 'season',
+                'ratingKey': '10', 'key': '/library/metadata/10/children',
+                'title': 'Season 1'}]),
+            '/library/metadata/10/children': container([
+                {'_elementType': 'Directory', 'key': 'allLeaves',
+                 'title': 'All episodes'},
+                item(1), item(2), item(3)]),
+            '/library/metadata/4': container([item(4, 'Video', 'movie')]),
+            '/library/metadata/5': container([same_name]),
+        }
+        for i in range(1, 6):
+            routes['/library/parts/{}/file'.format(i)] = range_file(BODY)
+        self.stub = StubServer(routes).__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.server = plexdevices.device.create_device(server_data(self.stub))
+
+    def child(self, endpoint):
+        return self.server.media_container(endpoint).children[0]
+
+    def manager(self, **kwargs):
+        manager = plexdevices.download.DownloadManager(self.directory,
+                                                       **kwargs)
+        self.addCleanup(manager.close)
+        return manager
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            return f.read()
+
+    def test_season(self):
+        manager = self.manager()
+        season = self.child('/library/metadata/10')
+        self.assertIsInstance(season, plexdevices.media.Season)
+        tasks = manager.add(season)
+        self.assertEqual([x.path for x in tasks],
+                         [os.path.join(self.directory, '{}.mkv'.format(i))
+                          for i in (1, 2, 3)])
+        self.assertEqual(manager.add(season), [])
+        self.assertTrue(manager.wait(10))
+        self.assertEqual([x.state for x in tasks], ['done'] * 3)
+        for i in (1, 2, 3):
+            self.assertEqual(self.read('{}.mkv'.format(i)), BODY)
+
+    def test_same_file_name(self):
+        manager = self.manager()
+        manager.add(self.child('/library/metadata/10'))
+        tasks = manager.add(self.child('/library/metadata/5'))
+        self.assertEqual([x.path for x in tasks],
+                         [os.path.join(self.directory, '1 (2).mkv')])
+        self.assertEqual(manager.add(self.child('/library/metadata/5')), [])
+        self.assertTrue(manager.wait(10))
+        self.assertEqual(self.read('1 (2).mkv'), BODY)
+        self.assertEqual(self.read('1.mkv'), BODY)
+
+    def test_priority(self):
+        started = []
+
+        def progress(task):
+            if task.state == 'running' and task.path not in started:
+                started.append(task.path)
+
+        manager = self.manager(workers=1, progress=progress)
+        manager.pause()
+        manager.add(self.child('/library/metadata/10'))
+        manager.add(self.child('/library/metadata/4'), priority=1)
+        manager.resume()
+        manager.wait(10)
+        self.assertEqual([os.path.basename(x) for x in started],
+                         ['4.mkv', '1.mkv', '2.mkv', '3.mkv'])
+
+    def test_per_server(self):
+        running = []
+        lock = threading.Lock()
+
+        def progress(task):
+            with lock:
+                running.append(len([x for x in manager.tasks
+                                    if x.state == 'running']))
+
+        manager = self.manager(workers=4, per_server=2, progress=progress)
+        manager.add(self.child('/library/metadata/10'))
+        manager.add(self.child('/library/metadata/4'))
+        manager.wait(10)
+        self.assertLessEqual(max(running), 2)
+
+    def test_bandwidth(self):
+        manager = self.manager(bandwidth=len(BODY) * 3)
+        start = time.time()
+        manager.add(self.child('/library/metadata/10'))
+        manager.wait(10)
+        self.assertGreater(time.time() - start, 0.6)
+
+    def test_pause(self):
+        self.stub.routes['/library/parts/4/file'] = slow_file(BODY)
+        chunk_size = plexdevices.download.SegmentedDownload.chunk_size
+        plexdevices.download.SegmentedDownload.chunk_size = 1000
+        self.addCleanup(setattr, plexdevices.download.SegmentedDownload,
+                        'chunk_size', chunk_size)
+        manager = self.manager()
+        task, = manager.add(self.child('/library/metadata/4'))
+        time.sleep(0.15)
+        manager.pause()
+        self.assertFalse(manager.wait(0.3))
+        self.assertEqual(task.state, 'queued')
+        self.assertGreater(task.downloaded, 0)
+        self.assertLess(task.downloaded, len(BODY))
+        manager.resume()
+        self.assertTrue(manager.wait(10))
+        self.assertEqual(self.read('4.mkv'), BODY)
+        ranges = [x[2]['Range'] for x in self.stub.requests
+                  if x[1].startswith('/library/parts/4/')]
+        self.assertEqual(len(ranges), 2)
+        self.assertNotEqual(ranges[1], ranges[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,347 @@
+"""
+plexdevices Tests
+
+Containers and their items.
+"""
+import gc
+import pickle
+import unittest
+import unittest.mock
+import weakref
+
+import plexdevices
+
+from .xml_samples import SAMPLE_MOVIES, HUB_SEARCH
+
+
+#: stands in for the server of the containers made by container().
+SERVER = unittest.mock.Mock(client_identifier='mock')
+
+
+def container(count, unknown=0):
+    items = [{'_elementType': 'Video', 'type': 'movie', 'title': str(i),
+              'ratingKey': str(i), '_children': [
+                  {'_elementType': 'Media', 'id': str(i), '_children': [
+                      {'_elementType': 'Part', 'id': str(i)}]}]}
+             for i in range(count)]
+    items[1:1] = [{'_elementType': 'Unknown'}] * unknown
+    return plexdevices.media.MediaContainer(
+        SERVER, {'_elementType': 'MediaContainer',
+                               'totalSize': str(count), '_children': items})
+
+
+class TestLazyChildren(unittest.TestCase):
+
+    def test_len_builds_nothing(self):
+        c = container(1000)
+        self.assertEqual(len(c), 1000)
+        self.assertEqual(c.children.built, 0)
+
+    def test_index_builds_once(self):
+        c = container(10)
+        item = c.children[3]
+        self.assertIsInstance(item, plexdevices.media.Movie)
+        self.assertIs(item.container, c)
+        self.assertIs(c.children[3], item)
+        self.assertIs(c.children[-7], item)
+        self.assertEqual(c.children.built, 1)
+        self.assertRaises(IndexError, lambda: c.children[10])
+
+    def test_slice(self):
+        c = container(10)
+        items = c.children[2:8:2]
+        self.assertEqual([x.title for x in items], ['2', '4', '6'])
+        self.assertEqual(c.children.built, 3)
+        self.assertIs(c.children[4], items[1])
+
+    def test_unknown_children_skipped(self):
+        c = container(5, unknown=2)
+        self.assertEqual(len(c), 5)
+        self.assertEqual([x.title for x in c], ['0', '1', '2', '3', '4'])
+
+    def test_extend_keeps_owner(self):
+        first, second = container(3), container(2)
+        first.children += second.children
+        self.assertEqual(len(first), 5)
+        self.assertEqual(first.children.built, 0)
+        self.assertIs(first.children[4].container, second)
+        self.assertEqual(first.children[4], second.children[1])
+
+    def test_list_operations(self):
+        c = container(4)
+        item = plexdevices.media.MediaContainer(
+            None, SAMPLE_MOVIES).children[0]
+        self.assertNotIn(item, c.children)
+        c.children.append(item)
+        self.assertIn(item, c.children)
+        self.assertEqual(c.children.index(item), 4)
+        self.assertEqual(c.children.index(c.children[2]), 2)
+        self.assertEqual(c.children, list(c.children))
+        self.assertRaises(ValueError, c.children.index, 'x')
+
+    def test_lookups_build_candidates_only(self):
+        c = container(10)
+        item = container(10).children[7]
+        self.assertIn(item, c.children)
+        self.assertEqual(c.children.index(item), 7)
+        self.assertEqual(c.children.count(item), 1)
+        self.assertEqual(c.children.built, 1)
+        self.assertRaises(ValueError, c.children.index, item, 0, 7)
+
+    def test_mutable_sequence(self):
+        c = container(6)
+        children = c.children
+        self.assertIsInstance(children, plexdevices.compat.MutableSequence)
+        children.reverse()
+        self.assertEqual(children.built, 0)
+        del children[0]
+        del children[-2:]
+        self.assertEqual(children.built, 0)
+        self.assertEqual([x.title for x in children], ['4', '3', '2'])
+        children.sort(key=lambda x: x.title)
+        self.assertEqual([x.title for x in children], ['2', '3', '4'])
+        extra = container(8).children[6:8]
+        children.insert(0, extra[0])
+        children[1] = extra[1]
+        self.assertEqual([x.title for x in children], ['6', '7', '3', '4'])
+        self.assertEqual(children.pop().title, '4')
+        children.remove(extra[0])
+        children[1:] = extra
+        self.assertEqual([x.title for x in children], ['7', '6', '7'])
+        self.assertRaises(IndexError, children.__setitem__, 9, extra[0])
+        self.assertRaises(ValueError, children.__setitem__, slice(None, None, 2), [])
+        self.assertEqual(len(children), 3)
+
+    def test_add(self):
+        first, second = container(2).children, container(3).children
+        both = first + second
+        self.assertIsInstance(both, plexdevices.media.LazyChildren)
+        self.assertEqual((len(both), both.built), (5, 0))
+        self.assertEqual(len(first), 2)
+        extra = [second[0]]
+        self.assertEqual([x.title for x in first + extra], ['0', '1', '0'])
+        self.assertEqual([x.title for x in extra + first], ['0', '0', '1'])
+
+    def test_media_and_parts_lazy(self):
+        item = container(1).children[0]
+        self.assertIsNone(item._media)
+        self.assertEqual(item.media[0].parts[0].id, 0)
+        self.assertIs(item.media, item.media)
+        self.assertIs(item.media[0].parts, item.media[0].parts)
+
+    def test_hub_children(self):
+        c = plexdevices.hubs.HubsContainer(None, HUB_SEARCH)
+        hub = next(h for h in c if len(h.children))
+        self.assertEqual(hub.children.built, 0)
+        item = hub.children[0]
+        self.assertIs(item.hub, hub)
+        self.assertIs(item.container, c)
+        self.assertIsInstance(item, plexdevices.hubs.HubsItemBase)
+
+
+class TestCompact(unittest.TestCase):
+
+    def test_items_take_attributes(self):
+        item = container(1).children[0]
+        for obj in (item, item.media[0], item.media[0].parts[0],
+                    plexdevices.device.Connection({})):
+            obj.note = 'mine'
+            self.assertEqual(obj.note, 'mine')
+
+    def test_compact_server(self):
+        server = plexdevices.device.create_device({
+            'provides': 'server', '_children': []})
+        server.compact = True
+        data = plexdevices.utils.parse_response(SAMPLE_MOVIES)
+        compacted = plexdevices.media.MediaContainer(
+            server, server._compact(data))
+        plain = plexdevices.media.MediaContainer(None, data)
+        item = compacted.children[0]
+        self.assertIsInstance(item.data, plexdevices.utils.CompactDict)
+        self.assertEqual(item, plain.children[0])
+        self.assertEqual(item.title, plain.children[0].title)
+        self.assertEqual(item.media[0].parts[0].key,
+                         plain.children[0].media[0].parts[0].key)
+        item.view_offset = 10
+        self.assertEqual(item.view_offset, 10)
+
+
+class TestFactory(unittest.TestCase):
+
+    def tearDown(self):
+        plexdevices.factory._registry.clear()
+        plexdevices.factory._index = None
+
+    def test_classes(self):
+        media, t = plexdevices.media, plexdevices.factory.media_factory
+        cases = [
+            ({'_elementType': 'Directory', 'type': 'season', 'ratingKey': '1'},
+             media.Season),
+            ({'_elementType': 'Directory', 'type': 'season'}, media.Directory),
+            ({'_elementType': 'Directory', 'type': 'photo', 'ratingKey': '1'},
+             media.PhotoAlbum),
+            ({'_elementType': 'Directory', 'settings': '1'},
+             media.PreferencesDirectory),
+            ({'_elementType': 'Directory', 'search': '1'}, media.InputDirectory),
+            ({'_elementType': 'Directory', 'type': 'other'}, media.Directory),
+            ({'_elementType': 'Video', 'type': 'movie'}, media.Movie),
+            ({'_elementType': 'Track', 'type': 'track'}, media.Track),
+            ({'_elementType': 'Video', 'type': 'clip'}, media.VideoClip),
+            ({'_elementType': 'Video', 'type': 'other'}, None),
+            ({'_elementType': 'Hub', 'type': 'movie'}, plexdevices.hubs.Hub),
+            ({'_elementType': 'Genre', 'tag': 'Drama'}, None),
+        ]
+        for data, cls in cases:
+            self.assertIs(t(data), cls, data)
+
+    def test_register(self):
+        class MyMovie(plexdevices.media.Movie):
+            pass
+
+        plexdevices.factory.register(MyMovie, 'Video',
+                                     plexdevices.types.PlexType.MOVIE)
+        plexdevices.factory.register(plexdevices.media.Directory, 'Playlist')
+        c = plexdevices.media.MediaContainer(None, SAMPLE_MOVIES)
+        self.assertIsInstance(c.children[0], MyMovie)
+        self.assertIs(plexdevices.factory.media_factory(
+            {'_elementType': 'Playlist', 'type': 'playlist'}),
+            plexdevices.media.Directory)
+        self.assertIs(plexdevices.factory.media_factory(
+            {'_elementType': 'Directory', 'type': 'show', 'ratingKey': '1'}),
+            plexdevices.media.Show)
+
+    def test_register_replaces_builtin(self):
+        class MySeason(plexdevices.media.Season):
+            pass
+
+        plexdevices.factory.register(MySeason, 'Directory',
+                                     plexdevices.types.PlexType.SEASON)
+        data = {'_elementType': 'Directory', 'type': 'season'}
+        self.assertIs(plexdevices.factory.media_factory(
+            dict(data, ratingKey='1')), MySeason)
+        self.assertIs(plexdevices.factory.media_factory(data), MySeason)
+        plexdevices.factory.register(plexdevices.media.Season, 'Directory',
+                                     plexdevices.types.PlexType.SEASON,
+                                     rating_key=True)
+        self.assertIs(plexdevices.factory.media_factory(
+            dict(data, ratingKey='1')), plexdevices.media.Season)
+        self.assertIs(plexdevices.factory.media_factory(data), MySeason)
+
+
+class TestHubItemClasses(unittest.TestCase):
+
+    def test_shared_and_picklable(self):
+        first = plexdevices.hubs.HubsContainer(None, HUB_SEARCH)
+        second = plexdevices.hubs.HubsContainer(None, HUB_SEARCH)
+        items = [i for c in (first, second) for h in c for i in h.children]
+        classes = set(type(i) for i in items)
+        self.assertLess(len(classes), len(items))
+        self.assertEqual(len(classes),
+                         len(set(type(i).__bases__[0] for i in items)))
+        copy = pickle.loads(pickle.dumps(items[0]))
+        self.assertIs(type(copy), type(items[0]))
+        self.assertEqual(copy, items[0])
+        self.assertEqual(copy.hub.title, items[0].hub.title)
+
+
+class TestSharedItems(unittest.TestCase):
+
+    def setUp(self):
+        self.server = plexdevices.device.create_device({
+            'provides': 'server', '_children': []})
+        self.server.share_items = True
+
+    def hub_item(self, data):
+        return plexdevices.hubs.HubsContainer(self.server, {
+            '_elementType': 'MediaContainer', '_children': [
+                {'_elementType': 'Hub', 'type': 'movie', '_children': [data]}]
+        }).children[0].children[0]
+
+    def test_shared_between_containers(self):
+        first = plexdevices.media.MediaContainer(self.server, SAMPLE_MOVIES)
+        second = plexdevices.media.MediaContainer(self.server, SAMPLE_MOVIES)
+        self.assertIs(first.children[0], second.children[0])
+        self.assertIs(first.children[0].container, second)
+        self.assertEqual(len(set(first.children) | set(second.children)),
+                         len(first))
+        first.children[0].view_offset = 1000
+        self.assertEqual(second.children[0].view_offset, 1000)
+
+    def test_updated_and_data_shared(self):
+        item = container(1).children[0]
+        data = dict(item.data, title='Renamed')
+        movie = plexdevices.media.MediaContainer(self.server, {
+            '_elementType': 'MediaContainer', '_children': [dict(item.data)]
+        }).children[0]
+        hub_item = self.hub_item(data)
+        self.assertIsNot(hub_item, movie)
+        self.assertIs(hub_item.data, movie.data)
+        self.assertEqual(movie.title, 'Renamed')
+        self.assertEqual(hub_item.hub.type, plexdevices.types.PlexType.MOVIE)
+
+    def test_stale_values_removed(self):
+        data = dict(container(1).children[0].data, viewOffset='1000')
+        first = plexdevices.media.MediaContainer(self.server, {
+            '_elementType': 'MediaContainer', '_children': [data]})
+        item = first.children[0]
+        self.assertTrue(item.in_progress)
+        data = dict(data, lastViewedAt='1500000000')
+        del data['viewOffset']
+        second = plexdevices.media.MediaContainer(self.server, {
+            '_elementType': 'MediaContainer', '_children': [data]})
+        self.assertIs(second.children[0], item)
+        self.assertNotIn('viewOffset', item.data)
+        self.assertFalse(item.in_progress)
+        self.assertTrue(item.watched)
+
+    def test_container_rebound(self):
+        first = plexdevices.media.MediaContainer(self.server, SAMPLE_MOVIES)
+        item = first.children[0]
+        self.assertIs(item.container, first)
+        data = dict(item.data)
+        data.pop('art', None)
+        second = plexdevices.media.MediaContainer(self.server, {
+            '_elementType': 'MediaContainer', 'art': '/second/art',
+            '_children': [data]})
+        self.assertIs(second.children[0], item)
+        self.assertIs(item.container, second)
+        self.assertEqual(item.art, '/second/art')
+        first = weakref.ref(first)
+        gc.collect()
+        self.assertIsNone(first())
+
+    def test_play_queue_items_not_shared(self):
+        data = container(1).children[0].data
+        entries = [dict(data, playQueueItemID=str(i)) for i in range(2)]
+        queue = plexdevices.media.MediaContainer(self.server, {
+            '_elementType': 'MediaContainer', '_children': entries})
+        self.assertIsNot(queue.children[0], queue.children[1])
+        self.assertNotEqual(queue.children[0], queue.children[1])
+        self.assertEqual(queue.children.index(queue.children[1]), 1)
+
+    def test_other_servers_differ(self):
+        other = plexdevices.device.create_device({
+            'provides': 'server', 'clientIdentifier': 'other',
+            '_children': []})
+        first = plexdevices.media.MediaContainer(self.server, SAMPLE_MOVIES)
+        second = plexdevices.media.MediaContainer(other, SAMPLE_MOVIES)
+        self.assertNotEqual(first.children[0], second.children[0])
+        self.assertEqual(len(set(first.children) | set(second.children)),
+                         2 * len(first))
+        self.assertNotIn(second.children[0], first.children)
+
+    def test_weak(self):
+        c = plexdevices.media.MediaContainer(self.server, SAMPLE_MOVIES)
+        list(c)
+        self.assertTrue(len(self.server.items))
+        del c
+        gc.collect()
+        self.assertEqual(len(self.server.items), 0)
+
+    def test_not_shared_by_default(self):
+        self.server.share_items = False
+        first = plexdevices.media.MediaContainer(self.server, SAMPLE_MOVIES)
+        second = plexdevices.media.MediaContainer(self.server, SAMPLE_MOVIES)
+        self.assertIsNot(first.children[0], second.children[0])
+        self.assertEqual(first.children[0], second.children[0])
+        self.assertEqual(hash(first.children[0]), hash(second.children[0]))
@@ -0,0 +1,209 @@
+"""
+plexdevices Tests
+
+Parsing helpers.
+"""
+import os
+import pickle
+import unittest
+import xml.etree.ElementTree as ET
+
+import plexdevices
+import plexdevices.jsonlib
+import plexdevices.utils
+
+from .xml_samples import SAMPLE_MOVIES, HUB_SEARCH
+
+
+class TestParseXml(unittest.TestCase):
+
+    def test_shape(self):
+        data = plexdevices.utils.parse_xml(ET.fromstring(
+            '<MediaContainer size="1"><Video title="A"><Media id="1">'
+            '<Part id="2"/></Media></Video><Directory/></MediaContainer>'))
+        self.assertEqual(data, {
+            '_elementType': 'MediaContainer', 'size': '1', '_children': [
+                {'_elementType': 'Video', 'title': 'A', '_children': [
+                    {'_elementType': 'Media', 'id': '1', '_children': [
+                        {'_elementType': 'Part', 'id': '2'}]}]},
+                {'_elementType': 'Directory'}]})
+
+    def test_document_matches_tree(self):
+        for sample in (SAMPLE_MOVIES, HUB_SEARCH):
+            tree = plexdevices.utils.parse_xml(
+                ET.fromstring(sample.encode('utf-8')))
+            self.assertEqual(plexdevices.utils.parse_xml_document(sample),
+                             tree)
+            self.assertEqual(plexdevices.utils.parse_xml_document(
+                sample.encode('utf-8')), tree)
+
+    def test_deep(self):
+        depth = 5000
+        xml = '<a>' * depth + '</a>' * depth
+        for data in (plexdevices.utils.parse_xml(ET.fromstring(xml)),
+                     plexdevices.utils.parse_xml_document(xml)):
+            for _ in range(depth - 1):
+                data = data['_children'][0]
+            self.assertNotIn('_children', data)
+
+
+class TestParseResponse(unittest.TestCase):
+
+    def test_content_type(self):
+        parse = plexdevices.utils.parse_response
+        self.assertEqual(parse(b'{"size": "1"}', 'application/json'),
+                         {'size': '1'})
+        data = parse(SAMPLE_MOVIES.encode('utf-8'), 'text/xml;charset=utf-8')
+        self.assertEqual(data['_elementType'], 'MediaContainer')
+        with self.assertRaises(plexdevices.ParseError):
+            parse(b'<MediaContainer/>', 'application/json')
+
+    def test_sniff(self):
+        parse = plexdevices.utils.parse_response
+        self.assertEqual(parse(u'  {"a": 1}'), {'a': 1})
+        self.assertEqual(parse(b'<Response code="1"/>', 'text/plain'),
+                         {'_elementType': 'Response', 'code': '1',
+                          'totalSize': 1})
+        self.assertEqual(parse(b''), {})
+        self.assertEqual(parse(b'  \n', 'application/json'), {})
+
+    def test_malformed(self):
+        for body, content_type in ((b'{"a": ', None), (b'<a><b></a>', None),
+                                   (b'<html', 'text/html'),
+                                   (b'Not Found', None)):
+            with self.assertRaises(ValueError) as cm:
+                plexdevices.utils.parse_response(body, content_type)
+            self.assertIsInstance(cm.exception, plexdevices.ParseError)
+            self.assertEqual(cm.exception.body, body)
+            self.assertIn('response', str(cm.exception))
+
+
+class TestInternTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = plexdevices.utils.strings
+        plexdevices.utils.strings = plexdevices.utils.InternTable(max_values=4)
+
+    def tearDown(self):
+        plexdevices.utils.strings = self.table
+
+    def test_shared_between_parses(self):
+        a = plexdevices.utils.parse_response(SAMPLE_MOVIES.encode('utf-8'))
+        b = plexdevices.utils.parse_xml(ET.fromstring(SAMPLE_MOVIES))
+        x, y = a['_children'][0], b['_children'][0]
+        self.assertEqual(a, b)
+        self.assertIs(x['type'], y['type'])
+        self.assertIs(x['_elementType'], y['_elementType'])
+        self.assertIs([k for k in x if k == 'ratingKey'][0],
+                      [k for k in y if k == 'ratingKey'][0])
+
+    def test_high_cardinality_not_shared(self):
+        table = plexdevices.utils.strings
+        for i in range(10):
+            table.value(table.key('ratingKey'), str(i))
+        self.assertIsNone(table._values['ratingKey'])
+        value = ''.join(['1', '2'])
+        self.assertIs(table.value('ratingKey', value), value)
+        long_value = 'x' * 100
+        self.assertIs(table.value(table.key('summary'), long_value),
+                      long_value)
+        self.assertEqual(table._values['summary'], {})
+
+    def test_json(self):
+        body = plexdevices.jsonlib.dumps({'_children': [
+            {'type': 'movie', 'size': 1}, {'type': 'movie', 'size': 2}]})
+        data = plexdevices.utils.parse_response(body, 'application/json')
+        first, second = data['_children']
+        self.assertIs(first['type'], second['type'])
+        self.assertIs([k for k in first if k == 'size'][0],
+                      [k for k in second if k == 'size'][0])
+        self.assertIs([k for k in first if k == 'size'][0],
+                      plexdevices.utils.strings.key('size'))
+        self.assertEqual(second['size'], 2)
+
+    def test_disabled(self):
+        self.assertIsNone(self.table)
+        plexdevices.utils.strings = None
+        data = plexdevices.utils.parse_response(SAMPLE_MOVIES)
+        self.assertEqual(data['_children'][0]['type'], 'movie')
+
+
+class TestCompactDict(unittest.TestCase):
+
+    def test_mapping(self):
+        d = plexdevices.utils.CompactDict({'a': 1, 'b': 2})
+        self.assertEqual(d, {'a': 1, 'b': 2})
+        self.assertEqual((d['a'], d.get('c'), d.get('c', 3)), (1, None, 3))
+        self.assertIn('b', d)
+        self.assertRaises(KeyError, lambda: d['c'])
+        d['a'] = 4
+        d['c'] = 5
+        del d['b']
+        self.assertEqual(list(d.items()), [('a', 4), ('c', 5)])
+        self.assertEqual(d.pop('c'), 5)
+        self.assertEqual(pickle.loads(pickle.dumps(d)), {'a': 4})
+
+    def test_layout_shared(self):
+        a = plexdevices.utils.CompactDict({'x': 1, 'y': 2})
+        b = plexdevices.utils.CompactDict({'x': 3, 'y': 4})
+        self.assertIs(a._layout, b._layout)
+        a['z'] = 0
+        b['z'] = 0
+        self.assertIs(a._layout, b._layout)
+
+    def test_compact_tree(self):
+        data = plexdevices.utils.parse_response(SAMPLE_MOVIES)
+        compacted = plexdevices.utils.compact(data)
+        self.assertEqual(compacted, data)
+        item = compacted['_children'][0]
+        self.assertIsInstance(item, plexdevices.utils.CompactDict)
+        self.assertIsInstance(item['_children'][0],
+                              plexdevices.utils.CompactDict)
+        streamed = plexdevices.utils.compact(
+            {'_children': iter(data['_children'])})
+        self.assertEqual(list(streamed['_children']), data['_children'])
+
+
+class TestJsonBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, plexdevices.jsonlib, '_backend',
+                        plexdevices.jsonlib._backend)
+        environ = os.environ.get(plexdevices.jsonlib.ENV_VAR)
+        if environ is None:
+            self.addCleanup(os.environ.pop, plexdevices.jsonlib.ENV_VAR, None)
+        else:
+            self.addCleanup(os.environ.__setitem__,
+                            plexdevices.jsonlib.ENV_VAR, environ)
+
+    def test_override(self):
+        backend = plexdevices.jsonlib.use('json')
+        self.assertIs(plexdevices.jsonlib.backend(), backend)
+        self.assertEqual(plexdevices.utils.parse_response(b'{"a": [1]}'),
+                         {'a': [1]})
+        self.assertEqual(plexdevices.jsonlib.loads(
+            plexdevices.jsonlib.dumps({'a': 1})), {'a': 1})
+        with self.assertRaises(ValueError):
+            plexdevices.jsonlib.use('yaml')
+
+    def test_environment(self):
+        plexdevices.jsonlib._backend = None
+        os.environ[plexdevices.jsonlib.ENV_VAR] = 'json'
+        self.assertEqual(plexdevices.jsonlib.backend().name, 'json')
+        plexdevices.jsonlib._backend = None
+        os.environ[plexdevices.jsonlib.ENV_VAR] = 'missing'
+        self.assertEqual(plexdevices.jsonlib.backend().name,
+                         plexdevices.jsonlib.available()[0].name)
+
+    def test_backends_agree(self):
+        body = SAMPLE_MOVIES.encode('utf-8')
+        expected = plexdevices.utils.parse_xml_document(body)
+        encoded = plexdevices.jsonlib.load_backend('json').dumps(expected)
+        for backend in plexdevices.jsonlib.available():
+            self.assertEqual(backend.loads(encoded.encode('utf-8')), expected)
+            with self.assertRaises(ValueError):
+                backend.loads(b'{"a": ')
+
+
+if __name__ == "__main__":
+    unittest.main()